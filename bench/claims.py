@@ -0,0 +1,145 @@
+# Check the work queue's leases and the reply claims that several copies of the bot share
+#
+# Two "workers" (two WorkQueues, or two names claiming in one RepliedStore) use the same state database:
+# a lease or claim is only ever held by one of them, extending a lease keeps it, and one that runs out goes
+# to the other. Then the bot itself, against the fakes: a worker that takes over a claim from one that died
+# just after posting (a submission reply, or a comment reply) finds that reply and doesn't post another,
+# and a long check of a submission keeps extending its lease so nobody else leases it meanwhile.
+#
+#   python bench/claims.py
+
+import argparse
+import os
+import sys
+import tempfile
+import shutil
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.insert(0, here)
+
+from workqueue import WorkQueue
+from store import RepliedStore
+import fakes
+import run
+
+lease = 0.5 # seconds (short, so leases and claims run out while we wait)
+
+def check(name, ok, detail='') :
+	print(('ok    ' if ok else 'FAILED') + ' ' + name + (': ' + detail if detail else ''))
+	return ok
+
+def checkLeases(path) :
+	results = []
+	a = WorkQueue(path, lease=lease, worker='a')
+	b = WorkQueue(path, lease=lease, worker='b')
+	a.put('submission:1', 'submission', '1')
+	item = a.lease()
+	results.append(check('lease', item is not None and item.key == 'submission:1' and b.lease() is None, 'only one worker gets the item'))
+
+	for _ in range(3) : # longer than the lease, all told, but extended as we go
+		time.sleep(lease * 0.6)
+		a.extend(item)
+	results.append(check('extend', b.lease() is None, 'an extended lease stays ours'))
+
+	time.sleep(lease * 1.2)
+	taken = b.lease()
+	results.append(check('expire', taken is not None and taken.key == 'submission:1' and taken.attempts == 2, 'a lease that runs out goes to the next worker'))
+	results.append(check('lost', not a.extend(item) and not a.ack(item) and b.ack(taken), 'the first worker can no longer extend or ack it'))
+
+	a.put('submission:1', 'submission', '1', delay=60)
+	results.append(check('requeue', a.lease() is None and a.stats()['states'].get('queued') == 1, 'a done item can be queued again, for later'))
+	return results
+
+def checkClaims(path) :
+	results = []
+	a = RepliedStore(path)
+	b = RepliedStore(path)
+	results.append(check('claim', a.claim('x', 'a', lease) and not b.claim('x', 'b', lease) and a.claim('x', 'a', lease), 'only one worker holds a claim (and can renew it)'))
+
+	time.sleep(lease * 1.2)
+	results.append(check('take over', b.claim('x', 'b', lease) and b.tookOver('x') and not b.tookOver('x'), "a claim that runs out can be taken over, and we're told so (once)"))
+
+	b.add('x')
+	results.append(check('replied', not a.claim('x', 'a', lease) and 'x' in RepliedStore(path), 'nobody can claim something that has been replied to'))
+
+	a.claim('y', 'a', lease)
+	a.unclaim('y', 'a')
+	results.append(check('unclaim', b.claim('y', 'b', lease) and not b.tookOver('y'), "giving up a claim lets someone else have it straight away (and that's not a take over)"))
+	return results
+
+# the bot itself, against the fakes
+def checkBot(workdir) :
+	results = []
+	args = argparse.Namespace(latency=0.0, subreddits=1, submissions=3, log_level='ERROR')
+	main, internet = run.setUp(args, workdir)
+	try:
+		counters = fakes.Counters()
+		main._reddit = reddit = fakes.FakeReddit(counters)
+		tweets = fakes.makeScenario(reddit, list(main.subreddits)[0], num_submissions=3, big_thread=10, comments_per_thread=5)
+		main._twitter = fakes.FakeTwitter(counters, tweets)
+		main._imgur = fakes.FakeImgur(counters)
+		main._gfycat = fakes.FakeGfycat(counters)
+		link = 'https://twitter.com/Vikings/status/' + next(iter(tweets))
+
+		# a submission: our list of our own comments is from before the dead worker posted
+		s = fakes.FakeSubmission(reddit, 'sub1', 'a tweet', link, time.time())
+		main.ownReply(s)
+		main.replied.claim(s.id, 'dead', -1) # (a claim that's already run out)
+		s.reply('an earlier reply')
+		before = len(reddit.posted)
+		main.replyToSubmission(s)
+		results.append(check('submission take over', len(reddit.posted) == before and s.id in main.replied, 'found the reply the dead worker posted'))
+		s = fakes.FakeSubmission(reddit, 'sub2', 'a tweet', link, time.time())
+		main.replied.claim(s.id, 'dead', -1)
+		before = len(reddit.posted)
+		main.replyToSubmission(s)
+		results.append(check('submission take over, no reply', len(reddit.posted) == before + 1, 'replied, since the dead worker never had'))
+
+		# a comment
+		comment = fakes.FakeComment(reddit, 'com1', link, s, time.time())
+		comment.top_level = True
+		key = main.commentTweetKey(comment.id, link)
+		main.replied.claim(key, 'dead', -1)
+		comment.reply('an earlier reply')
+		before = len(reddit.posted)
+		main.replyToComment(comment, [link], {})
+		results.append(check('comment take over', len(reddit.posted) == before and key in main.replied, 'found the reply the dead worker posted'))
+
+		# a check of a submission that takes three leases' worth of time, making progress as it goes
+		queue = WorkQueue(os.environ['STATE_DB'], lease=lease, worker='a')
+		other = WorkQueue(os.environ['STATE_DB'], lease=lease, worker='b')
+		s = list(reddit.subreddits.values())[0]._submissions[0]
+		queue.put('submission:' + s.id, 'submission', s.id)
+		item = queue.lease()
+		stolen = []
+		def slowCheck(s, url_finder, comments=True, progress=None) :
+			for _ in range(6) :
+				time.sleep(lease / 2)
+				progress()
+				stolen.append(other.lease())
+			return 0
+		checkSubmission = main.checkSubmission
+		main.checkSubmission = slowCheck
+		try:
+			main.doWork(item, queue, None)
+		finally:
+			main.checkSubmission = checkSubmission
+		results.append(check('long check', not any(stolen) and queue.stats()['states'].get('done') == 1, 'the lease was extended as the check went, and acked at the end'))
+	finally:
+		internet.stop()
+	return results
+
+def main() :
+	workdir = tempfile.mkdtemp(prefix='fleetflot-claims-')
+	try:
+		results = checkLeases(os.path.join(workdir, 'leases.db'))
+		results += checkClaims(os.path.join(workdir, 'claims.db'))
+		results += checkBot(os.path.join(workdir, 'bot'))
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+	sys.exit(0 if all(results) else 1)
+
+if __name__ == '__main__' :
+	main()
@@ -0,0 +1,451 @@
+# Local stand-ins for everything the bot talks to, for benchmarking without touching the internet
+#
+# Reddit, Twitter, Imgur and Gfycat are faked at the client level (objects that look enough like
+# praw/tweepy/imgurpython/gfypy for main.py), each call sleeping for a configurable latency.
+# Everything that goes over plain HTTP (following shortlinks, streamable, downloading gifs) goes
+# through FakeInternet, a little local HTTP proxy that pretends to be bit.ly, twitter.com, streamable etc.
+#
+# The synthetic subreddit is generated from a seed, so the same scenario is exactly the same every run.
+
+import http.server
+import threading
+import urllib.parse
+import random
+import time
+import json
+import collections
+import praw.models
+import praw.exceptions
+
+# what the shortlinks in the scenario point to is encoded in the link itself, so the fake internet
+# doesn't need to know anything about the scenario:
+#   http://bit.ly/t<id>   -> http://twitter.com/vikings/status/<id>
+#   http://bit.ly/m<id>   -> http://mnvkn.gs/t<id> -> http://twitter.com/vikings/status/<id>
+#   http://bit.ly/x<n>    -> http://www.vikings.com/news/<n>
+shorteners = ('bit.ly', 't.co', 'mnvkn.gs')
+
+class Counters :
+	def __init__(self) :
+		self.lock = threading.Lock()
+		self.calls = collections.Counter()
+
+	def count(self, name, n=1) :
+		with self.lock :
+			self.calls[name] += n
+
+########-------- HTTP --------########
+
+class FakeInternet :
+	# latency is how many seconds every request takes; gif_bytes is how big each fake gif is
+	def __init__(self, counters, latency=0.0, gif_bytes=256*1024, streamable_polls=1) :
+		self.counters = counters
+		self.latency = latency
+		self.gif_bytes = gif_bytes
+		self.streamable_polls = streamable_polls # how many times a video has to be checked on before it's ready
+		self.polls = collections.Counter()
+		self.server = None
+
+	def start(self) :
+		internet = self
+		class Handler(http.server.BaseHTTPRequestHandler) :
+			protocol_version = 'HTTP/1.1' # keep-alive, like the real thing
+
+			def do_HEAD(self) :
+				internet.handle(self, head=True)
+
+			def do_GET(self) :
+				internet.handle(self, head=False)
+
+			def log_message(self, *args) :
+				pass
+
+		self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+		self.server.daemon_threads = True
+		threading.Thread(target=self.server.serve_forever, name='fake-internet', daemon=True).start()
+		return self
+
+	def stop(self) :
+		self.server.shutdown()
+		self.server.server_close()
+
+	@property
+	def proxy(self) :
+		return 'http://127.0.0.1:' + str(self.server.server_port)
+
+	def handle(self, request, head) :
+		if self.latency :
+			time.sleep(self.latency)
+		url = urllib.parse.urlsplit(request.path) # as a proxy, we get the whole url
+		host = url.hostname or request.headers.get('Host', '')
+		path = url.path
+		self.counters.count('http ' + host)
+
+		if host in shorteners :
+			code = path.strip('/')
+			if code.startswith('t') :
+				return self.respond(request, head, 301, location='http://twitter.com/vikings/status/' + code[1:])
+			if code.startswith('m') :
+				return self.respond(request, head, 301, location='http://mnvkn.gs/t' + code[1:])
+			if code.startswith('x') :
+				return self.respond(request, head, 301, location='http://www.vikings.com/news/' + code[1:])
+			return self.respond(request, head, 404)
+
+		if host == 'api.streamable.com' :
+			if path == '/import' :
+				source = urllib.parse.parse_qs(url.query).get('url', [''])[0]
+				return self.respond(request, head, 200, body={'shortcode' : 'v' + str(abs(hash(source)) % 10**8)})
+			if path.startswith('/videos/') :
+				shortcode = path.split('/')[-1]
+				self.polls[shortcode] += 1
+				if self.polls[shortcode] >= self.streamable_polls :
+					files = {'mp4' : {'url' : '//cdn.streamable.com/' + shortcode + '.mp4'}, 'mp4-mobile' : {'url' : '//cdn.streamable.com/' + shortcode + '-mobile.mp4'}}
+					return self.respond(request, head, 200, body={'status' : 2, 'files' : files})
+				return self.respond(request, head, 200, body={'status' : 1, 'files' : {}})
+			return self.respond(request, head, 404)
+
+		if host == 'video.twimg.com' :
+			return self.respond(request, head, 200, raw=b'\0' * self.gif_bytes, content_type='video/mp4')
+
+		return self.respond(request, head, 200, raw=b'<html></html>', content_type='text/html') # any other page just exists
+
+	def respond(self, request, head, status, location=None, body=None, raw=None, content_type='application/json') :
+		if body is not None :
+			raw = json.dumps(body).encode('utf-8')
+		raw = raw or b''
+		request.send_response(status)
+		if location is not None :
+			request.send_header('Location', location)
+		request.send_header('Content-Type', content_type)
+		request.send_header('Content-Length', str(len(raw)))
+		request.end_headers()
+		if not head :
+			request.wfile.write(raw)
+
+########-------- Reddit --------########
+
+class FakeAuthor :
+	def __init__(self, name) :
+		self.name = name
+
+class FakeComment :
+	def __init__(self, reddit, id, body, submission, created_utc, author='someone') :
+		self._reddit = reddit
+		self.id = id
+		self.body = body
+		self.submission = submission
+		self.created_utc = created_utc
+		self.author = FakeAuthor(author)
+		self.replies = [] # (the fake threads are flat)
+
+	@property
+	def is_root(self) :
+		return self.top_level
+
+	def reply(self, body) :
+		return self._reddit.post(self, body)
+
+	def refresh(self) :
+		self._reddit.call('comment')
+		self.replies = [comment for comment in self._reddit.posted if getattr(comment, 'parent', None) is self]
+		return self
+
+	def edit(self, body) :
+		self._reddit.call('edit')
+		self.body = body
+
+# a comment that isn't there (say one posted in an earlier run, to an earlier FakeReddit): like praw's, it's
+# only fetched when it's used, and then there's nothing to fetch
+class FakeMissingComment :
+	def __init__(self, reddit, id) :
+		self._reddit = reddit
+		self.id = id
+
+	def __getattr__(self, name) :
+		if name.startswith('_') :
+			raise AttributeError(name)
+		self._reddit.call('comment')
+		raise praw.exceptions.ClientException('No data returned for comment ' + self.id)
+
+# a 'load more comments', which takes a request to expand into the next 100 comments (and another one of these for the rest)
+class FakeMoreComments(praw.models.MoreComments) :
+	def __init__(self, reddit, comments) :
+		self._reddit = reddit
+		self._rest = comments
+		self.count = len(comments)
+		self.children = [comment.id for comment in comments]
+		self.submission = None
+
+	def comments(self, update=True) :
+		self._reddit.call('morechildren')
+		fetched = self._rest[:100]
+		if len(self._rest) > 100 :
+			fetched.append(FakeMoreComments(self._reddit, self._rest[100:]))
+		return fetched
+
+class FakeForest :
+	def __init__(self, reddit, comments, limit=2048) :
+		self._reddit = reddit
+		self._comments = comments
+		self._limit = limit
+
+	def replace_more(self, limit=32, threshold=0) :
+		# pretend every 100 comments were behind a 'load more comments' that took a request to expand
+		if not getattr(self, '_expanded', False) :
+			self._reddit.call('morechildren', max(0, len(self._comments) // 100))
+			self._expanded = True
+		return []
+
+	def list(self) :
+		return list(self._comments)
+
+	# once it's been expanded, the top-level comments; before that, the first limit comments
+	# that came with the submission, and a 'load more comments' for the rest
+	def __iter__(self) :
+		if getattr(self, '_expanded', False) :
+			return iter([comment for comment in self._comments if comment.top_level])
+		top = self._comments[:self._limit]
+		if len(self._comments) > self._limit :
+			top.append(FakeMoreComments(self._reddit, self._comments[self._limit:]))
+		return iter(top)
+
+	def __len__(self) :
+		return len(self._comments)
+
+class FakeSubmission :
+	def __init__(self, reddit, id, title, url, created_utc) :
+		self._reddit = reddit
+		self.id = id
+		self.title = title
+		self.url = url
+		self.created_utc = created_utc
+		self._comments = []
+		self._forest = None
+		self.comment_limit = 2048
+
+	@property
+	def num_comments(self) :
+		return len(self._comments)
+
+	@property
+	def comments(self) :
+		if self._forest is None :
+			self._reddit.call('comments') # fetching a submission's comments costs a request
+			self._forest = FakeForest(self._reddit, self._comments, self.comment_limit)
+		return self._forest
+
+	def reply(self, body) :
+		return self._reddit.post(self, body)
+
+class FakeSubreddit :
+	def __init__(self, reddit, name, submissions) :
+		self._reddit = reddit
+		self.display_name = name
+		self._submissions = submissions
+
+	def new(self, limit=100) :
+		self._reddit.call('new', max(1, -(-min(limit, len(self._submissions)) // 100)))
+		return iter(sorted(self._submissions, key=lambda s : s.created_utc, reverse=True)[:limit])
+
+	# like praw's listings, this fetches a page of 100 at a time, as they're needed
+	def comments(self, limit=100) :
+		everything = sorted((c for s in self._submissions for c in s._comments), key=lambda c : c.created_utc, reverse=True)
+		if limit is not None :
+			everything = everything[:limit]
+		self._reddit.call('comments listing')
+		for n, comment in enumerate(everything) :
+			if n % 100 == 0 and n :
+				self._reddit.call('comments listing')
+			yield comment
+
+class FakeRedditor :
+	def __init__(self, reddit, name) :
+		self._reddit = reddit
+		self.name = name
+		self.comments = self
+
+	# (as redditor.comments.new)
+	def new(self, limit=100) :
+		self._reddit.call('own comments') # a request for every page of 100
+		for n, comment in enumerate(reversed([comment for comment in self._reddit.posted if comment.author.name == self.name])) :
+			if limit is not None and n >= limit :
+				return
+			if n % 100 == 0 and n :
+				self._reddit.call('own comments')
+			yield comment
+
+class FakeReddit :
+	def __init__(self, counters, latency=0.0) :
+		self.counters = counters
+		self.latency = latency
+		self.subreddits = {}
+		self.posted = []
+		self._next_id = 0
+		self._by_id = {}
+
+	def call(self, name, requests=1) :
+		self.counters.count('reddit ' + name, requests)
+		if self.latency :
+			time.sleep(self.latency * requests)
+
+	def subreddit(self, name) :
+		return self.subreddits[name]
+
+	def comment(self, id) :
+		return self._by_id.get(id) or FakeMissingComment(self, id)
+
+	def redditor(self, name) :
+		return FakeRedditor(self, name)
+
+	def submission(self, id) :
+		self.call('submission')
+		return next(s for subreddit in self.subreddits.values() for s in subreddit._submissions if s.id == id)
+
+	def post(self, parent, body) :
+		self.call('reply')
+		self._next_id += 1
+		submission = parent.submission if isinstance(parent, FakeComment) else parent
+		comment = FakeComment(self, 'bot' + str(self._next_id), body, submission, time.time(), author='FleetFlotTheTweetBot')
+		comment.parent = parent
+		comment.top_level = parent is submission
+		self._by_id[comment.id] = comment
+		self.posted.append(comment)
+		return comment
+
+########-------- Twitter --------########
+
+class FakeTwitter :
+	def __init__(self, counters, tweets, latency=0.0) :
+		import tweepy
+		self.counters = counters
+		self.tweets = tweets # id -> json
+		self.latency = latency
+		self.parser = tweepy.parsers.ModelParser()
+		self._api = tweepy.API(parser=self.parser)
+
+	def _call(self, name) :
+		self.counters.count('twitter ' + name)
+		if self.latency :
+			time.sleep(self.latency)
+
+	def get_status(self, id, tweet_mode=None) :
+		import tweepy
+		self._call('get_status')
+		if str(id) not in self.tweets :
+			raise tweepy.error.TweepError([{'code' : 144, 'message' : 'No status found with that ID.'}], api_code=144)
+		return tweepy.models.Status.parse(self._api, self.tweets[str(id)])
+
+	def statuses_lookup(self, ids, tweet_mode=None) :
+		import tweepy
+		self._call('statuses_lookup')
+		return [tweepy.models.Status.parse(self._api, self.tweets[str(id)]) for id in ids if str(id) in self.tweets]
+
+########-------- Imgur / Gfycat --------########
+
+class FakeImgur :
+	def __init__(self, counters, latency=0.0) :
+		self.counters = counters
+		self.latency = latency
+
+	def upload_from_url(self, url, config=None, anon=True) :
+		self.counters.count('imgur upload')
+		if self.latency :
+			time.sleep(self.latency)
+		return {'id' : 'i' + str(abs(hash(url)) % 10**7)}
+
+class FakeGfycat :
+	def __init__(self, counters, latency=0.0) :
+		self.counters = counters
+		self.latency = latency
+
+	def upload_from_file(self, filepath) :
+		self.counters.count('gfycat upload')
+		if self.latency :
+			time.sleep(self.latency)
+		name = 'G' + str(abs(hash(filepath)) % 10**7)
+		mp4 = type('Mp4', (), {'url' : 'https://giant.gfycat.com/' + name + '.mp4'})
+		return type('Response', (), {'content_urls' : type('ContentUrls', (), {'mp4' : mp4})})
+
+########-------- Scenario --------########
+
+# a tweet of each kind, cycling through them by id
+tweet_kinds = ('text', 'link', 'image', 'four images', 'gif', 'video', 'image and video')
+
+def makeTweet(id) :
+	kind = tweet_kinds[id % len(tweet_kinds)]
+	text = 'SKOL! Tweet number ' + str(id) + ' about the game.\n\n1. first thing\n# not a heading\n    indented line'
+	tweet = {
+		'id' : id, 'id_str' : str(id), 'full_text' : text,
+		'user' : {'screen_name' : 'Vikings', 'name' : 'Minnesota Vikings'},
+		'entities' : {'urls' : []},
+	}
+	media = []
+	if kind == 'link' :
+		tweet['full_text'] += ' https://t.co/lnk' + str(id)
+		tweet['entities']['urls'].append({'url' : 'https://t.co/lnk' + str(id), 'expanded_url' : 'http://bit.ly/x' + str(id), 'display_url' : 'bit.ly/x' + str(id)})
+	if kind in ('image', 'image and video') :
+		media.append({'type' : 'photo', 'media_url_https' : 'http://pbs.twimg.com/media/' + str(id) + '_0.jpg', 'url' : 'https://t.co/m' + str(id)})
+	if kind == 'four images' :
+		for k in range(4) :
+			media.append({'type' : 'photo', 'media_url_https' : 'http://pbs.twimg.com/media/' + str(id) + '_' + str(k) + '.jpg', 'url' : 'https://t.co/m' + str(id)})
+	if kind == 'gif' :
+		media.append({'type' : 'animated_gif', 'url' : 'https://t.co/m' + str(id), 'video_info' : {'variants' : [{'content_type' : 'video/mp4', 'bitrate' : 0, 'url' : 'http://video.twimg.com/tweet_video/' + str(id) + '.mp4'}]}})
+	if kind in ('video', 'image and video') :
+		media.append({'type' : 'video', 'url' : 'https://t.co/m' + str(id), 'video_info' : {'variants' : [
+			{'content_type' : 'video/mp4', 'bitrate' : 832000, 'url' : 'http://video.twimg.com/ext_tw_video/' + str(id) + '/vid/640x360/a.mp4'},
+			{'content_type' : 'video/mp4', 'bitrate' : 2176000, 'url' : 'http://video.twimg.com/ext_tw_video/' + str(id) + '/vid/1280x720/b.mp4'},
+			{'content_type' : 'application/x-mpegURL', 'url' : 'http://video.twimg.com/ext_tw_video/' + str(id) + '/pl/c.m3u8'}]}})
+	if media :
+		tweet['extended_entities'] = {'media' : media}
+		tweet['full_text'] += ' https://t.co/m' + str(id) # twitter tacks a link to the tweet itself on the end
+	return tweet
+
+# build a synthetic subreddit: num_submissions submissions (tweet_share of them links to tweets),
+# the first of which is a game thread with big_thread comments and the rest with comments_per_thread each;
+# link_share of the comments have links in them, a mix of direct tweet links, shortlinks (some to tweets),
+# and ordinary links; there are num_tweets distinct tweets, so popular ones get linked over and over
+def makeScenario(reddit, name, seed=1, num_submissions=100, big_thread=10000, comments_per_thread=50, tweet_share=0.2, link_share=0.3, num_tweets=200) :
+	rand = random.Random(seed)
+	tweets = {str(id) : makeTweet(id) for id in range(1000, 1000 + num_tweets)}
+	tweet_ids = list(tweets)
+	now = time.time() - 3 * 60 * 60 # (recent enough that the bot will still reply to the comments)
+	words = ('skol', 'vikings', 'defense', 'cousins', 'jefferson', 'kick', 'punt', 'refs', 'what', 'a', 'game', 'lol', 'the', 'is', 'on')
+
+	def text(n) :
+		return ' '.join(rand.choice(words) for _ in range(n))
+
+	def link() :
+		roll = rand.random()
+		id = rand.choice(tweet_ids)
+		if roll < 0.25 :
+			return 'http://twitter.com/Vikings/status/' + id
+		if roll < 0.45 :
+			return 'http://bit.ly/t' + id
+		if roll < 0.55 :
+			return 'http://bit.ly/m' + id
+		if roll < 0.7 :
+			return 'http://bit.ly/x' + str(rand.randrange(10**6))
+		if roll < 0.85 :
+			return 'http://www.youtube.com/watch?v=' + str(rand.randrange(10**9))
+		return 'http://imgur.com/gallery/' + str(rand.randrange(10**6))
+
+	submissions = []
+	for n in range(num_submissions) :
+		created = now - n * 600
+		if rand.random() < tweet_share :
+			url = 'https://twitter.com/Vikings/status/' + rand.choice(tweet_ids)
+		else :
+			url = 'https://www.reddit.com/r/' + name + '/comments/s' + str(n)
+		s = FakeSubmission(reddit, name + '_s' + str(n), ('Game Thread' if n == 0 else 'Submission ' + str(n)), url, created)
+		count = big_thread if n == 0 else comments_per_thread
+		for k in range(count) :
+			body = text(rand.randint(3, 40))
+			if rand.random() < link_share :
+				links = [link() for _ in range(rand.choice((1, 1, 1, 2, 3)))]
+				body += ' ' + ' '.join(('(' + l + ')' if rand.random() < 0.1 else '**' + l + '**' if rand.random() < 0.1 else l) for l in links) + '. ' + text(5)
+			comment = FakeComment(reddit, s.id + 'c' + str(k), body, s, created + k)
+			comment.top_level = rand.random() < 0.3
+			s._comments.append(comment)
+		submissions.append(s)
+
+	reddit.subreddits[name] = FakeSubreddit(reddit, name, submissions)
+	return tweets
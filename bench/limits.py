@@ -0,0 +1,48 @@
+# Check that the rate limiters hold back everyone who asks once a service's budget is used up,
+# not just the first caller
+#
+#   python bench/limits.py
+
+import os
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+
+import ratelimit
+
+def check(name, ok, detail) :
+	print(('ok    ' if ok else 'FAILED') + ' ' + name + ': ' + detail)
+	return ok
+
+def main() :
+	results = []
+
+	# the service says we've got one call left, resetting in 100 seconds
+	limiter = ratelimit.Limiter('budget')
+	limiter.update(remaining=1, reset_at=time.time() + 100)
+	waits = [limiter.reserve() for _ in range(4)]
+	results.append(check('used up budget', all(wait > 99 for wait in waits), 'waits ' + str([round(wait, 1) for wait in waits])))
+
+	# once the reset has passed, nobody waits any more
+	limiter = ratelimit.Limiter('reset')
+	limiter.update(remaining=1, reset_at=time.time() - 1)
+	waits = [limiter.reserve() for _ in range(3)]
+	results.append(check('after the reset', all(wait == 0 for wait in waits), 'waits ' + str([round(wait, 1) for wait in waits])))
+
+	# with budget to spare, nobody waits either, until it runs out
+	limiter = ratelimit.Limiter('spare', margin=1)
+	limiter.update(remaining=4, reset_at=time.time() + 100)
+	waits = [limiter.reserve() for _ in range(5)]
+	results.append(check('spare budget', waits[:3] == [0, 0, 0] and all(wait > 99 for wait in waits[3:]), 'waits ' + str([round(wait, 1) for wait in waits])))
+
+	# our own token bucket still paces calls in a row
+	limiter = ratelimit.Limiter('bucket', rate=1, burst=1)
+	waits = [limiter.reserve() for _ in range(3)]
+	results.append(check('token bucket', waits[0] == 0 and 0.9 < waits[1] < 1.1 and 1.9 < waits[2] < 2.1, 'waits ' + str([round(wait, 1) for wait in waits])))
+
+	sys.exit(0 if all(results) else 1)
+
+if __name__ == '__main__' :
+	main()
@@ -0,0 +1,113 @@
+# Check the reply renderer against the old way of building replies, and time them both
+#
+# Every tweet in the golden corpus (hand-picked awkward texts, plus the synthetic tweets from fakes.py)
+# is rendered both ways, and the replies have to be identical, byte for byte.
+#
+#   python bench/replies.py [--repeat 2000]
+
+import argparse
+import os
+import re
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.insert(0, here)
+
+import render
+import fakes
+
+########-------- The old way, as composeReply used to do it --------########
+
+def legacyEscape(string) :
+	# escape leading hashtags ('#')
+	string = re.sub(r"^#","\\#",string,0,re.MULTILINE)
+
+	# delete leading spaces/tabs (so as not to trigger reddit's 'code' formatting)
+	string = re.sub(r"^[ \t]+","",string,0,re.MULTILINE)
+
+	# fix numbered list formatting by adding an escape like so: '5\.'
+	# otherwise reddit will always change the numbers to start at 1
+	string = re.sub(r"(?:(?<=^\d)|(?<=^\d{2})|(?<=^\d{3}))\.","\\.",string,0,re.MULTILINE)
+
+	# double space, because reddit needs two newlines to actually display a line break
+	# (the regex actually only adds a newline at the end of a line if there's another line after it with characters in it)
+	string = re.sub(r"(?<=.(?=\n.))","\n",string,0,re.MULTILINE)
+
+	return string
+
+def legacyReply(screen_name, name, text, replace_link, media) :
+	lineSep = "--------------------"
+	comment = "**[@" + screen_name + "](https://www.twitter.com/" + screen_name + ")** (" + name + "):\n\n"
+	tweetText = re.sub(r"\bhttps?:\/\/t\.co\/\w+\b",replace_link, text, 0)
+	comment += re.sub(r"^","> ",legacyEscape(tweetText), 0, re.MULTILINE) + "\n\n"
+	if len(media) > 0 :
+		comment += "Rehosted Media:\n\n"
+		for string in media :
+			comment += "* " + string + "\n\n"
+	comment += lineSep + "\n\n"
+	comment += "^I ^am ^a ^bot ^powered ^by ^fricks ^and ^I ^like ^that"
+	comment += " ^| [^(message&nbsp;me)](https://www.reddit.com/message/compose?to=FleetFlotTheTweetBot)"
+	comment += " ^| [^(source&nbsp;code)](https://github.com/JohnMTorgerson/FleetFlotTheTweetBot)"
+	comment += " ^| ^Skål!"
+	return comment
+
+def newReply(screen_name, name, text, replace_link, media) :
+	return render.reply(screen_name, name, render.quote(text, replace_link), media)
+
+########-------- Golden corpus --------########
+
+# what each t.co link gets replaced with (anything not in here is a link to the tweet itself, which gets dropped)
+links = {
+	'https://t.co/abc' : '[bit.ly/x](https://www.vikings.com/news/x)',
+	'http://t.co/def' : 'https://www.vikings.com/news/y',
+	'https://t.co/nl' : 'first\nsecond',
+	'https://t.co/hash' : '#notaheading',
+	'https://t.co/num' : '12.',
+}
+
+def replaceLink(match) :
+	return links.get(match.group(), '')
+
+texts = [
+	'', 'plain', 'two\nlines', 'blank\n\nline', 'trailing newline\n', '\nleading newline', '\n', '\n\n\n', 'a\n\n\nb\nc',
+	'#heading', '#heading\n#another', ' #indented hash', '\t\ttabbed', '   spaced\n  also spaced', '    \nwhitespace line\n \t \nend',
+	'1. one\n2. two\n10. ten\n100. hundred\n1000. thousand', '1.2.3', '12', '1.', '١. arabic-indic digit', '²3. superscript', '1 . no',
+	'https://t.co/abc', 'https://t.co/abc is great', 'see https://t.co/abc and http://t.co/def.', 'https://t.co/zzz #hash',
+	'https://t.co/zzz 1. list', 'xhttps://t.co/abc', 'https://t.co/abc_more', 'https://t.co/nl in the middle', 'https://t.co/hash',
+	'https://t.co/num after', 'line\r\nwindows\r\nlines', '\r', 'emoji 🏈 and ñ', '> already quoted', '* bullet\n- dash',
+	'SKOL! https://t.co/abc\n\n1. first\n# not a heading\n    indented https://t.co/xyz',
+]
+
+def corpus() :
+	for text in texts :
+		yield 'Vikings', 'Minnesota Vikings', text, []
+		yield 'a_b', 'Name (with) [brackets]', text, ['http://imgur.com/x.jpg', 'Video: [[desktop]](https://cdn/x.mp4) [[mobile]](https://cdn/y.mp4) ']
+	for id in range(1000, 1100) :
+		tweet = fakes.makeTweet(id)
+		yield tweet['user']['screen_name'], tweet['user']['name'], tweet['full_text'], ['https://giant.gfycat.com/G' + str(id) + '.mp4'] * (id % 3)
+
+def main() :
+	parser = argparse.ArgumentParser(description='Check the reply renderer against the old way of building replies, and time them both')
+	parser.add_argument('--repeat', type=int, default=2000, help='how many times to render the corpus when timing')
+	args = parser.parse_args()
+
+	cases = list(corpus())
+	mismatches = [case for case in cases if newReply(*case[:3], replaceLink, case[3]) != legacyReply(*case[:3], replaceLink, case[3])]
+	mismatches += [(None, None, text, []) for text in texts if render.escape(text) != legacyEscape(text)] # escaping on its own, too
+	print(f"{len(cases)} replies, {len(mismatches)} mismatches")
+	for screen_name, name, text, media in mismatches[:20] :
+		print(f"  {text!r}\n    old: {legacyReply(screen_name, name, text, replaceLink, media)!r}\n    new: {newReply(screen_name, name, text, replaceLink, media)!r}")
+
+	for label, function in (('old', legacyReply), ('new', newReply)) :
+		started = time.perf_counter()
+		for _ in range(args.repeat) :
+			for screen_name, name, text, media in cases :
+				function(screen_name, name, text, replaceLink, media)
+		seconds = time.perf_counter() - started
+		print(f"{label}: {seconds:.3f}s for {args.repeat * len(cases)} replies ({seconds / (args.repeat * len(cases)) * 1e6:.1f}us each)")
+	sys.exit(1 if mismatches else 0)
+
+if __name__ == '__main__' :
+	main()
@@ -0,0 +1,247 @@
+# Offline end-to-end benchmark of a run of the bot
+#
+# Runs main() against a synthetic subreddit, with every service faked locally (see fakes.py),
+# and reports how long each stage took, as a table and (optionally) as JSON that can be
+# compared against a run from another commit:
+#
+#   python bench/run.py --output before.json
+#   (change things)
+#   python bench/run.py --output after.json --compare before.json
+#
+# Everything (the state database, logs, downloads) goes in a fresh temporary directory,
+# so the first run is always cold; use --runs 2 or more to also see how the warm runs go.
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(here)
+sys.path.insert(0, root)
+sys.path.insert(0, here)
+
+import fakes
+
+# the functions in main.py we time, as (stage, function, which argument holds the items it handles, if it handles a bunch at once)
+# (besides these, findURLs is URLFinder.findall, resolveRedirects is RedirectResolver.resolveAll,
+# and discovery is everything we spend getting submissions and comments out of reddit)
+stages = (
+	('prefetchTweets', 'prefetchTweets', 0),
+	('getTweet', 'getTweet', None),
+	('getTweetMedia', 'getTweetMedia', None),
+	('composeReply', 'composeReply', None),
+	('checkComments', 'checkComments', 0),
+)
+
+class Stats :
+	def __init__(self) :
+		self.lock = threading.Lock()
+		self.samples = {} # stage -> list of (seconds, items)
+
+	def add(self, stage, seconds, items=1) :
+		with self.lock :
+			self.samples.setdefault(stage, []).append((seconds, items))
+
+	@contextlib.contextmanager
+	def timing(self, stage, items=1) :
+		started = time.perf_counter()
+		try:
+			yield
+		finally:
+			self.add(stage, time.perf_counter() - started, items)
+
+	def summary(self) :
+		summary = {}
+		for stage, samples in self.samples.items() :
+			times = sorted(seconds for seconds, items in samples)
+			total = sum(times)
+			items = sum(items for seconds, items in samples)
+			summary[stage] = {
+				'calls' : len(samples),
+				'items' : items,
+				'seconds' : round(total, 6),
+				'mean_ms' : round(total / len(times) * 1000, 3),
+				'p50_ms' : round(percentile(times, 50) * 1000, 3),
+				'p95_ms' : round(percentile(times, 95) * 1000, 3),
+				'max_ms' : round(times[-1] * 1000, 3),
+				'items_per_second' : round(items / total, 1) if total > 0 else None,
+			}
+		return summary
+
+def percentile(ordered, p) :
+	if not ordered :
+		return 0
+	return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+# wrap function so every call gets timed as stage; if items is given, the argument
+# at that position is a bunch of things, and we count how many
+def wrap(stats, stage, function, items=None) :
+	def timed(*args, **kwargs) :
+		count = 1
+		if items is not None :
+			args = list(args)
+			args[items] = list(args[items]) # so we can count it without using up a generator
+			count = len(args[items])
+		with stats.timing(stage, count) :
+			return function(*args, **kwargs)
+	return timed
+
+def gitRevision() :
+	try:
+		revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=root, capture_output=True, text=True, check=True).stdout.strip()
+		dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=root, capture_output=True, text=True).stdout.strip()
+		return revision + ('-dirty' if dirty else '')
+	except Exception :
+		return None
+
+def parseArgs() :
+	parser = argparse.ArgumentParser(description='Benchmark a run of the bot against local fakes of every service it uses')
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--subreddits', type=int, default=1, help='how many subreddits (each with its own game thread and submissions)')
+	parser.add_argument('--submissions', type=int, default=100, help='submissions in each subreddit (all of them get checked)')
+	parser.add_argument('--big-thread', type=int, default=10000, help='comments in the game thread')
+	parser.add_argument('--comments', type=int, default=50, help='comments in every other thread')
+	parser.add_argument('--tweets', type=int, default=200, help='distinct tweets that get linked to')
+	parser.add_argument('--tweet-share', type=float, default=0.2, help='share of submissions that link to a tweet')
+	parser.add_argument('--link-share', type=float, default=0.3, help='share of comments with links in them')
+	parser.add_argument('--latency', type=float, default=0.02, help='seconds every fake api call and http request takes')
+	parser.add_argument('--runs', type=int, default=1, help='run this many times against the same state (the first is cold, the rest warm)')
+	parser.add_argument('--log-level', default='WARNING', help="the bot's log level while benchmarking (its own default is DEBUG)")
+	parser.add_argument('--output', help='write the results as JSON to this file')
+	parser.add_argument('--compare', help='JSON results from an earlier benchmark to compare against')
+	return parser.parse_args()
+
+def setUp(args, workdir) :
+	# everything main.py needs from the environment, pointed at our temporary directory and fake internet
+	internet = fakes.FakeInternet(fakes.Counters(), latency=args.latency).start()
+	os.makedirs(os.path.join(workdir, 'logs'))
+	os.makedirs(os.path.join(workdir, 'temp'))
+	os.environ.update({
+		'SUB_NAME' : 'benchmark',
+		'SUBREDDITS' : ','.join('benchmark' + (str(n) if n else '') for n in range(args.subreddits)),
+		'NUM_THREADS' : str(args.submissions),
+		'STATE_DB' : os.path.join(workdir, 'state.db'),
+		'TEMP_DIR' : os.path.join(workdir, 'temp'),
+		'STREAMABLE_API' : 'http://api.streamable.com',
+		'STREAMABLE_WAIT' : '0', # don't sit around waiting for videos at the end of the run
+		'RATE_LIMITS' : 'imgur=none,gfycat=none,streamable=none', # the fakes don't have any, and we're timing the bot, not the limits
+		'HTTP_PROXY' : internet.proxy,
+		'http_proxy' : internet.proxy,
+		'NO_PROXY' : '',
+		'no_proxy' : '',
+	})
+	sys.modules['paths'] = types.SimpleNamespace(logs=os.path.join(workdir, 'logs') + os.sep)
+	sys.modules['loginStreamable'] = types.SimpleNamespace(username='benchmark', password='benchmark')
+
+	import main
+	import logging
+	main.logger.setLevel(getattr(logging, args.log_level.upper()))
+	return main, internet
+
+def run(main, args, internet, number) :
+	counters = internet.counters = fakes.Counters()
+	main._reddit = reddit = fakes.FakeReddit(counters, latency=args.latency)
+	tweets = {}
+	for n, name in enumerate(main.subreddits) :
+		tweets.update(fakes.makeScenario(reddit, name, seed=args.seed + n, num_submissions=args.submissions, big_thread=args.big_thread,
+			comments_per_thread=args.comments, tweet_share=args.tweet_share, link_share=args.link_share, num_tweets=args.tweets))
+	main._twitter = fakes.FakeTwitter(counters, tweets, latency=args.latency)
+	main._imgur = fakes.FakeImgur(counters, latency=args.latency)
+	main._gfycat = fakes.FakeGfycat(counters, latency=args.latency)
+
+	# wrap everything we time
+	stats = Stats()
+	originals = {}
+	for stage, name, items in stages :
+		originals[name] = getattr(main, name)
+		setattr(main, name, wrap(stats, stage, originals[name], items))
+	findall = main.URLFinder.findall
+	main.URLFinder.findall = wrap(stats, 'findURLs', findall, 1)
+	main.resolver.resolveAll = wrap(stats, 'resolveRedirects', main.resolver.resolveAll, 0)
+	for name in ('new', 'comments') :
+		original = getattr(fakes.FakeSubreddit, name)
+		originals['FakeSubreddit.' + name] = original
+		setattr(fakes.FakeSubreddit, name, wrap(stats, 'discovery', original))
+	replace_more = fakes.FakeForest.replace_more
+	fakes.FakeForest.replace_more = wrap(stats, 'discovery', replace_more)
+	more_comments = fakes.FakeMoreComments.comments
+	fakes.FakeMoreComments.comments = wrap(stats, 'discovery', more_comments)
+
+	try:
+		started = time.perf_counter()
+		main.main()
+		total = time.perf_counter() - started
+	finally:
+		for name, original in originals.items() :
+			if name.startswith('FakeSubreddit.') :
+				setattr(fakes.FakeSubreddit, name.split('.')[1], original)
+			else :
+				setattr(main, name, original)
+		main.URLFinder.findall = findall
+		del main.resolver.resolveAll
+		fakes.FakeForest.replace_more = replace_more
+		fakes.FakeMoreComments.comments = more_comments
+
+	return {
+		'run' : number,
+		'seconds' : round(total, 3),
+		'replies' : len(reddit.posted),
+		'stages' : stats.summary(),
+		'calls' : dict(sorted(counters.calls.items())),
+	}
+
+def report(results, compare=None) :
+	previous = {}
+	if compare is not None :
+		previous = {run['run'] : run for run in compare['runs']}
+		print(f"comparing {results['revision']} against {compare.get('revision')}")
+	for run in results['runs'] :
+		before = previous.get(run['run'])
+		print(f"\nrun {run['run']}: {run['seconds']:.3f}s, {run['replies']} replies" + (f" (was {before['seconds']:.3f}s)" if before else ''))
+		print(f"  {'stage':<18}{'calls':>8}{'items':>8}{'total s':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'items/s':>10}" + ('   vs before' if before else ''))
+		for stage, s in run['stages'].items() :
+			line = f"  {stage:<18}{s['calls']:>8}{s['items']:>8}{s['seconds']:>10.3f}{s['mean_ms']:>10.2f}{s['p50_ms']:>10.2f}{s['p95_ms']:>10.2f}{(s['items_per_second'] or 0):>10.1f}"
+			if before and stage in before['stages'] and before['stages'][stage]['seconds'] > 0 :
+				line += f"   {s['seconds'] / before['stages'][stage]['seconds']:.2f}x"
+			print(line)
+		print('  calls: ' + ', '.join(f'{name} {n}' for name, n in run['calls'].items()))
+
+def benchmark() :
+	args = parseArgs()
+	workdir = tempfile.mkdtemp(prefix='fleetflot-bench-')
+	try:
+		main, internet = setUp(args, workdir)
+		try:
+			runs = [run(main, args, internet, number) for number in range(1, args.runs + 1)]
+		finally:
+			internet.stop()
+	finally:
+		shutil.rmtree(workdir, ignore_errors=True)
+
+	results = {
+		'revision' : gitRevision(),
+		'when' : time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+		'python' : platform.python_version(),
+		'scenario' : {key : value for key, value in vars(args).items() if key not in ('output', 'compare', 'log_level')},
+		'runs' : runs,
+	}
+	compare = None
+	if args.compare :
+		with open(args.compare) as file :
+			compare = json.load(file)
+	report(results, compare)
+	if args.output :
+		with open(args.output, 'w') as file :
+			json.dump(results, file, indent=2)
+
+if __name__ == '__main__' :
+	benchmark()
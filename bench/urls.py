@@ -0,0 +1,102 @@
+# Check the url tokenizer against the url regex it replaces, and time them both
+#
+# Every text in the corpus (hand-picked edge cases, synthetic comments like the ones in run.py,
+# and a pile of random junk made of url-ish characters) goes through urlfinder.findURLs and through
+# regex_url itself, and the results have to be identical; anything the regex takes too long on
+# is counted but left out of the comparison.
+#
+#   python bench/urls.py [--random 200000] [--seed 1]
+
+import argparse
+import os
+import random
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(here))
+sys.path.insert(0, here)
+
+import regex
+import urlfinder
+import fakes
+
+# the url pattern, exactly as it is in main.py (which we can't import without setting up logins and so on)
+regex_url = r"(?i)\b((?:[a-z][\w-]+:(?:\/{1,3}|[a-z0-9%])|www\d{0,3}[.]|[a-z0-9.\-]++[.][a-z]{2,4}\/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'\"\*.,<>?«»“”‘’]))"
+
+edge_cases = [
+	'', 'no urls here', 'just a sentence. with a period', 'a colon: and nothing else',
+	'http://twitter.com/Vikings/status/123', 'https://twitter.com/Vikings/status/123?s=20',
+	'look at this: https://bit.ly/abc.', 'look at this (https://bit.ly/abc)', 'look at this (https://bit.ly/abc).',
+	'**https://bit.ly/abc**', '*https://bit.ly/abc*', '"https://bit.ly/abc"', "'https://bit.ly/abc'", '“https://bit.ly/abc”',
+	'https://en.wikipedia.org/wiki/Minnesota_(disambiguation)', 'https://en.wikipedia.org/wiki/A_(b_(c))_d',
+	'https://en.wikipedia.org/wiki/A_(b_(c)_d', 'https://x.com/a_((b))', 'https://x.com/a_(()', 'https://x.com/a_()', 'https://x.com/()',
+	'http://a', 'http://ab', 'http:/', 'http://', 'http:///', 'http:////a', 'http:x', 'http:%20', 'http:.', 'h:a', 'a-b:c', '-ab:c', '_ab:/c',
+	'www.vikings.com', 'www1.vikings.com', 'www123.vikings.com', 'www1234.vikings.com', 'wwww.vikings.com', 'xwww.vikings.com', 'a-www.b',
+	'WWW.VIKINGS.COM', 'HTTP://BIT.LY/X', 'www.', 'www.a', 'www..', 'www.(a)', 'www.a(b)', 'www.a(b)c',
+	'vikings.com/news', 'vikings.com', 'foo.bar.baz/qux', 'mailto:someone@example.com', 'javascript:void(0)',
+	'two links http://a.com/x and www.b.com/y, then http://c.com.', 'http://a.com/xhttp://b.com/y', 'http://a.com/x<b>', 'http://a.com/x>y',
+	'text http://a.com/(x)(y)', 'text http://a.com/(x)(y).', 'text http://a.com/x(y).z', 'http://a.com/x?', 'http://a.com/x!', 'http://a.com/x;',
+	'http://a.com/x[1]', 'http://a.com/x{1}', 'http://a.com/`x`', 'http://a.com/x«»', 'http://a.com/x—', 'http://a.com/x…',
+	'http://a.com/x y', 'http://a.com/x y', 'http://a.com/x​y', 'http://a.com/x\x1cy', 'http://a.com/x　y',
+	'Kelvin:x', 'ſite:x', 'İstanbul:x', 'é http://a.com é', 'éhttp://a.com', 'http://é.com/é', 'ab́:x',
+	'[link](https://twitter.com/Vikings/status/123)', '[link](https://twitter.com/Vikings/status/123).', '<https://a.com/x>',
+	'https://a.com/x_(y)_(z)', '((http://a.com/x))', 'http://a.com/x)', 'http://a.com/(x', 'http://a.com/((x', 'http://a.com/x((y))z',
+	'ftp://a.b', 'ab:cd:ef', 'a:b:c', 'http:http://a.com', 'http:/a.com', 'www.a.com:80/x', 'www.www.com', '-www.a', 'www-a.b',
+]
+
+# characters that make for interesting text: url-ish characters, all the punctuation the regex
+# treats specially, parentheses, unicode oddities, and various kinds of whitespace
+alphabet = list('htpswwwxab.:/-_%()()<>[]{}!?*\'",;`0123 ') + ['«', '“', '’', ' ', ' ', 'K', 'é', '\n', '\t', 'http://', 'www.']
+
+def randomTexts(count, seed, length) :
+	rand = random.Random(seed)
+	for _ in range(count) :
+		yield ''.join(rand.choice(alphabet) for _ in range(rand.randint(1, length)))
+
+def syntheticComments(seed) :
+	reddit = fakes.FakeReddit(fakes.Counters())
+	fakes.makeScenario(reddit, 'urls', seed=seed, num_submissions=20, big_thread=5000, comments_per_thread=100)
+	return [comment.body for s in reddit.subreddit('urls')._submissions for comment in s._comments]
+
+def main() :
+	parser = argparse.ArgumentParser(description='Check the url tokenizer against the url regex, and time them both')
+	parser.add_argument('--random', type=int, default=200000, help='how many random texts to check')
+	parser.add_argument('--length', type=int, default=40, help='how long the random texts get (in chunks of the alphabet)')
+	parser.add_argument('--seed', type=int, default=1)
+	parser.add_argument('--timeout', type=float, default=1, help='how long the regex gets per text before we leave that text out')
+	args = parser.parse_args()
+
+	compiled = regex.compile(regex_url)
+	corpora = {
+		'edge cases' : edge_cases,
+		'synthetic comments' : syntheticComments(args.seed),
+		'backtracking' : ['www.' + '.' * n for n in (1000, 2000, 4000)] + ['http://a.com/' + ',' * 4000, 'http://a' + '(b)' * 25 + '(((', 'a' * 100000 + ':b'],
+		'random' : list(randomTexts(args.random, args.seed, args.length)),
+	}
+	failed = False
+	for name, texts in corpora.items() :
+		mismatches = []
+		timeouts = 0
+		regex_seconds = tokenizer_seconds = 0
+		for text in texts :
+			started = time.perf_counter()
+			try:
+				expected = [match.group(0) for match in compiled.finditer(text, timeout=args.timeout)]
+			except TimeoutError :
+				timeouts += 1
+				continue
+			regex_seconds += time.perf_counter() - started
+			started = time.perf_counter()
+			found = urlfinder.findURLs(text)
+			tokenizer_seconds += time.perf_counter() - started
+			if found != expected :
+				mismatches.append((text, expected, found))
+		print(f"{name}: {len(texts)} texts, {len(mismatches)} mismatches, {timeouts} regex timeouts; regex {regex_seconds:.3f}s, tokenizer {tokenizer_seconds:.3f}s")
+		for text, expected, found in mismatches[:20] :
+			print(f"  {text!r}\n    regex:     {expected!r}\n    tokenizer: {found!r}")
+		failed = failed or bool(mismatches)
+	sys.exit(1 if failed else 0)
+
+if __name__ == '__main__' :
+	main()
@@ -0,0 +1,105 @@
+# A small persistent key/value cache backed by SQLite, so that things we've already
+# looked up (e.g. where a shortlink redirects to) survive from one run of the bot to the next
+#
+# Every entry has a time-to-live; failures can be cached too (with their own, usually
+# shorter, time-to-live) so that we don't keep hammering a link that's broken.
+# When a table grows past max_entries, the oldest entries are thrown away.
+
+import sqlite3
+import threading
+import json
+import time
+import collections
+import metrics
+
+# value is whatever was stored (None for a cached failure);
+# error is None for a good entry, or a message saying why the lookup failed
+Entry = collections.namedtuple('Entry', ['value', 'error'])
+
+# all the caches (and anything else that wants to keep state in the same database file) share one connection per file
+_connections = {}
+_connections_lock = threading.Lock()
+
+def connect(path) :
+	with _connections_lock :
+		if path not in _connections :
+			conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None) # autocommit; we use explicit transactions where we need them
+			conn.execute('PRAGMA journal_mode=WAL') # lets readers and a writer get along
+			conn.execute('PRAGMA synchronous=NORMAL')
+			_connections[path] = (conn, threading.RLock())
+		return _connections[path]
+
+class Cache :
+	prune_every = 100 # check whether we need to evict anything after this many puts
+
+	# path is the SQLite database file, table is the name of the table this cache lives in
+	# ttl and negative_ttl are in seconds; max_entries bounds the size of the table
+	def __init__(self, path, table, ttl, negative_ttl=None, max_entries=None) :
+		self.path = path
+		self.table = table
+		self.ttl = ttl
+		self.negative_ttl = negative_ttl if negative_ttl is not None else ttl
+		self.max_entries = max_entries
+		self.hits = 0
+		self.misses = 0
+		self._conn = None
+		self._puts = 0
+
+	def _db(self) :
+		if self._conn is None :
+			conn, lock = connect(self.path)
+			with lock :
+				conn.execute(f'CREATE TABLE IF NOT EXISTS "{self.table}" (key TEXT PRIMARY KEY, value TEXT, error TEXT, stored REAL NOT NULL, expires REAL NOT NULL)')
+				conn.execute(f'CREATE INDEX IF NOT EXISTS "{self.table}_stored" ON "{self.table}" (stored)')
+			self._conn, self._lock = conn, lock
+			self.prune()
+		return self._conn
+
+	# return the Entry for key, or None if we don't have one (or it's expired)
+	def lookup(self, key) :
+		db = self._db()
+		with self._lock :
+			row = db.execute(f'SELECT value, error, expires FROM "{self.table}" WHERE key = ?', (key,)).fetchone()
+		if row is None or row[2] < time.time() :
+			self.misses += 1
+			metrics.count('cache_lookups', cache=self.table, result='miss')
+			return None
+		self.hits += 1
+		metrics.count('cache_lookups', cache=self.table, result='hit')
+		return Entry(json.loads(row[0]) if row[0] is not None else None, row[1])
+
+	# like lookup, but for a bunch of keys at once; returns a dict of key -> Entry for the keys we have
+	def lookupMany(self, keys) :
+		return {key : entry for key, entry in ((key, self.lookup(key)) for key in keys) if entry is not None}
+
+	# cache a good value for key
+	def put(self, key, value) :
+		self._store(key, json.dumps(value), None, self.ttl)
+
+	# remember that looking up key failed, so we don't bother trying again for a while
+	def putFailure(self, key, error) :
+		self._store(key, None, str(error), self.negative_ttl)
+
+	def delete(self, key) :
+		db = self._db()
+		with self._lock :
+			db.execute(f'DELETE FROM "{self.table}" WHERE key = ?', (key,))
+
+	def _store(self, key, value, error, ttl) :
+		db = self._db()
+		now = time.time()
+		with self._lock :
+			db.execute(f'INSERT OR REPLACE INTO "{self.table}" (key, value, error, stored, expires) VALUES (?, ?, ?, ?, ?)', (key, value, error, now, now + ttl))
+		self._puts += 1
+		if self._puts % self.prune_every == 0 :
+			self.prune()
+
+	# throw away expired entries, and then the oldest entries if we're over max_entries
+	def prune(self) :
+		db = self._db()
+		with self._lock :
+			db.execute(f'DELETE FROM "{self.table}" WHERE expires < ?', (time.time(),))
+			if self.max_entries is not None :
+				count = db.execute(f'SELECT COUNT(*) FROM "{self.table}"').fetchone()[0]
+				if count > self.max_entries :
+					db.execute(f'DELETE FROM "{self.table}" WHERE key IN (SELECT key FROM "{self.table}" ORDER BY stored LIMIT ?)', (count - self.max_entries,))
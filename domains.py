@@ -0,0 +1,48 @@
+# Telling what a url is from its domain, without going to the network
+#
+# A link straight to a tweet (on twitter.com, mobile.twitter.com or x.com) can be recognised as it is;
+# a link on a url shortener (bit.ly, t.co, ...) might lead to a tweet, so it's worth following its redirects;
+# anything else (youtube, imgur, reddit, vikings.com, ...) isn't a tweet and isn't going to turn into one,
+# so there's no need to look any further.
+
+import urllib.parse
+import re
+import os
+
+regex_tweet = r"https?:\/\/(?:www\.|mobile\.)?(?:twitter|x)\.com\/\w{1,15}\/status\/\d+" # a link to a tweet
+
+TWEET = 'tweet'
+SHORTENER = 'shortener'
+OTHER = 'other'
+
+# domains whose links are just redirects to somewhere else (add more with SHORTENERS="a.co,b.ly",
+# or SHORTENERS="*" to follow every link, like we used to)
+shorteners = {
+	't.co', 'bit.ly', 'mnvkn.gs', 'tinyurl.com', 'ow.ly', 'buff.ly', 'dlvr.it', 'trib.al', 'ift.tt', 'fb.me',
+	'goo.gl', 'is.gd', 'tiny.cc', 'lnkd.in', 'cutt.ly', 'rebrand.ly', 'shorturl.at', 'bl.ink', 't.ly', 'tr.im',
+	'j.mp', 'bitly.com', 'wp.me', 'snip.ly', 'hubs.ly',
+	'twitter.com', 'x.com', 'mobile.twitter.com', # (links to twitter that aren't straight to a tweet, like twitter.com/i/web/status/..., can redirect to one)
+}
+shorteners.update(domain.strip().lower() for domain in os.getenv('SHORTENERS', '').split(',') if domain.strip())
+follow_everything = '*' in shorteners
+
+# the host name in url, in lower case, without any 'www.' (or '' if there isn't one)
+def host(url) :
+	if '://' not in url :
+		url = 'http://' + url # (the url regex finds things like 'bit.ly/abc' too)
+	try:
+		host = urllib.parse.urlsplit(url).hostname or ''
+	except ValueError : # (e.g. a bad port, or mismatched brackets)
+		return ''
+	host = host.rstrip('.')
+	if host.startswith('www.') :
+		host = host[4:]
+	return host
+
+# TWEET if url is a link to a tweet, SHORTENER if it might redirect to one, otherwise OTHER
+def classify(url) :
+	if re.match(regex_tweet, url) :
+		return TWEET
+	if follow_everything or host(url) in shorteners :
+		return SHORTENER
+	return OTHER
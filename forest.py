@@ -0,0 +1,38 @@
+# Going through every comment in a thread, without loading them all first
+#
+# s.comments.replace_more(limit=None) fetches every "load more comments" in a thread before we get to look at
+# any of it, and s.comments.list() then makes one big list of the lot; on a 20,000 comment game thread that's
+# a lot to hold all at once. walk() goes through the thread depth first instead, only fetching each "load more
+# comments" when it gets to it, and hands comments over as it goes. Whatever it fetches isn't added to the
+# submission's own comment tree, so once the comments have been dealt with and let go of, they're gone;
+# chunks() groups them up for checking, so no more than so many are held at once.
+
+from praw.models import MoreComments
+import itertools
+import metrics
+import ratelimit
+
+# every comment in submission s (depth first, in the order reddit gives them), fetching more as we go
+def walk(s) :
+	with metrics.timer('api', service='reddit', call='comments'), ratelimit.call('reddit') :
+		pending = list(s.comments)[::-1] # (the first fetch of the submission comes with the top of the tree)
+	while pending :
+		item = pending.pop()
+		if isinstance(item, MoreComments) :
+			if item.submission is None :
+				item.submission = s # (it needs to know which submission it's in to fetch anything)
+			with metrics.timer('api', service='reddit', call='morechildren'), ratelimit.call('reddit') :
+				fetched = item.comments(update=False) # (not update, so they aren't added to the submission's tree)
+			pending.extend(reversed(fetched))
+			continue
+		pending.extend(reversed(list(item.replies)))
+		yield item
+
+# group items up into lists of at most size
+def chunks(items, size) :
+	items = iter(items)
+	while True :
+		chunk = list(itertools.islice(items, size))
+		if not chunk :
+			return
+		yield chunk
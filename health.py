@@ -0,0 +1,97 @@
+# Health check for when the bot runs as a long-lived daemon
+#
+# The daemon calls beat() every time it gets through a round of polling reddit, and error()
+# whenever something goes wrong; we're healthy as long as the last beat was recent enough.
+# The status can be read from a small HTTP server (GET /health returns 200 or 503, with the
+# details as JSON), and/or from a heartbeat file that gets rewritten on every beat.
+
+import http.server
+import threading
+import json
+import time
+import os
+
+class HealthCheck :
+	# max_age is how many seconds can go by without a beat before we're considered unhealthy
+	# port (optional) is the local port to serve the status on
+	# heartbeat_file (optional) is a file to write the status to on every beat
+	# details (optional) is a function returning anything else worth including in the status
+	def __init__(self, max_age=300, port=None, heartbeat_file=None, details=None) :
+		self.max_age = max_age
+		self.port = port
+		self.heartbeat_file = heartbeat_file
+		self.details = details
+		self.started = time.time()
+		self.last_beat = None
+		self.last_error = None
+		self.last_error_time = None
+		self.beats = 0
+		self.errors = 0
+		self.server = None
+
+	def start(self) :
+		if self.port is not None and self.server is None :
+			health = self
+			class Handler(http.server.BaseHTTPRequestHandler) :
+				def do_GET(self) :
+					if self.path.rstrip('/') not in ('', '/health') :
+						self.send_error(404)
+						return
+					status = health.status()
+					body = json.dumps(status).encode('utf-8')
+					self.send_response(200 if status['healthy'] else 503)
+					self.send_header('Content-Type', 'application/json')
+					self.send_header('Content-Length', str(len(body)))
+					self.end_headers()
+					self.wfile.write(body)
+
+				def log_message(self, *args) : # don't spam stderr with every request
+					pass
+
+			self.server = http.server.ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+			threading.Thread(target=self.server.serve_forever, name='health', daemon=True).start()
+		return self
+
+	def stop(self) :
+		if self.server is not None :
+			self.server.shutdown()
+			self.server.server_close()
+			self.server = None
+
+	def beat(self) :
+		self.last_beat = time.time()
+		self.beats += 1
+		self._writeHeartbeat()
+
+	def error(self, message) :
+		self.last_error = str(message)
+		self.last_error_time = time.time()
+		self.errors += 1
+		self._writeHeartbeat()
+
+	def healthy(self) :
+		# before the first beat, give ourselves max_age seconds to get going
+		last = self.last_beat if self.last_beat is not None else self.started
+		return time.time() - last <= self.max_age
+
+	def status(self) :
+		status = {
+			'healthy' : self.healthy(),
+			'started' : self.started,
+			'last_beat' : self.last_beat,
+			'beats' : self.beats,
+			'errors' : self.errors,
+			'last_error' : self.last_error,
+			'last_error_time' : self.last_error_time,
+		}
+		if self.details is not None :
+			status['details'] = self.details()
+		return status
+
+	def _writeHeartbeat(self) :
+		if self.heartbeat_file is None :
+			return
+		temp = self.heartbeat_file + '.tmp'
+		with open(temp, 'w') as file :
+			json.dump(self.status(), file)
+		os.replace(temp, self.heartbeat_file) # so nobody ever reads a half-written file
@@ -1,7 +1,10 @@
+# Each api wrapper is only imported when we actually log in to that service,
+# so importing this module doesn't drag in every SDK up front
+
 # Reddit
-import praw
-import loginReddit
 def reddit():
+    import praw
+    import loginReddit
     r = praw.Reddit(client_id=loginReddit.app_id,
                      client_secret=loginReddit.app_secret,
                      password=loginReddit.password,
@@ -10,18 +13,18 @@ def reddit():
     return r
 
 # Twitter
-import tweepy
-import loginTwitter
 def twitter() :
+	import tweepy
+	import loginTwitter
 	auth = tweepy.OAuthHandler(loginTwitter.consumer_key, loginTwitter.consumer_secret)
 	auth.set_access_token(loginTwitter.access_token, loginTwitter.access_secret)
 	t = tweepy.API(auth)
 	return t
 
 # Imgur
-from imgurpython import ImgurClient
-import loginImgur
 def imgur() :
+	from imgurpython import ImgurClient
+	import loginImgur
 	i = ImgurClient(loginImgur.app_id, loginImgur.app_secret)
 	return i
 
@@ -30,9 +33,9 @@ def imgur() :
 import loginStreamable
 
 # Gfycat
-# from gfycat.client import GfycatClient # gfycat api wrapper
-from gfypy import Gfypy
-import loginGfycat
 def gfycat() :
+    # from gfycat.client import GfycatClient # gfycat api wrapper
+    from gfypy import Gfypy
+    import loginGfycat
     g = Gfypy(loginGfycat.client_id, loginGfycat.client_secret, './creds.json')
     return g
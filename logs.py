@@ -0,0 +1,99 @@
+# Logging without waiting on the disk
+#
+# queue() moves a logger's handlers (files, stdout) onto a background thread: logging a message just puts
+# it on a queue, and the thread writes it out, so the bot never sits waiting for a write in the middle of
+# going through comments. context() says what we're working on (e.g. submission and comment ids); every
+# message logged inside it gets those as fields, which the JSON lines format (JSONFormatter) writes out
+# as they are, so the logs can be searched by submission or comment. SampleFilter thins out chatty
+# messages (like the ones for every url we look at), keeping all of them for a sample of comments.
+
+import logging
+import logging.handlers
+import contextlib
+import contextvars
+import queue as queues
+import atexit
+import copy
+import json
+import zlib
+
+_context = contextvars.ContextVar('log_context', default={})
+fields = ('submission', 'comment') # context that gets added to every message
+
+# log everything inside the with statement with these fields (on top of any context we're already in)
+@contextlib.contextmanager
+def context(**values) :
+	token = _context.set(dict(_context.get(), **values))
+	try:
+		yield
+	finally:
+		_context.reset(token)
+
+# adds the current context to each record, as it's logged (on the thread that logged it)
+class ContextFilter(logging.Filter) :
+	def filter(self, record) :
+		for key, value in _context.get().items() :
+			if not hasattr(record, key) :
+				setattr(record, key, value)
+		return True
+
+# one JSON object per line: time, level, message, the context fields, and the exception (if there was one)
+class JSONFormatter(logging.Formatter) :
+	def format(self, record) :
+		entry = {
+			'time' : self.formatTime(record),
+			'level' : record.levelname,
+			'message' : record.getMessage(),
+		}
+		for key in fields :
+			if getattr(record, key, None) is not None :
+				entry[key] = getattr(record, key)
+		if record.exc_info and not record.exc_text :
+			record.exc_text = self.formatException(record.exc_info)
+		if record.exc_text :
+			entry['exception'] = record.exc_text
+		return json.dumps(entry)
+
+# only lets through messages about a sample of comments (rate is the share of them, from 0 to 1), so that
+# a comment's messages are either all there or all gone; messages that aren't about a comment all get through
+class SampleFilter(logging.Filter) :
+	def __init__(self, rate) :
+		super().__init__()
+		self.rate = rate
+
+	def filter(self, record) :
+		if self.rate >= 1 :
+			return True
+		comment = _context.get().get('comment')
+		if comment is None :
+			return True
+		return zlib.crc32(str(comment).encode('utf-8')) % 10000 < self.rate * 10000
+
+# puts records on the queue as they are, other than formatting the message and the traceback (if there is one)
+# into text while we're still on the thread that logged it; the stock QueueHandler formats the whole record,
+# traceback and all, into the message, which leaves JSONFormatter nothing to put in 'exception'
+class QueueHandler(logging.handlers.QueueHandler) :
+	def prepare(self, record) :
+		record = copy.copy(record)
+		record.msg = record.message = record.getMessage()
+		record.args = None
+		if record.exc_info :
+			if not record.exc_text :
+				record.exc_text = logging.Formatter().formatException(record.exc_info)
+			record.exc_info = None # (the traceback itself holds on to every frame it went through)
+		return record
+
+# move all of logger's handlers onto a background thread (see above); returns the QueueListener,
+# which is stopped (writing out anything still waiting) when we exit
+def queue(logger) :
+	waiting = queues.SimpleQueue()
+	handlers = list(logger.handlers)
+	for handler in handlers :
+		logger.removeHandler(handler)
+	handler = QueueHandler(waiting)
+	handler.addFilter(ContextFilter())
+	logger.addHandler(handler)
+	listener = logging.handlers.QueueListener(waiting, *handlers, respect_handler_level=True)
+	listener.start()
+	atexit.register(listener.stop)
+	return listener
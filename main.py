@@ -1,37 +1,103 @@
-# Reply to any submission in 'subName' that's a Twitter link
+# Reply to any submission in our subreddits ('subreddits') that's a Twitter link
+
+import time
+startup_timings = {} # how long each step of starting up took (imports, logins), in seconds, so we can see where the time goes
+_imports_started = time.perf_counter()
 
 import praw # reddit api wrapper
 import prawcore # some praw exceptions inherit from here
-import tweepy # twitter api wrapper
-import imgurpython # imgur api wrapper
-from imgurpython.helpers.error import ImgurClientError # imgurpython errors
-# from gfycat.client import GfycatClient # gfycat api wrapper
-# from gfycat.error import GfycatClientError # gfycat api errors
-from gfypy import Gfypy
-from gfypy import GfypyException
+# tweepy (twitter), imgurpython (imgur) and gfypy (gfycat) are only imported
+# when we first need them, since a lot of runs never touch some of them
 import login # our custom login object for all the api's we need
 import paths # links to custom paths (e.g. for the log files)
 import re
-import regex # one of the regex patterns we need to use requires a possessive quantifier, which the 're' library doesn't support. This library does.
-import time
-import multiprocessing # only using this to time-out the big url regex in case of catastrophic backtracking
-import queue as queueError # for queue.empty exception
+import contextlib
+from urlfinder import URLFinder # pool of worker processes to run the big url regex in, so we can time it out
+from redirects import RedirectResolver # follows redirects on lots of urls at once
+from cache import Cache # persistent cache of things we've already looked up
+from health import HealthCheck # health check for daemon mode
+import metrics # timings and counts for every stage of a run and every service we talk to
+import ratelimit # staying within every service's rate limits
+import sessions # one pool of HTTP connections for every request we make ourselves
+import logs # logging on a background thread, with context
+import streamable # rehosting videos on streamable, which can take a while
+import render # rendering the text of our replies
+from store import RepliedStore, Checkpoints # everything we've already replied to, and where we got to last time
+import scheduler # sharing our time between several subreddits
+import forest # going through a thread's comments without loading them all at once
+import domains # which urls are tweets, and which might redirect to one
+from workqueue import WorkQueue, workerName # sharing work between several copies of the bot
 import requests
-import json # to display data for debugging
-from pprint import pprint
 import warnings
 import logging
 import logging.handlers
 import os
 import sys
+import signal
+import threading
+import concurrent.futures
+import collections
+import tempfile
+import hashlib
+import urllib.parse
+import argparse
 from dotenv import load_dotenv
 load_dotenv()
+startup_timings['imports'] = time.perf_counter() - _imports_started
 
 # set some global variables
 botName = 'FleetFlotTheTweetBot' # our reddit username
-subName = os.environ['SUB_NAME'] # subreddit
-num_threads = int(os.environ['NUM_THREADS']) # the number of recent threads to check
+# the subreddits we look after, and the number of recent threads to check in each, e.g. SUBREDDITS="minnesotavikings:25,nfl:10"
+# (or just the one, SUB_NAME, checking NUM_THREADS threads)
+subreddits = scheduler.parseSubreddits(os.getenv('SUBREDDITS', ''), int(os.getenv('NUM_THREADS', 10))) or {os.environ['SUB_NAME'] : int(os.environ['NUM_THREADS'])}
+subName = '+'.join(subreddits) # all of our subreddits at once, the way reddit understands it (e.g. for streams)
+activity_decay = 0.5 # how much of a subreddit's past activity still counts after each run, when deciding how busy it is
 url_logging_truncate = 50
+url_log_sample = float(os.getenv('URL_LOG_SAMPLE', 1)) # the share of comments we log every url we find in at DEBUG level (see url_logger)
+log_format = os.getenv('LOG_FORMAT', 'text') # 'text', or 'json' for JSON lines
+url_workers = int(os.getenv('URL_WORKERS', 1)) # the number of worker processes to run the url regex in
+url_timeout = 2 # how many seconds the url regex gets per comment before we give up on it
+url_extractor = os.getenv('URL_EXTRACTOR', 'tokenizer') # 'tokenizer' (fast, and gives the same results as regex_url) or 'regex' (regex_url itself, in the worker processes)
+resolve_workers = int(os.getenv('RESOLVE_WORKERS', 8)) # the number of urls we'll follow redirects on at the same time
+resolve_timeout = float(os.getenv('RESOLVE_TIMEOUT', 10)) # how many seconds we'll wait for any one url to resolve
+daemon_poll = float(os.getenv('DAEMON_POLL', 5)) # in daemon mode, how many seconds to wait between checks for new submissions/comments
+daemon_max_backoff = float(os.getenv('DAEMON_MAX_BACKOFF', 300)) # in daemon mode, the longest we'll wait before reconnecting to reddit after an error
+health_port = int(os.environ['HEALTH_PORT']) if os.getenv('HEALTH_PORT') else None # local port to serve the daemon's health check on
+health_file = os.getenv('HEALTH_FILE') # file to write the daemon's health check to
+temp_dir = os.getenv('TEMP_DIR', 'temp') # where gifs are downloaded to on their way to gfycat
+max_download_bytes = int(os.getenv('MAX_DOWNLOAD_BYTES', 100*1024*1024)) # we won't download anything bigger than this
+download_timeout = float(os.getenv('DOWNLOAD_TIMEOUT', 30))
+streamable_api = os.getenv('STREAMABLE_API', 'https://api.streamable.com')
+streamable_wait = float(os.getenv('STREAMABLE_WAIT', 120)) # at the end of a run, how many seconds we'll wait for streamable to finish any videos before leaving them for next time
+metrics_file = os.getenv('METRICS_FILE') # file to write metrics to at the end of each run (JSON if it ends in .json, otherwise a Prometheus textfile)
+metrics_port = int(os.environ['METRICS_PORT']) if os.getenv('METRICS_PORT') else None # local port to serve metrics on in daemon mode
+state_db = os.getenv('STATE_DB', paths.logs + 'state.db') # SQLite file where we keep caches and anything else that should outlive a run
+worker_name = os.getenv('WORKER_NAME') or workerName() # who we are when sharing work (and replies) with other copies of the bot
+worker_lease = float(os.getenv('WORKER_LEASE', 600)) # how many seconds a worker has to finish a piece of work (or a reply) before someone else can take it over
+worker_rediscover = float(os.getenv('WORKER_REDISCOVER', 60)) # with --worker, how many seconds between checks of each subreddit for its newest submissions
+worker_max_attempts = 5 # with --worker, how many times we'll try a piece of work that keeps failing before giving up on it
+own_replies_ttl = 600 # how many seconds we go by our list of our own comments for, when checking whether we've already replied to something
+max_comments_held = int(os.getenv('MAX_COMMENTS_HELD', 1000)) # how many of a thread's comments we hold onto at once while checking them
+comment_batch_size = 100 # how many comments from the comment feed we check at a time (before giving another subreddit a turn)
+comment_max_age = float(os.getenv('COMMENT_MAX_AGE', 24*60*60)) # we don't reply to comments older than this many seconds
+
+# regex url to parse any url out of the given text;
+# the following regex pattern was taken from https://mathiasbynens.be/demo/url-regex (@gruber v2)
+# and modified to work in python; also added a check to not match * at the end
+# specifically in case a url is put in reddit italics/bold markup.
+# I uh... I hope this doesn't break any legit urls...
+# also added another '+' after the second '+' quantifier to make it possessive
+regex_url = r"(?i)\b((?:[a-z][\w-]+:(?:\/{1,3}|[a-z0-9%])|www\d{0,3}[.]|[a-z0-9.\-]++[.][a-z]{2,4}\/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'\"\*.,<>?«»“”‘’]))" # find any url
+regex_tweet = domains.regex_tweet # a link to a tweet (on twitter.com or x.com)
+regex_tweet_id = re.compile(r"(?<=\/status\/)(\d+)") # regex pattern to find the tweet id from the url
+pattern_twitter = re.compile("^https?:\/\/(www\.|mobile\.)?(twitter|x)\.com") # submissions that link to twitter
+tweet_batch_size = 100 # the most tweets twitter will let us look up in one request
+media_workers = { # how many uploads we'll run at the same time on each service
+	'imgur' : int(os.getenv('MEDIA_WORKERS_IMGUR', 4)),
+	'gfycat' : int(os.getenv('MEDIA_WORKERS_GFYCAT', 2)),
+	'streamable' : int(os.getenv('MEDIA_WORKERS_STREAMABLE', 2)),
+}
+media_slots = {service : threading.BoundedSemaphore(max(1, workers)) for service, workers in media_workers.items()}
 
 # turn off some warnings
 warnings.simplefilter("ignore", ResourceWarning) # ignore resource warnings
@@ -40,10 +106,16 @@ warnings.simplefilter("ignore", ResourceWarning) # ignore resource warnings
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# the format for the logs: plain text, or with LOG_FORMAT=json, JSON lines (with the submission and comment ids as fields)
+def logFormatter() :
+	if log_format == 'json' :
+		return logs.JSONFormatter()
+	return logging.Formatter('%(asctime)s %(levelname)s - %(message)s')
+
 # timed rotating handler to log to file at DEBUG level, rotate every 1 MB
 debug_handler = logging.handlers.RotatingFileHandler(paths.logs + 'debug_log.log', mode='a', maxBytes=1000000, backupCount=1, encoding=None, delay=False)
 debug_handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s %(levelname)s - %(message)s')
+formatter = logFormatter()
 debug_handler.setFormatter(formatter)
 logger.addHandler(debug_handler)
 
@@ -56,17 +128,29 @@ logger.addHandler(debug_stream_handler)
 # timed rotating handler to log to file at INFO level, rotate every 1 MB
 main_handler = logging.handlers.RotatingFileHandler(paths.logs + 'main_log.log', mode='a', maxBytes=1000000, backupCount=10, encoding=None, delay=False)
 main_handler.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s %(levelname)s - %(message)s')
+formatter = logFormatter()
 main_handler.setFormatter(formatter)
 logger.addHandler(main_handler)
 
 # handler to log to a different file at ERROR level, rotate every 1 MB
 error_handler = logging.handlers.RotatingFileHandler(paths.logs + 'error_log.log', mode='a', maxBytes=1000000, backupCount=1, encoding=None, delay=False)
 error_handler.setLevel(logging.ERROR)
-formatter = logging.Formatter('%(asctime)s %(levelname)s - %(message)s')
+formatter = logFormatter()
 error_handler.setFormatter(formatter)
 logger.addHandler(error_handler)
 
+logger.addHandler(metrics.LogCounter(metrics.registry)) # count warnings and errors
+
+# the files and stdout are written on a background thread, so we never wait on them (see logs.py)
+logs.queue(logger)
+
+# the messages about every url we find are the bulk of the debug log on a big thread; URL_LOG_SAMPLE
+# keeps them for only a share of comments (e.g. 0.1), or none at all (0)
+url_logger = logger.getChild('urls')
+url_logger.addFilter(logs.SampleFilter(url_log_sample))
+if url_log_sample <= 0 :
+	url_logger.setLevel(logging.INFO)
+
 # separate handler to log the ID of each submission we comment on, rotate every 1 MB
 comment_logger = logging.getLogger('comments')
 comment_logger.setLevel(logging.INFO)
@@ -76,38 +160,142 @@ formatter = logging.Formatter('%(message)s')
 comment_handler.setFormatter(formatter)
 comment_logger.addHandler(comment_handler)
 
+# cache of where urls found in comments redirect to;
+# shortlinks basically never change where they point, but a failure might be temporary, so we only remember those for a little while
+redirect_cache = Cache(state_db, 'redirects',
+	ttl=float(os.getenv('REDIRECT_CACHE_TTL', 30*24*60*60)),
+	negative_ttl=float(os.getenv('REDIRECT_CACHE_NEGATIVE_TTL', 60*60)),
+	max_entries=int(os.getenv('REDIRECT_CACHE_SIZE', 100000)))
+resolver = RedirectResolver(max_workers=resolve_workers, timeout=resolve_timeout, cache=redirect_cache,
+	stop=lambda url: domains.classify(url) != domains.SHORTENER) # (once a link is off the shorteners, we know whether it's a tweet)
+
+# links in tweet text are followed all the way, since the url they end up at is what we put in the reply;
+# they have a cache of their own, so they never get (or give) an answer from a comment's url that stopped short
+link_cache = Cache(state_db, 'links',
+	ttl=float(os.getenv('REDIRECT_CACHE_TTL', 30*24*60*60)),
+	negative_ttl=float(os.getenv('REDIRECT_CACHE_NEGATIVE_TTL', 60*60)),
+	max_entries=int(os.getenv('REDIRECT_CACHE_SIZE', 100000)))
+link_resolver = RedirectResolver(max_workers=resolve_workers, timeout=resolve_timeout, cache=link_cache)
+
+# ids of every submission we've replied to (starting with whatever's in the comment log, the first time)
+replied = RepliedStore(state_db, legacy_log=paths.logs + 'comment_log.log')
+
+# how far we got in each submission last time, so we only scan what's new
+checkpoints = Checkpoints(state_db)
+
+# tweets we've already fetched (as the raw json twitter gave us), so a tweet that gets linked
+# over and over again only costs us one request; a tweet we couldn't find is remembered for a little while too
+tweet_cache = Cache(state_db, 'tweets',
+	ttl=float(os.getenv('TWEET_CACHE_TTL', 24*60*60)),
+	negative_ttl=float(os.getenv('TWEET_CACHE_NEGATIVE_TTL', 60*60)),
+	max_entries=int(os.getenv('TWEET_CACHE_SIZE', 20000)))
+
+# media we've already rehosted, keyed by the url of the original on twitter, so the same
+# pic/gif/video showing up in another thread doesn't get uploaded all over again
+media_cache = Cache(state_db, 'media',
+	ttl=float(os.getenv('MEDIA_CACHE_TTL', 30*24*60*60)),
+	max_entries=int(os.getenv('MEDIA_CACHE_SIZE', 20000)))
+
+# streamable imports we're still waiting on, and the comments we'll need to edit once they're done
+video_tracker = streamable.VideoTracker(state_db, streamable_api,
+	requests.auth.HTTPBasicAuth(login.loginStreamable.username,login.loginStreamable.password), logger=logger.getChild('streamable'))
+
+# time how long something takes while we're starting up, and add it to startup_timings
+_timings_lock = threading.Lock()
+@contextlib.contextmanager
+def timed(name) :
+	started = time.perf_counter()
+	try:
+		yield
+	finally:
+		with _timings_lock : # (logins can happen on the media threads)
+			startup_timings[name] = startup_timings.get(name, 0) + time.perf_counter() - started
+
+# log how long starting up took, broken down by step
+def logStartupTimings() :
+	with _timings_lock :
+		timings = dict(startup_timings)
+	logger.info('Startup timing: %s', ', '.join(f"{name} {seconds*1000:.0f}ms" for name, seconds in timings.items()))
+
+# We only log into each service the first time we actually need it
+# (plenty of runs never need to rehost anything, for instance)
+_reddit = None
+_twitter = None
+_imgur = None
+_gfycat = None
+_login_errors = {} # if we couldn't log into imgur/gfycat, remember why, so we don't keep trying for the rest of the run
+# the media workers can all need the same service at once, so only one of them logs in (and the rest wait for it)
+_login_locks = {name : threading.Lock() for name in ('reddit', 'twitter', 'imgur', 'gfycat')}
+
 # login to reddit
-try:
-	r = login.reddit() # login to our account
-	logger.debug("Successfully logged into reddit")
-except praw.exceptions.PRAWException as e:
-	logger.critical('EXITING! Couldn\'t log in to reddit: %s %s',e.message,e.url)
-	raise SystemExit('Quitting - could not log in to Reddit!') # if we can't deal with reddit, just stop altogether, and let it try again next time
+def reddit() :
+	global _reddit
+	if _reddit is None :
+		with _login_locks['reddit'] :
+			if _reddit is None : # (someone else may have logged in while we waited)
+				try:
+					with timed('login reddit'):
+						_reddit = login.reddit() # login to our account
+					logger.debug("Successfully logged into reddit")
+				except praw.exceptions.PRAWException as e:
+					logger.critical('EXITING! Couldn\'t log in to reddit: %s %s',e.message,e.url)
+					raise SystemExit('Quitting - could not log in to Reddit!') # if we can't deal with reddit, just stop altogether, and let it try again next time
+	return _reddit
 
 # login to twitter
-try:
-	t = login.twitter() # login and get the twitter object
-	logger.debug("Successfully logged into Twitter")
-except tweepy.TweepError as e:
-	logger.critical('EXITING! Couldn\'t log in to Twitter: %s',str(e))
-	raise SystemExit('Quitting - could not log in to Twitter!') # if we can't deal with Twitter, just stop altogether, and let it try again next time
+def twitter() :
+	global _twitter
+	if _twitter is None :
+		with _login_locks['twitter'] :
+			if _twitter is None : # (someone else may have logged in while we waited)
+				with timed('import tweepy'):
+					import tweepy # twitter api wrapper
+				try:
+					with timed('login twitter'):
+						_twitter = login.twitter() # login and get the twitter object
+					logger.debug("Successfully logged into Twitter")
+				except tweepy.TweepError as e:
+					logger.critical('EXITING! Couldn\'t log in to Twitter: %s',str(e))
+					raise SystemExit('Quitting - could not log in to Twitter!') # if we can't deal with Twitter, just stop altogether, and let it try again next time
+	return _twitter
 
 # login to imgur
-try:
-	i = login.imgur() # login and get the imgur object
-	logger.debug("Successfully logged into Imgur")
-except ImgurClientError as e:
-	logger.critical('EXITING! Couldn\'t log in to Imgur: %s',str(e))
-	raise SystemExit('Quitting - could not log in to Imgur!') # if we can't deal with Imgur, just stop altogether, and let it try again next time
+# if we can't, the exception (usually an ImgurClientError) is raised, just like an error uploading would be
+def imgur() :
+	global _imgur
+	if _imgur is None :
+		with _login_locks['imgur'] :
+			if _imgur is None : # (someone else may have logged in while we waited)
+				if 'imgur' in _login_errors :
+					raise _login_errors['imgur']
+				try:
+					with timed('login imgur'): # (which is also when imgurpython gets imported)
+						_imgur = login.imgur() # login and get the imgur object
+					logger.debug("Successfully logged into Imgur")
+				except Exception as e:
+					logger.error('Couldn\'t log in to Imgur: %s',str(e))
+					_login_errors['imgur'] = e
+					raise
+	return _imgur
 
 # login to gfycat
-try:
-	g = login.gfycat() # login and get the gfycat object
-	logger.debug("Successfully logged into gfycat")
-except Exception as e:
-	logger.critical('EXITING! Couldn\'t log in to Gfycat: %s',str(e))
-	raise SystemExit('Quitting - could not log in to Gfycat!') # if we can't deal with Gfycat, just stop altogether, and let it try again next time
-
+# if we can't, the exception is raised, just like an error uploading would be
+def gfycat() :
+	global _gfycat
+	if _gfycat is None :
+		with _login_locks['gfycat'] :
+			if _gfycat is None : # (someone else may have logged in while we waited)
+				if 'gfycat' in _login_errors :
+					raise _login_errors['gfycat']
+				try:
+					with timed('login gfycat'): # (which is also when gfypy gets imported)
+						_gfycat = login.gfycat() # login and get the gfycat object
+					logger.debug("Successfully logged into gfycat")
+				except Exception as e:
+					logger.error('Couldn\'t log in to Gfycat: %s',str(e))
+					_login_errors['gfycat'] = e
+					raise
+	return _gfycat
 
 
 
@@ -115,143 +303,592 @@ def main() :
 	# find any submissions in this subreddit that are links to twitter.com
 	# and reply to them; then loop through all comments in that submission
 	# and reply to any twitter links found therein
+	url_finder = URLFinder(regex_url, timeout=url_timeout, num_workers=url_workers, extractor=url_extractor)
 	try:
-		subreddit = r.subreddit(subName)
+		url_finder.start() # start the workers up front, so they're warm by the time we have comments to give them
+		resolver.start()
+		video_tracker.start() # check on any streamable videos left over from last time (and any new ones) in the background
 		logger.debug(f"logging into r/{subName}...")
-		# loop through submissions
-		for s in subreddit.new(limit=num_threads) : # check the newest num_threads submissions
-			logger.debug('\n====================================================================================================')
-			logger.debug('SUBMISSION TITLE: %s',s.title)
-			pattern = re.compile("^https?:\/\/(www\.|mobile\.)?twitter\.com")
-
-			########-------- Reply to Submission --------########
-			logger.debug('Checking submission itself for Twitter link...')
-			# if the domain is twitter.com and we haven't already commented, proceed
-			if pattern.match(s.url) is not None and not alreadyDone(s) :
-				# create reply
-				reply = composeReply(s.url,s.id)
-				#reply = None
-
-				# post comment as a top-level reply to the submission
-				# (if there was a serious error in composeReply
-				# it will just return None, and we won't reply)
-				if reply is not None :
-					try:
-						s.reply(reply) # post comment to reddit
-					except praw.exceptions.RedditAPIException as e:
-						# for subexception in e.items:
-						# 	print(subexception.error_type)
-						logger.error('%s - Could not comment: %s',s.id,e.items)
-					except praw.exceptions.PRAWException as e:
-						logger.error('%s - Could not comment: %s',s.id,str(e))
-					except AttributeError as e:
-						logger.error('%s - Could not comment. I have no idea why: %s',s.id,str(e), exc_info=True)
-					else:
-						logger.info("Successfully added comment on %s!",s.id)
-						comment_logger.info(s.id) # log the ID of this submission to check against next time
-
-			########-------- Reply to Comments --------########
-			logger.debug('Checking this submission\'s comments for Twitter links...')
-			s.comments.replace_more(limit=None)
-			# loop through all comments in this submission
-			for comment in s.comments.list() :
-				#logger.info('#### Comment id: %s (submission %s) ####',comment.id,comment.submission.id)# + '\n' + comment.body + '\n------------')
-				# regex url to parse any url out of the given text;
-				# the following regex pattern was taken from https://mathiasbynens.be/demo/url-regex (@gruber v2)
-				# and modified to work in python; also added a check to not match * at the end
-				# specifically in case a url is put in reddit italics/bold markup.
-				# I uh... I hope this doesn't break any legit urls...
-				# also added another '+' after the second '+' quantifier to make it possessive
-				regex_url = r"(?i)\b((?:[a-z][\w-]+:(?:\/{1,3}|[a-z0-9%])|www\d{0,3}[.]|[a-z0-9.\-]++[.][a-z]{2,4}\/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'\"\*.,<>?«»“”‘’]))" # find any url
-				regex_tweet = r"https?:\/\/(?:www\.|mobile\.)?twitter\.com\/\w{1,15}\/status\/\d+"
-
-				# Find urls in text; we use a separate process for this
-				# simply so that we can time it out after a while;
-				# since the regex is so unwieldy and the text unpredictable,
-				# we run the risk of catastrophic backtracking;
-				# I've done my best to stop that from happening, but
-				queue = multiprocessing.Queue()
-				p = multiprocessing.Process(target=findURLs, args=(regex_url, comment.body, queue))
-				p.start()
-				p.join(2) # Wait for 2 seconds or until process finishes
-				# If thread is still active
-				if p.is_alive():
-					logger.error("    Regex to find url on %s in %s was taking too long; skipping this comment",comment.id,comment.submission.id)
-					# Terminate
-					p.terminate()
-					p.join()
-				try :
-					urls = queue.get_nowait()
-				except queueError.Empty as e :
-					urls = []
-					
-				if len(urls) > 0 :
-					logger.debug(f"    Found the following URLs in this comment:")
-					for u in urls:
-						logger.debug(f"      {u[:url_logging_truncate]}")
-
-				# loop through any urls and see if any resolve into twitter status (tweet) links
-				tweet_links = []
-				for url in urls :
-					logger.debug("    ----------")
-					logger.debug(f"    checking url {str(url[0])}")
-					url = url[0] # the list of urls is actually a list of tuples, and we just want the first string within the tuple, which is the url itself
-
-					queue = multiprocessing.Queue()
-					p = multiprocessing.Process(target=resolveRedirects, args=(url, queue))
-					p.start()
-					p.join(10) # Wait for 10 seconds or until process finishes
-					# If thread is still active
-					if p.is_alive():
-						logger.error(f"    Resolving redirects timed out")
-						# Terminate
-						p.terminate()
-						p.join()
-					try :
-						resolved_url = queue.get_nowait()
-					except queueError.Empty as e :
-						resolved_url = url
-
-
-					try :
-						# test to see if the resolved url is a twitter link
-						logger.debug(f"    checking if {resolved_url[:url_logging_truncate]}... is a tweet link...")
-						tweet_links.append(re.match(regex_tweet,resolved_url).group(0))
-						logger.debug(f"    {resolved_url[:url_logging_truncate]}... is a tweet link!")
-					except AttributeError as e :
-						logger.debug(f"    {resolved_url[:url_logging_truncate]}... is NOT a tweet link")
-					except TypeError as e :
-						logger.debug(f"    error appending tweet link: {str(e)}")
-						#tweet_links.append(re.match(regex_tweet,url).group(0))
-
-					#except :
-				if tweet_links : # if tweet_links is not empty
-					logger.info('#### Comment ID: %s (Submission %s) ####',comment.id,comment.submission.id)
-					logger.info('    Found tweet links! (not commenting yet though) %s', str(tweet_links))
-
-				# now loop through any twitter links we found in this comment
-				# and post replies to them
-				for tweet_link in tweet_links :
-					logger.debug("looping through any twitter links we found and (not) commenting on them")
-					# will have to modify alreadyDone() to be able to handle comments
-					# particularly, it'll have to somehow handle the possibility of multiple replies
-					# in the case that there are multiple links to reply to
-					# if not alreadyDone(comment) :
-					# 	composeReply(tweet_link, s.id, comment.id)
-					pass
-					
+		checkSubreddits(url_finder)
+		logStartupTimings()
+
+		# give streamable a little while to finish any videos before we go; anything it
+		# doesn't finish in time will get picked up next run
+		video_tracker.wait(streamable_wait)
+		finishVideos()
 	except prawcore.exceptions.OAuthException as e:
 		logger.critical('EXITING! Could not log in to reddit: %s',str(e))
 		raise SystemExit('Quitting - could not log in to reddit') # if we can't deal with reddit, just stop altogether, and let it try again next time
 	except prawcore.PrawcoreException as e:
 		logger.critical('EXITING! Could not get subreddit/submissions: %s',str(e))
 		raise SystemExit('Quitting - could not get subreddit/submissions') # if we can't deal with reddit, just stop altogether, and let it try again next time
+	finally:
+		url_finder.close()
+		resolver.close()
+		link_resolver.close()
+		video_tracker.stop()
+		writeMetrics()
+		logRateLimits()
+		logConnections()
+
+# returns an event that gets set when we're asked to stop (SIGTERM, or Ctrl-C)
+def stopOnSignals() :
+	stopping = threading.Event()
+	def stop(signum, frame) :
+		logger.info('Got signal %s; shutting down once we finish what we\'re doing', signum)
+		stopping.set()
+	signal.signal(signal.SIGTERM, stop)
+	signal.signal(signal.SIGINT, stop)
+	return stopping
+
+# run forever, reacting to new submissions and comments as they come in, rather than checking once and exiting
+def daemon() :
+	stopping = stopOnSignals()
+
+	health = HealthCheck(max_age=max(60, daemon_poll * 10), port=health_port, heartbeat_file=health_file, details=lambda : {'rate_limits' : ratelimit.usage(), 'http' : sessions.usage()}).start()
+	url_finder = URLFinder(regex_url, timeout=url_timeout, num_workers=url_workers, extractor=url_extractor)
+	backoff = daemon_poll
+	try:
+		if metrics_port is not None :
+			metrics.registry.serve(metrics_port)
+		url_finder.start()
+		resolver.start()
+		video_tracker.start()
+		subreddit = reddit().subreddit(subName)
+		logger.info(f"Starting daemon for r/{subName}...")
+		logStartupTimings()
+		caught_up = False
+		while not stopping.is_set() :
+			try:
+				# first catch up on anything that happened while we weren't running,
+				# then just watch for whatever's new from here on
+				if not caught_up :
+					checkSubreddits(url_finder, progress=health.beat, stopping=stopping) # (this can take a while, but we're not stuck)
+					caught_up = True
+				# (not skip_existing: anything posted while we were catching up would be skipped as 'existing';
+				# the streams start with the newest 100 of each instead, and whatever we've seen already is skipped as usual)
+				submissions = subreddit.stream.submissions(pause_after=-1)
+				comments = subreddit.stream.comments(pause_after=-1)
+				while not stopping.is_set() :
+					# each time round, the streams make one request each and give us whatever's new (then None)
+					new_submissions = []
+					with ratelimit.call('reddit') :
+						for s in submissions :
+							if s is None :
+								break
+							new_submissions.append(s)
+					for s in new_submissions :
+						if stopping.is_set() :
+							break
+						logger.debug('New submission: %s', s.id)
+						with logs.context(submission=s.id) :
+							replyToSubmission(s)
+					new_comments = []
+					with ratelimit.call('reddit') :
+						for comment in comments :
+							if comment is None :
+								break
+							new_comments.append(comment)
+					redditLimits()
+					if new_comments and not stopping.is_set() :
+						logger.debug('%d new comments', len(new_comments))
+						checkComments(new_comments, url_finder)
+					finishVideos()
+					health.beat()
+					writeMetrics()
+					backoff = daemon_poll # we're connected fine, so reset the backoff
+					stopping.wait(daemon_poll)
+			except prawcore.exceptions.OAuthException as e:
+				logger.critical('EXITING! Could not log in to reddit: %s',str(e))
+				raise SystemExit('Quitting - could not log in to reddit') # no point reconnecting if our credentials are bad
+			except prawcore.PrawcoreException as e:
+				# reddit is having a bad time; wait a bit (longer each time it keeps happening) and reconnect
+				logger.error('Lost connection to reddit, reconnecting in %d seconds: %s', backoff, str(e))
+				health.error(e)
+				caught_up = False # catch up on anything we missed while we were disconnected
+				stopping.wait(backoff)
+				backoff = min(backoff * 2, daemon_max_backoff)
+		logger.info('Daemon stopped')
+	finally:
+		url_finder.close()
+		resolver.close()
+		link_resolver.close()
+		video_tracker.stop()
+		health.stop()
+		metrics.registry.stop()
+		writeMetrics()
+		logRateLimits()
+		logConnections()
+
+# run forever as one of any number of workers sharing the same database (STATE_DB): checking each subreddit
+# for its newest submissions, and checking each of those submissions, are work items in a shared queue
+# (see workqueue.py), which whichever worker is free picks up; if a worker dies, its work goes to someone else
+def worker() :
+	stopping = stopOnSignals()
+	queue = WorkQueue(state_db, lease=worker_lease, worker=worker_name)
+	health = HealthCheck(max_age=max(60, worker_lease), port=health_port, heartbeat_file=health_file, details=lambda : {'rate_limits' : ratelimit.usage(), 'http' : sessions.usage(), 'work' : queue.stats()}).start()
+	url_finder = URLFinder(regex_url, timeout=url_timeout, num_workers=url_workers, extractor=url_extractor)
+	backoff = daemon_poll
+	try:
+		if metrics_port is not None :
+			metrics.registry.serve(metrics_port)
+		url_finder.start()
+		resolver.start()
+		video_tracker.start()
+		for name in subreddits :
+			queue.put('subreddit:' + name, 'subreddit', name) # (unless another worker already has)
+		logger.info('Starting worker %s for r/%s...', worker_name, subName)
+		logStartupTimings()
+		while not stopping.is_set() :
+			item = queue.lease()
+			if item is None : # nothing to do right now
+				finishVideos()
+				health.beat()
+				writeMetrics()
+				stopping.wait(daemon_poll)
+				continue
+			try:
+				doWork(item, queue, url_finder)
+			except prawcore.exceptions.OAuthException as e:
+				queue.release(item)
+				logger.critical('EXITING! Could not log in to reddit: %s',str(e))
+				raise SystemExit('Quitting - could not log in to reddit')
+			except prawcore.PrawcoreException as e:
+				# reddit is having a bad time; put this back for later, and wait a bit (longer each time it keeps happening)
+				logger.error('Lost connection to reddit working on %s, waiting %d seconds: %s', item.key, backoff, str(e))
+				health.error(e)
+				queue.release(item, delay=backoff)
+				stopping.wait(backoff)
+				backoff = min(backoff * 2, daemon_max_backoff)
+			except Exception as e:
+				health.error(e)
+				if item.attempts >= worker_max_attempts :
+					logger.error('Giving up on %s after %d attempts: %s', item.key, item.attempts, str(e), exc_info=True)
+					queue.ack(item)
+				else :
+					logger.error('Error working on %s (attempt %d), trying again later: %s', item.key, item.attempts, str(e), exc_info=True)
+					queue.release(item, delay=daemon_poll * 2 ** item.attempts)
+			else :
+				backoff = daemon_poll
+				finishVideos()
+				health.beat()
+		logger.info('Worker stopped')
+	finally:
+		url_finder.close()
+		resolver.close()
+		link_resolver.close()
+		video_tracker.stop()
+		health.stop()
+		metrics.registry.stop()
+		writeMetrics()
+		logRateLimits()
+		logConnections()
+
+# do one item of work from the queue, and ack it
+def doWork(item, queue, url_finder) :
+	if item.kind == 'subreddit' :
+		name = item.payload
+		if name not in subreddits : # we don't look after this one any more
+			queue.ack(item)
+			return
+		with metrics.timer('stage', stage='discovery'), metrics.timer('api', service='reddit', call='new'), ratelimit.call('reddit') :
+			submissions = list(reddit().subreddit(name).new(limit=subreddits[name]))
+		redditLimits()
+		feed = commentFeed(name)
+		# fetch the tweets we might be replying with while we have them all together (the cache is shared, so whoever replies gets them)
+		prefetchTweets(s.url for s in submissions if pattern_twitter.match(s.url) is not None and s.id not in replied)
+		for s in submissions :
+			# (if the comment feed has all the new comments, whoever checks a submission only has to look at the submission itself)
+			queue.put('submission:' + s.id, 'post' if feed.complete else 'submission', s.id) # (unless it's already waiting, or being checked)
+		if feed.complete :
+			checkComments(feed.comments, url_finder)
+		if feed.newest is not None :
+			checkpoints.setState('newest_comment:' + name, feed.newest)
+		queue.ack(item, again=worker_rediscover)
+	elif item.kind in ('submission', 'post') :
+		with metrics.timer('api', service='reddit', call='submission'), ratelimit.call('reddit') :
+			s = reddit().submission(item.payload)
+			s.comment_limit = max_comments_held
+			s.num_comments # (praw fetches the submission the first time we look at it)
+		# a big thread can take longer than a lease, so keep extending ours as we go
+		def progress() :
+			if not queue.extend(item) :
+				logger.warning('Our lease on %s ran out; someone else may be checking it too', item.key)
+		with logs.context(submission=s.id) :
+			checkSubmission(s, url_finder, comments=item.kind == 'submission', progress=progress)
+		if not queue.ack(item) :
+			logger.warning('Took too long checking %s; someone else may have checked it too', item.key)
+	else :
+		logger.error('Unknown kind of work: %s', item.kind)
+		queue.ack(item)
+
+# log how much of each service's rate limit we've used, and how long we spent waiting on them
+def logRateLimits() :
+	for name, usage in ratelimit.usage().items() :
+		logger.info('Rate limit %s: %d calls, waited %d times (%.1fs), rate limited %d times, %s left', name, usage['calls'], usage['waits'], usage['waited'], usage['throttles'],
+			'unknown' if usage['remaining'] is None else f"{usage['remaining']:.0f} (resets in {usage['resets_in']:.0f}s)")
+
+# log how many requests we made to each host, and how many of them reused a connection that was already open
+def logConnections() :
+	for host, usage in sessions.usage().items() :
+		logger.info('HTTP %s: %d requests over %d connections (%d reused)', host, usage['requests'], usage['connections'], usage['reused'])
+
+# tell the rate limiter what reddit says is left of our budget (praw keeps track of it from the headers)
+def redditLimits() :
+	limits = getattr(getattr(reddit(), 'auth', None), 'limits', None) or {}
+	ratelimit.update('reddit', limits.get('remaining'), limits.get('reset_timestamp'))
+
+# write out the metrics, if we've been asked to
+def writeMetrics() :
+	if metrics_file is None :
+		return
+	try:
+		metrics.registry.write(metrics_file)
+	except OSError as e:
+		logger.error('Could not write metrics to %s: %s', metrics_file, str(e))
+
+# check the newest submissions in each of our subreddits (as many as each one's limit), and every comment
+# since last time, sharing our time between them, with the busiest ones first (see scheduler.py)
+# progress (optional) is called after each submission or batch of comments (and each chunk of a big thread's comments),
+# to show we're still getting somewhere; stopping (optional) is an event that, once set, stops us between them
+def checkSubreddits(url_finder, progress=None, stopping=None) :
+	schedule = scheduler.FairScheduler()
+	feeds = {}
+	activity = {} # how many new comments we looked at in each subreddit this time
+	for name, limit in subreddits.items() :
+		with metrics.timer('stage', stage='discovery'), metrics.timer('api', service='reddit', call='new'), ratelimit.call('reddit') :
+			submissions = list(reddit().subreddit(name).new(limit=limit)) # check the newest submissions in this subreddit
+		redditLimits()
+		# the comments, from the subreddit's comment feed if it goes back far enough (if not, we go through each submission's comments instead)
+		feeds[name] = commentFeed(name)
+		busy = float(checkpoints.getState('activity:' + name, 0)) # how busy this subreddit has been lately
+		logger.debug('r/%s: %d submissions to check (activity %.1f)', name, len(submissions), busy)
+		schedule.add(name, submissions, weight=busy)
+		if feeds[name].complete :
+			logger.debug('r/%s: %d new comments to check', name, len(feeds[name].comments))
+			schedule.add(name, [feeds[name].comments[n:n + comment_batch_size] for n in range(0, len(feeds[name].comments), comment_batch_size)], weight=busy)
+		activity[name] = 0
+
+	# fetch all the tweets we might be replying with (in any subreddit) in as few requests as we can, up front
+	prefetchTweets(s.url for queue in schedule.queues.values() for s in queue if not isinstance(s, list) and pattern_twitter.match(s.url) is not None and s.id not in replied)
+
+	# loop through submissions (and batches of comments from the comment feed), taking turns between subreddits
+	stopped = False
+	for name, item in schedule :
+		if stopping is not None and stopping.is_set() :
+			logger.info('Stopping before we have checked everything')
+			stopped = True
+			break
+		if isinstance(item, list) : # a batch of comments
+			checkComments(item, url_finder)
+			activity[name] += len(item)
+		else :
+			s = item
+			with logs.context(submission=s.id) :
+				activity[name] += checkSubmission(s, url_finder, comments=not feeds[name].complete, progress=progress)
+		finishVideos() # edit in any streamable videos that finished while we were busy
+		if progress is not None :
+			progress()
+
+	for name in subreddits :
+		if feeds[name].newest is not None and not stopped : # (if we stopped part way, the feed needs to go back as far next time)
+			checkpoints.setState('newest_comment:' + name, feeds[name].newest) # next time, the comment feed only has to go back this far
+		busy = float(checkpoints.getState('activity:' + name, activity[name]))
+		checkpoints.setState('activity:' + name, busy * activity_decay + activity[name] * (1 - activity_decay))
+
+# the comments in subreddit name since last time, newest first, from the subreddit's comment feed; the feed
+# is read back (a page of 100 at a time) until we get to the newest comment we saw last time
+# comments is what we got; complete is whether that's everything since last time (it isn't if we've never
+# done this before, or more comments came in than reddit lists), and newest is the newest one's timestamp
+Feed = collections.namedtuple('Feed', ['comments', 'complete', 'newest'])
+def commentFeed(name) :
+	since = checkpoints.getState('newest_comment:' + name)
+	comments = []
+	complete = False
+	with metrics.timer('stage', stage='discovery'), metrics.timer('api', service='reddit', call='comment_feed'), ratelimit.call('reddit') :
+		# (if we've never done this before, all we need is the newest comment, to start from next time)
+		for comment in reddit().subreddit(name).comments(limit=None if since is not None else 1) :
+			# (comments from that same second get looked at again, in case one came in just after we looked)
+			if since is not None and comment.created_utc < float(since) :
+				complete = True
+				break
+			comments.append(comment)
+	redditLimits()
+	newest = max([comment.created_utc for comment in comments] + ([float(since)] if since is not None else []), default=None)
+	if since is None :
+		return Feed([], False, newest)
+	if not complete :
+		logger.debug('r/%s: the comment feed doesn\'t go back as far as last time; checking each submission\'s comments instead', name)
+	return Feed(comments, complete, newest)
+
+# check a submission for a link to a tweet, and then (unless comments is False, e.g. if we're getting
+# them from the comment feed) check any of its comments we haven't looked at yet;
+# returns how many comments we looked at; progress (optional) is called after each chunk of them
+def checkSubmission(s, url_finder, comments=True, progress=None) :
+	logger.debug('\n====================================================================================================')
+	logger.debug('SUBMISSION TITLE: %s',s.title)
+
+	########-------- Reply to Submission --------########
+	replyToSubmission(s)
+	if not comments :
+		return 0
+
+	########-------- Reply to Comments --------########
+	# if the number of comments hasn't changed since we last scanned this submission, there's nothing new to look at
+	checkpoint = checkpoints.get(s.id)
+	if checkpoint is not None and checkpoint[0] == s.num_comments :
+		logger.debug('No new comments since last time; skipping this submission\'s comments')
+		return 0
+
+	logger.debug('Checking this submission\'s comments for Twitter links...')
+	# go through the comments as they come (fetching more as we need them), a chunk at a time (see forest.py)
+	s.comment_limit = max_comments_held # (how many comments come with the submission itself, if it hasn't been fetched yet)
+	newest_comment = checkpoint[1] if checkpoint is not None else 0
+	count = 0
+	def sinceCheckpoint(comments) :
+		nonlocal newest_comment
+		for comment in comments :
+			newest_comment = max(newest_comment, comment.created_utc)
+			# only look at comments from the newest one we saw last time on
+			# (comments from that same second get looked at again, in case one came in just after we looked)
+			if checkpoint is None or comment.created_utc >= checkpoint[1] :
+				yield comment
+	for chunk in forest.chunks(sinceCheckpoint(forest.walk(s)), max_comments_held) :
+		checkComments(chunk, url_finder)
+		count += len(chunk)
+		if progress is not None :
+			progress()
+	redditLimits()
+	if checkpoint is not None :
+		logger.debug('%d comments since last time', count)
+
+	# we've looked at everything in this submission up to now
+	checkpoints.set(s.id, s.num_comments, newest_comment)
+	return count
+
+# reply to the submission itself, if it's a link to a tweet (and we haven't already)
+def replyToSubmission(s) :
+	logger.debug('Checking submission itself for Twitter link...')
+	# if the domain is twitter.com and we haven't already commented, proceed
+	if pattern_twitter.match(s.url) is not None and not alreadyDone(s) :
+		# make sure nobody else (another worker, or another copy of the bot) is replying to it at the same time
+		if not replied.claim(s.id, worker_name, worker_lease) :
+			logger.debug('Someone else is replying to this submission: %s', s.id)
+			return
+		try:
+			# if whoever claimed it before us never finished, they may have died just after posting (before recording it);
+			# our list of our own comments could be from before then, so look again
+			if replied.tookOver(s.id) :
+				forgetOwnReplies()
+				if alreadyDone(s) :
+					logger.info('%s - Found a reply of ours that was never recorded; not replying again', s.id)
+					return
+			# create reply
+			reply = composeReply(s.url,s.id)
+			#reply = None
+
+			# post comment as a top-level reply to the submission
+			# (if there was a serious error in composeReply
+			# it will just return None, and we won't reply)
+			if reply is not None :
+				try:
+					with metrics.timer('stage', stage='reply'), metrics.timer('api', service='reddit', call='reply'), ratelimit.call('reddit', 'reddit.reply') :
+						posted = s.reply(reply) # post comment to reddit
+				except praw.exceptions.RedditAPIException as e:
+					# for subexception in e.items:
+					# 	print(subexception.error_type)
+					logger.error('%s - Could not comment: %s',s.id,e.items)
+				except praw.exceptions.PRAWException as e:
+					logger.error('%s - Could not comment: %s',s.id,str(e))
+				except AttributeError as e:
+					logger.error('%s - Could not comment. I have no idea why: %s',s.id,str(e), exc_info=True)
+				else:
+					logger.info("Successfully added comment on %s!",s.id)
+					metrics.count('replies')
+					replied.add(s.id) # remember the ID of this submission to check against next time (this also drops our claim)
+					comment_logger.info(s.id) # and log it
+					attachVideos(posted.id, reply) # if any videos are still processing, we'll need to edit this comment later
+		finally:
+			if s.id not in replied :
+				replied.unclaim(s.id, worker_name) # we didn't reply, so let it be tried again
+
+# look for links to tweets in a bunch of comments (from one submission, or from all over the subreddit)
+def checkComments(comments, url_finder) :
+	# Find urls in the text of every comment; normally that's done with a tokenizer that
+	# gives the same results as the url regex, in linear time (see urlfinder.py);
+	# the regex itself, if we use it, runs in a pool of worker processes simply
+	# so that we can time it out after a while; since the regex is so unwieldy
+	# and the text unpredictable, we run the risk of catastrophic backtracking
+	comments = list(comments)
+	metrics.count('comments_checked', len(comments))
+	with metrics.timer('stage', stage='findURLs') :
+		found_urls = url_finder.findall(comment.body for comment in comments)
+	# (if the regex took too long on a comment, we get None instead of a list of urls)
+
+	# follow redirects on every url found in these comments that might redirect to a tweet (i.e. is on a url shortener),
+	# all at once; anything else is either a tweet already or isn't one, and we can tell which without going anywhere
+	kinds = {url : domains.classify(url) for urls in found_urls if urls for url in urls}
+	for kind in (domains.TWEET, domains.SHORTENER, domains.OTHER) :
+		metrics.count('urls_classified', sum(1 for url_kind in kinds.values() if url_kind == kind), kind=kind)
+	with metrics.timer('stage', stage='resolveRedirects') :
+		resolutions = resolver.resolveAll(url for url, kind in kinds.items() if kind == domains.SHORTENER)
+
+	# loop through all the comments
+	found = [] # (comment, tweet links) for every comment with links to tweets in it
+	for comment, urls in zip(comments, found_urls) :
+		#logger.info('#### Comment id: %s (submission %s) ####',comment.id,comment.submission.id)# + '\n' + comment.body + '\n------------')
+		if urls is None :
+			logger.error("    Regex to find url on %s in %s was taking too long; skipping this comment",comment.id,comment.submission.id)
+			urls = []
+
+		with logs.context(submission=comment.submission.id, comment=comment.id) :
+			tweet_links = findTweetLinks(urls, resolutions)
+		metrics.count('urls_found', len(urls))
+		if tweet_links : # if tweet_links is not empty
+			metrics.count('tweet_links_found', len(tweet_links))
+			logger.info('#### Comment ID: %s (Submission %s) ####',comment.id,comment.submission.id)
+			logger.info('    Found tweet links! %s', str(tweet_links))
+			found.append((comment, tweet_links))
+
+	# fetch all the tweets we'll be replying with in as few requests as we can, up front
+	prefetchTweets(tweet_link for comment, tweet_links in found for tweet_link in tweet_links)
+
+	# now reply to each comment with every tweet it links to (that we haven't already replied with) in one reply;
+	# each tweet is only fetched and rehosted once, however many comments link to it
+	composed = {}
+	for comment, tweet_links in found :
+		with logs.context(submission=comment.submission.id, comment=comment.id) :
+			replyToComment(comment, tweet_links, composed)
+
+# which of the urls found in a comment are (or redirect to) links to tweets
+# resolutions is where each url redirects to (from resolver.resolveAll)
+# (this logs a lot about every url, so it goes to url_logger, which can be sampled or turned off; see URL_LOG_SAMPLE)
+def findTweetLinks(urls, resolutions) :
+	if len(urls) > 0 :
+		url_logger.debug("    Found the following URLs in this comment:")
+		for u in urls:
+			url_logger.debug("      %s", u[:url_logging_truncate])
+
+	# loop through any urls and see if any resolve into twitter status (tweet) links
+	tweet_links = []
+	for url in urls :
+		url_logger.debug("    ----------")
+		url_logger.debug("    checking url %s", url)
+
+		resolution = resolutions.get(url)
+		if resolution is None : # (not a url shortener, so we didn't follow it)
+			resolved_url = url
+			url_logger.debug("    Using %s... as found (not a shortener)", url[:url_logging_truncate])
+		else :
+			resolved_url = resolution.resolved_url
+			cached = " (cached)" if resolution.cached else ""
+			if resolution.error is None :
+				url_logger.debug("    resolved url%s: %s...", cached, resolved_url[:url_logging_truncate])
+			elif resolution.error == 'timed out' and not resolution.cached :
+				logger.error("    Resolving redirects timed out")
+			else :
+				url_logger.debug("    Using %s... as found%s, %s", url[:url_logging_truncate], cached, resolution.error)
+
+		try :
+			# test to see if the resolved url is a twitter link
+			url_logger.debug("    checking if %s... is a tweet link...", resolved_url[:url_logging_truncate])
+			tweet_links.append(re.match(regex_tweet,resolved_url).group(0))
+			url_logger.debug("    %s... is a tweet link!", resolved_url[:url_logging_truncate])
+		except AttributeError :
+			url_logger.debug("    %s... is NOT a tweet link", resolved_url[:url_logging_truncate])
+		except TypeError as e :
+			url_logger.debug("    error appending tweet link: %s", str(e))
+			#tweet_links.append(re.match(regex_tweet,url).group(0))
+
+		#except :
+	return tweet_links
+
+# the key we remember having replied to a comment with a tweet under
+def commentTweetKey(comment_id, tweet_link) :
+	return comment_id + '/' + tweetID(tweet_link)
+
+# reply to a comment with all the tweets in tweet_links we haven't already replied to it with
+# composed is a dict of tweets we've already composed (see composeReply)
+def replyToComment(comment, tweet_links, composed) :
+	try:
+		if comment.author.name == botName : # (we don't reply to ourselves)
+			return
+	except AttributeError : # (no author; it's been deleted)
+		return
+	if comment.created_utc < time.time() - comment_max_age :
+		logger.debug('%s - Too old to reply to', comment.id)
+		return
+
+	# one link per tweet, and only the ones we haven't replied with yet
+	# (and that nobody else, e.g. another worker, is replying with right now)
+	links = {}
+	for tweet_link in tweet_links :
+		key = commentTweetKey(comment.id, tweet_link)
+		if key not in links.values() and key not in replied :
+			links[tweet_link] = key
+	links = {tweet_link : key for tweet_link, key in links.items() if replied.claim(key, worker_name, worker_lease)}
+	if not links :
+		logger.debug('%s - Already replied with every tweet linked to in this comment', comment.id)
+		return
+
+	try:
+		# if whoever claimed any of these before us never finished, they may have died just after posting
+		# (before recording it), so make sure there isn't a reply of ours there already
+		if [key for key in links.values() if replied.tookOver(key)] and ownCommentReply(comment) :
+			logger.info('%s - Found a reply of ours that was never recorded; not replying again', comment.id)
+			replied.addMany(links.values())
+			return
+		reply = composeReply(list(links), comment.submission.id, comment.id, composed)
+		if reply is not None :
+			try:
+				with metrics.timer('stage', stage='reply'), metrics.timer('api', service='reddit', call='reply'), ratelimit.call('reddit', 'reddit.reply') :
+					posted = comment.reply(reply)
+			except praw.exceptions.RedditAPIException as e:
+				logger.error('%s - Could not comment: %s',comment.id,e.items)
+			except praw.exceptions.PRAWException as e:
+				logger.error('%s - Could not comment: %s',comment.id,str(e))
+			else:
+				logger.info("Successfully replied to comment %s!",comment.id)
+				metrics.count('replies')
+				replied.addMany(links.values()) # (this also drops our claims)
+				for key in links.values() :
+					comment_logger.info(key)
+				attachVideos(posted.id, reply)
+	finally:
+		for key in links.values() :
+			if key not in replied :
+				replied.unclaim(key, worker_name) # we didn't reply, so let them be tried again
+
+# True if one of the replies to comment is ours (this fetches the comment again, with its replies)
+def ownCommentReply(comment) :
+	with metrics.timer('api', service='reddit', call='comment_replies'), ratelimit.call('reddit') :
+		comment.refresh()
+		replies = list(comment.replies)
+	return any(getattr(getattr(reply, 'author', None), 'name', None) == botName for reply in replies)
 
 # return True if we've already replied to this submission
 def alreadyDone(s) :
-	# First we'll check if we've commented in this thread already
+	# First we'll check our own record of what we've replied to; this is the cheap check,
+	# and it also saves us from double posting when reddit is slow to show our comment
+	# (one time the bot posted like 13 times in a row before we kept track of this)
+	if s.id in replied :
+		logger.debug('We have already replied to this submission: %s', s.id)
+		return True
+
+	# Then we'll check if we've commented in this thread already (e.g. if our record got lost),
+	# from a list of our own newest comments (a few requests, however big the thread is)
+	found = ownReply(s)
+	if found is not None :
+		if found :
+			replied.add(s.id) # so next time we won't have to look
+		else :
+			logger.debug('We have not commented on this post yet')
+		return found
+
+	# (if our own comments don't go back that far, we'll have to look through the thread's comments)
 	try:
-		s.comments.replace_more(limit=None) # get unlimited list of comments
+		with metrics.timer('api', service='reddit', call='comments'), ratelimit.call('reddit') :
+			s.comments.replace_more(limit=None) # get unlimited list of comments
 	except AttributeError as e:
 		logger.error("ERROR: could not find comments in post (thread possibly too old?) - %s", str(e)) # found this bug when testing on very old threads
 		return True # skip this post and move on to the next one
@@ -261,28 +898,57 @@ def alreadyDone(s) :
 		try:
 			if comment.author.name == botName :
 				logger.debug('We posted a top-level comment on this thread already: %s', comment.id)
+				replied.add(s.id) # so next time we won't have to look
 				return True
-		except AttributeError as e:
-			# logger.debug('attribute error: ' + str(e))
+		except AttributeError :
 			# a comment will have no author if it has been deleted, which will raise an attribute error
 			pass
 
-	# We'll also check our comment log file to be extra sure (sometimes reddit posts are delayed,
-	# so we want to do this to avoid a double post; one time the bot posted like 13 times in a row before I added this check)
-	with open(paths.logs + 'comment_log.log') as log:
-		for line in log:
-			if line == s.id + '\n' :
-				return True
-
 	logger.debug('We have not commented on this post yet')
 	return False
 
+# whether we've posted a top-level comment on submission s, going by our own newest comments (which we go through
+# once every own_replies_ttl seconds, rather than for every submission); returns True or False, or None if reddit
+# doesn't list our comments back as far as when s was posted (it only lists the newest thousand or so)
+_own_replies = None # (when we went through them, ids of the submissions we've commented on, timestamp of the oldest one we saw)
+def ownReply(s) :
+	global _own_replies
+	if _own_replies is None or _own_replies[0] < time.time() - own_replies_ttl :
+		submission_ids = set()
+		oldest = time.time()
+		count = 0
+		with metrics.timer('api', service='reddit', call='own_comments'), ratelimit.call('reddit') :
+			for comment in reddit().redditor(botName).comments.new(limit=None) :
+				if comment.is_root :
+					submission_ids.add(comment.submission.id)
+				oldest = comment.created_utc
+				count += 1
+		redditLimits()
+		if count < 1000 : # we got to the end, so that's everything we've ever posted
+			oldest = 0
+		_own_replies = (time.time(), submission_ids, oldest)
+	submission_ids, oldest = _own_replies[1:]
+	if s.id in submission_ids :
+		logger.debug('We posted a top-level comment on this thread already')
+		return True
+	if s.created_utc >= oldest :
+		return False
+	return None
+
+# go through our own comments again next time ownReply is asked
+def forgetOwnReplies() :
+	global _own_replies
+	_own_replies = None
+
 # compose comment from the contents of the tweet
-# url is the url of the tweet
+# url is the url of the tweet, or a list of urls to put all of those tweets in one comment
 # sub_id is the id of the submission
 # com_id is the id of the comment; if the link is from the submission itself
 #		 rather than a comment within the submission, this should be left as None
-def composeReply(url, sub_id, com_id = None) :
+# composed (optional) is a dict to keep each tweet's part of the reply in, by tweet id, so a tweet
+#		 that gets linked to in lots of comments is only fetched and rehosted once
+@metrics.timed('stage', stage='composeReply')
+def composeReply(url, sub_id, com_id = None, composed = None) :
 	# if com_ID isn't empty, we're replying to a comment
 	if com_id is not None :
 		where = "COMMENT"
@@ -292,8 +958,30 @@ def composeReply(url, sub_id, com_id = None) :
 		where = "POST"
 		id = sub_id
 
-	logger.info("######## Found new tweet in %s ######## REDDIT:%s TWITTER:%s", where, id, url ) # log the submission id and twitter URL
-
+	if composed is None :
+		composed = {}
+	tweets = []
+	for url in ([url] if isinstance(url, str) else url) :
+		logger.info("######## Found new tweet in %s ######## REDDIT:%s TWITTER:%s", where, id, url ) # log the submission id and twitter URL
+		key = tweetID(url)
+		if key not in composed :
+			composed[key] = composeTweet(url, id)
+		if composed[key] is not None : # (if we couldn't get the tweet, we'll leave it out)
+			tweets.append(composed[key])
+
+	if not tweets :
+		return None
+	return render.replyMany(tweets)
+
+# the id of the tweet at url (or the url itself, if we can't find one)
+def tweetID(url) :
+	matches = regex_tweet_id.search(url)
+	return matches.group(1) if matches is not None else url
+
+# compose one tweet's part of a reply; returns None if there was an error
+# url is the url of the tweet; id is the reddit id we're replying to (for logging)
+def composeTweet(url, id) :
+	import tweepy # already imported by the time we need it (see twitter())
 	comment = None
 
 	try:
@@ -315,66 +1003,112 @@ def composeReply(url, sub_id, com_id = None) :
 			logger.debug('text: %s',tweet.full_text)
 
 			# --- FORMAT COMMENT --- #
-			lineSep = "--------------------"
-
-			# Tweet author
-			comment = "**[@" + tweet.user.screen_name + "](https://www.twitter.com/" + tweet.user.screen_name + ")** (" + tweet.user.name + "):\n\n"
-
-			# Text
-			tweetText = re.sub(r"\bhttps?:\/\/t\.co\/\w+\b",resolveLink(tweet), tweet.full_text, 0) # replace any t.co links in the tweet text with the resolved link; not only does this allow people to use them even if twitter is blocked, t.co links also probably cause reddit comments to be blocked as spam
-			comment += re.sub(r"^","> ",redditEscape(tweetText), 0, re.MULTILINE) + "\n\n" # escape reddit formatting and add "> " quote syntax to the beginning of each line
-
-			logger.debug('text after link replacement: ' + tweetText)
-			# Media
-			if len(tweetMedia) > 0 : # if there's any media, display links
-				comment += "Rehosted Media:\n\n"
-				for media in tweetMedia :
-					string = ""
-					if isinstance(media,dict) : # if the media was a video, it will be a dict with possibly multiple links of different bitrates
-						for key in media :
-							string += "[[" + key + "]](" + media[key] + ") "
-						if string == "" : # i.e. if the dict was empty
-							string = "error rehosting video. Sorry!"
-						string = "Video: " + string
-					else : # otherwise, we assume it's a string, a single url
-						string = media
-					comment += "* " + string + "\n\n"
-
-			# Footer
-			comment += lineSep + "\n\n"
-			comment += "^I ^am ^a ^bot ^powered ^by ^fricks ^and ^I ^like ^that"
-			comment += " ^| [^(message&nbsp;me)](https://www.reddit.com/message/compose?to=FleetFlotTheTweetBot)"
-			comment += " ^| [^(source&nbsp;code)](https://github.com/JohnMTorgerson/FleetFlotTheTweetBot)"
-			comment += " ^| ^Skål!"
+			# Text: any t.co links in the tweet text are replaced with the resolved link (not only does this allow people
+			# to use them even if twitter is blocked, t.co links also probably cause reddit comments to be blocked as spam),
+			# reddit formatting is escaped, and "> " quote syntax is added to the beginning of each line
+			quoted = render.quote(tweet.full_text, resolveLink(tweet))
+			logger.debug('text after link replacement: ' + quoted)
+
+			# Media: if the media was a video, it will be a dict with possibly multiple links of different bitrates;
+			# otherwise, we assume it's a string, a single url (or a placeholder for a video that isn't ready yet)
+			media = [formatVideo(media) if isinstance(media,dict) else media for media in tweetMedia]
+
+			# Tweet author, text and media (the footer goes on the end of the whole reply)
+			comment = render.tweet(tweet.user.screen_name, tweet.user.name, quoted, media)
 	return comment
 
+# format the links to a rehosted video (a dict with possibly multiple links of different bitrates)
+def formatVideo(media) :
+	string = ""
+	for key in media :
+		string += "[[" + key + "]](" + media[key] + ") "
+	if string == "" : # i.e. if the dict was empty
+		string = "error rehosting video. Sorry!"
+	return "Video: " + string
 
 # get the contents of the tweet
 # if we can't find the tweet, raise an exception
+@metrics.timed('stage', stage='getTweet')
 def getTweet(url) :
+	import tweepy # already imported by the time we need it (see twitter())
 	logger.debug(url)
 
 	# first find the tweet id from the url
-	regex = re.compile(r"(?<=\/status\/)(\d+)") # regex pattern to find the tweet id from the url
-	matches = re.search(regex,url)
+	matches = regex_tweet_id.search(url)
 	try:
 		id = matches.group(1) # extract the id
 	except AttributeError as e: # no regex match for the id, so raise an exception
 		e.custom = 'Could not find tweet id from url:' + url
 		raise
 	else: # we found the tweet id
+		# see if we've already got it (e.g. from prefetchTweets)
+		cached = tweet_cache.lookup(id)
+		if cached is not None :
+			if cached.error is not None : # we tried to get this tweet recently, and couldn't
+				e = tweepy.error.TweepError(cached.error)
+				e.custom = 'Could not find tweet for this id: ' + id + ' - error (cached): ' + cached.error
+				raise e
+			logger.debug('Found tweet %s in the cache', id)
+			return tweepy.models.Status.parse(twitter(), cached.value)
+
 		try:
-			tweet = t.get_status(id, tweet_mode='extended') # get the actual tweet
+			api = twitter()
+			try:
+				with metrics.timer('api', service='twitter', call='get_status'), ratelimit.call('twitter.get_status') :
+					tweet = api.get_status(id, tweet_mode='extended') # get the actual tweet
+			finally:
+				ratelimit.updateFromHeaders('twitter.get_status', getattr(getattr(api, 'last_response', None), 'headers', None))
 		except tweepy.error.TweepError as e: # we couldn't find the tweet from the id
+			if e.api_code == 144 : # 'No status found with that ID.'; anything else might just be a hiccup
+				tweet_cache.putFailure(id, str(e))
 			e.custom = 'Could not find tweet for this id: ' + id + ' - error: ' + str(e)
 			raise
 		else:
+			tweet_cache.put(id, tweet._json)
 			return tweet # return it
 
+# fetch every tweet linked to in urls that isn't already in the cache, as few requests as possible,
+# and put them in the cache for getTweet; we don't raise anything here, since getTweet will
+# just fetch (and complain about) anything we couldn't get
+@metrics.timed('stage', stage='prefetchTweets')
+def prefetchTweets(urls) :
+	ids = []
+	for url in urls :
+		matches = regex_tweet_id.search(url)
+		if matches is not None :
+			ids.append(matches.group(1))
+	ids = [id for id in dict.fromkeys(ids) if tweet_cache.lookup(id) is None]
+	if not ids :
+		return
+
+	import tweepy # already imported by the time we need it (see twitter())
+	for start in range(0, len(ids), tweet_batch_size) :
+		batch = ids[start:start + tweet_batch_size]
+		try:
+			api = twitter()
+			try:
+				with metrics.timer('api', service='twitter', call='statuses_lookup'), ratelimit.call('twitter.statuses_lookup') :
+					tweets = api.statuses_lookup(batch, tweet_mode='extended')
+			finally:
+				ratelimit.updateFromHeaders('twitter.statuses_lookup', getattr(getattr(api, 'last_response', None), 'headers', None))
+		except tweepy.error.TweepError as e:
+			logger.error('Could not look up %d tweets at once; we\'ll try them one at a time: %s', len(batch), str(e))
+			continue
+		found = {tweet.id_str : tweet for tweet in tweets}
+		for id in batch :
+			if id in found :
+				tweet_cache.put(id, found[id]._json)
+			else : # twitter leaves out tweets that don't exist (or that we're not allowed to see)
+				tweet_cache.putFailure(id, 'No status found with that ID.')
+		logger.debug('Looked up %d tweets in one request (found %d)', len(batch), len(found))
+
 # find any media in the tweet that we care about (e.g. pics, videos)
 # rehost it if possible, and return all of it as a list
+# (all the media in the tweet is rehosted at the same time, but the list is in the same order as in the tweet)
+@metrics.timed('stage', stage='getTweetMedia')
 def getTweetMedia(tweet) :
 	tweetMedia = [] # list in which we'll store the media
+	uploads = [] # (service, url) for each piece of media we need to rehost, in order
 
 	# find any media and add to tweetMedia
 	if hasattr(tweet,'extended_entities') and 'media' in tweet.extended_entities : # if we have any media at all?
@@ -390,24 +1124,7 @@ def getTweetMedia(tweet) :
 						if variant['content_type'] == 'video/mp4' :
 							url = variant['url']
 							logger.debug('GIF - url:' + url)
-
-							# rehost the gif on gfycat and add the new url
-							try:
-								filepath = download(url)
-								response = g.upload_from_file(filepath)
-								gfy_url = response.content_urls.mp4.url
-							except GfypyException as e:
-								# set custom error message and raise exception
-								e.custom = 'Could not upload to gfycat. GfypyException: ' + str(e)
-								raise
-							except KeyError as e: # KeyError will be raised if we could connect to gfycat, but couldn't upload (e.g. the url we tried to upload was bad)
-								# set custom error message and raise exception
-								e.custom = 'Could not upload to gfycat. Probably a bad upload url. KeyError: ' + str(e) + ' doesn\'t exist in response. JSON response was: ' + str(response)
-								raise
-							except Exception as e:
-								raise
-							else:
-								tweetMedia.append(gfy_url)
+							uploads.append(('gfycat', url)) # rehost the gif on gfycat
 							break
 					else : # no-break: we didn't find anything
 						logger.error("GIF, didn't recognize content_type: %s",ent['url'])
@@ -423,18 +1140,7 @@ def getTweetMedia(tweet) :
 							logger.debug('video variants - bitrate=' + str(bitrate) + ' url=' + url)
 					if url != '' : # we found a video
 						logger.debug('VIDEO - url:' + url)
-
-						# rehost the video on Streamable and append urls to tweetMedia
-						try:
-							vids = getStreamableURLs(url)
-						except Exception as e:
-							logger.error('Could not upload to Streamable, commenting anyway: %s',str(e))
-							# send back an error message to be displayed in the comment
-							vids = '*Sorry, there was an error trying to rehost a video in this tweet :(*'
-							# we don't want to raise this exception, because we want to post the tweet
-							# even if we couldn't get the video uploaded
-						tweetMedia.append(vids)
-
+						uploads.append(('streamable', url)) # rehost the video on Streamable
 					else : # we didn't find anything
 						logger.error("VIDEO found, but didn't recognize content_type: %s",ent['url'])
 
@@ -442,9 +1148,47 @@ def getTweetMedia(tweet) :
 			elif 'media_url_https' in ent : # if not, the media is a static image
 				url = ent['media_url_https']
 				logger.debug('PICTURE - media_url_https: %s',url)
-				# rehost static image on imgur
+				uploads.append(('imgur', url)) # rehost static image on imgur
+
+			else : # if we're here, there's no media at all
+				logger.error('Thought we found media, but couldn\'t find urls (extended_entities exists, but no video_info or media_url_https???)')
+
+	else : # we didn't find any media
+		logger.debug('no extended_entities at all!!!')
+
+	# start rehosting everything at once, then collect the results in order
+	futures = [mediaExecutor().submit(rehostOn, service, url) for service, url in uploads]
+	try:
+		for (service, url), future in zip(uploads, futures) :
+			# GIF
+			if service == 'gfycat' :
+				from gfypy import GfypyException # only imported once we need it (see gfycat())
 				try:
-					imgurURL = getImgurURL(url)
+					gfy_url = future.result()
+				except GfypyException as e:
+					# set custom error message and raise exception
+					e.custom = 'Could not upload to gfycat. GfypyException: ' + str(e)
+					raise
+				else:
+					tweetMedia.append(gfy_url)
+
+			# VIDEO
+			elif service == 'streamable' :
+				try:
+					vids = future.result()
+				except Exception as e:
+					logger.error('Could not upload to Streamable, commenting anyway: %s',str(e))
+					# send back an error message to be displayed in the comment
+					vids = '*Sorry, there was an error trying to rehost a video in this tweet :(*'
+					# we don't want to raise this exception, because we want to post the tweet
+					# even if we couldn't get the video uploaded
+				tweetMedia.append(vids)
+
+			# IMAGE
+			else :
+				from imgurpython.helpers.error import ImgurClientError # only imported once we need it (see imgur())
+				try:
+					imgurURL = future.result()
 				except ImgurClientError as e:
 					# set custom error message and raise exception
 					e.custom = "Could not upload static image to imgur: " + str(e)
@@ -453,15 +1197,40 @@ def getTweetMedia(tweet) :
 					# if successful, append the imgur URL to the tweetMedia list
 					tweetMedia.append(imgurURL)
 					logger.debug('Successfully uploaded to imgur: %s',imgurURL)
-
-			else : # if we're here, there's no media at all
-				logger.error('Thought we found media, but couldn\'t find urls (extended_entities exists, but no video_info or media_url_https???)')
-
-	else : # we didn't find any media
-		logger.debug('no extended_entities at all!!!')
+	finally:
+		for future in futures : # if we gave up part way through, don't bother starting anything that hasn't started yet
+			future.cancel()
 
 	return tweetMedia
 
+# rehost the media at url on service ('imgur', 'gfycat' or 'streamable'),
+# waiting for a free slot if that service is already busy with as many uploads as we allow at once
+def rehostOn(service, url) :
+	with media_slots[service] :
+		if service == 'streamable' :
+			return getStreamableVideo(url) # (we don't wait around for streamable; see getStreamableVideo)
+		upload = {'imgur' : getImgurURL, 'gfycat' : getGfycatURL}[service]
+		return rehost(url, upload)
+
+# thread pool that all the media uploads run on; it's big enough for every service to use all of its slots at once
+_media_executor = None
+def mediaExecutor() :
+	global _media_executor
+	if _media_executor is None :
+		_media_executor = concurrent.futures.ThreadPoolExecutor(max_workers=sum(max(1, workers) for workers in media_workers.values()), thread_name_prefix='media')
+	return _media_executor
+
+# rehost the media at url using upload (getImgurURL or getGfycatURL),
+# unless we've already rehosted it before, in which case just return what we got last time
+def rehost(url, upload) :
+	cached = media_cache.lookup(url)
+	if cached is not None :
+		logger.debug('Already rehosted %s as %s', url, cached.value)
+		return cached.value
+	rehosted = upload(url)
+	media_cache.put(url, rehosted)
+	return rehosted
+
 # given a url to a (static) image, upload to imgur and return the imgur url
 def getImgurURL(url) :
 	try:
@@ -470,65 +1239,77 @@ def getImgurURL(url) :
 		e.custom = "Could not find file extension from URL when trying to upload to imgur"
 		raise
 	else:
-		upload = i.upload_from_url(url, config=None, anon=True)
+		client = imgur()
+		try:
+			with metrics.timer('api', service='imgur', call='upload'), ratelimit.call('imgur', cost=10) : # an upload costs 10 credits
+				upload = client.upload_from_url(url, config=None, anon=True)
+		finally:
+			credits = getattr(client, 'credits', None) or {} # imgurpython keeps track of our credits from the headers
+			ratelimit.update('imgur', credits.get('UserRemaining'), credits.get('UserReset'))
 		imgurURL = "http://imgur.com/" + upload['id'] + "." + ext
 		return imgurURL
 
-# given a url to a twitter video, upload to streamable and return a dict with streamable urls to the video (2 videos, for desktop and mobile)
-def getStreamableURLs(url) :
+# given a url to a twitter gif (which is really an mp4), download it, upload it to gfycat, and return the gfycat url
+# (we also remember the upload by the file's checksum, so the same gif under a different url doesn't get uploaded twice either)
+def getGfycatURL(url) :
+	response = None
 	try:
-		r = requests.get('https://api.streamable.com/import?url=' + url,auth=requests.auth.HTTPBasicAuth(login.loginStreamable.username,login.loginStreamable.password))
-		shortcode = r.json()['shortcode'] # get shortcode from streamable for uploaded video, which we'll then check on to see if it got uploaded
-	except Exception as e:
-		e.custom = 'Streamable account may have been suspended; response was: ' + str(r)
+		with download(url) as (filepath, checksum) :
+			cached = media_cache.lookup('sha256:' + checksum)
+			if cached is not None :
+				logger.debug('Already rehosted a gif with the same contents as %s: %s', url, cached.value)
+				return cached.value
+			client = gfycat()
+			with metrics.timer('api', service='gfycat', call='upload'), ratelimit.call('gfycat') :
+				response = client.upload_from_file(filepath)
+			gfy_url = response.content_urls.mp4.url
+			media_cache.put('sha256:' + checksum, gfy_url)
+			return gfy_url
+	except KeyError as e: # KeyError will be raised if we could connect to gfycat, but couldn't upload (e.g. the url we tried to upload was bad)
+		# set custom error message and raise exception
+		e.custom = 'Could not upload to gfycat. Probably a bad upload url. KeyError: ' + str(e) + ' doesn\'t exist in response. JSON response was: ' + str(response)
 		raise
 
-	# wait until status is '2' or give up after 20 tries
-	urls = {} # we'll return this
-	tries = 20
-	while tries > 0 :
-		response = requests.get('https://api.streamable.com/videos/' + shortcode)
-		response.json()
-		status = response.json()['status']
-		files = response.json()['files']
-		if status == 2 : # success, but we still have to check to see if we have any url's yet
-			if 'mp4' in files and files['mp4'].get('url','') != '' : # we have a desktop url
-				urls['desktop'] = files['mp4']['url']
-			if 'mp4-mobile' in files and files['mp4-mobile'].get('url','') != '' : # we have a mobile url
-				urls['mobile'] = files['mp4-mobile']['url']
-
-			# if we have both a desktop and a mobile url, break out of the loop
-			# (if we have neither or just 1 of the 2, we'll keep trying)
-			if 'desktop' in urls and 'mobile' in urls :
-				break
-		elif status == 3 : # error
-			raise requests.exceptions.RequestException("Could not upload, returned status==3!")
-			break
-		time.sleep(5) # sleep for 5 seconds and then try again
-		tries -= 1 # decrement tries
-	else : # no-break: we timed out without getting a successful response
-		raise requests.exceptions.RequestException("Could not retrieve any URLs in time, so we gave up!")
-
-	# if we're here, we've gotten at least a desktop or a mobile url, or both
-	return urls
-
-# escape any reddit markdown from the string
-def redditEscape(string) :
-	# escape leading hashtags ('#')
-	string = re.sub(r"^#","\#",string,0,re.MULTILINE)
-
-	# delete leading spaces/tabs (so as not to trigger reddit's 'code' formatting)
-	string = re.sub(r"^[ \t]+","",string,0,re.MULTILINE)
-
-	# fix numbered list formatting by adding an escape like so: '5\.'
-	# otherwise reddit will always change the numbers to start at 1
-	string = re.sub(r"(?:(?<=^\d)|(?<=^\d{2})|(?<=^\d{3}))\.","\\.",string,0,re.MULTILINE)
-
-	# double space, because reddit needs two newlines to actually display a line break
-	# (the regex actually only adds a newline at the end of a line if there's another line after it with characters in it)
-	string = re.sub(r"(?<=.(?=\n.))","\n",string,0,re.MULTILINE)
-
-	return string
+# given a url to a twitter video, start importing it to streamable, and return what to put in the reply for it:
+# if we've rehosted it before, that's a dict with streamable urls to the video (2 videos, for desktop and mobile);
+# otherwise it's a placeholder, which we'll swap for the real links once streamable is done (see finishVideos)
+def getStreamableVideo(url) :
+	cached = media_cache.lookup(url)
+	if cached is not None :
+		logger.debug('Already rehosted %s as %s', url, cached.value)
+		return cached.value
+	shortcode = video_tracker.startImport(url)
+	logger.debug('Streamable is importing %s as %s', url, shortcode)
+	return streamable.placeholder(shortcode)
+
+# link a comment we posted to any streamable videos it has placeholders for, so they get edited in when they're ready
+def attachVideos(comment_id, reply) :
+	for shortcode in video_tracker.attach(comment_id, reply) :
+		logger.error('%s - Streamable job %s is long gone, so its placeholder will never be replaced', comment_id, shortcode)
+
+# edit the real links into any comments we posted with placeholders for streamable videos that are now done
+# (this runs on the main thread, in between other work, so we never have two threads talking to reddit at once)
+def finishVideos() :
+	for job in video_tracker.finished() :
+		if job.urls is not None :
+			media_cache.put(job.source_url, job.urls)
+			replacement = formatVideo(job.urls)
+			logger.debug('Streamable finished %s: %s', job.shortcode, job.urls)
+		else :
+			logger.error('Could not upload to Streamable: %s', job.error)
+			replacement = '*Sorry, there was an error trying to rehost a video in this tweet :(*'
+		edited = []
+		for comment_id in job.comment_ids :
+			try:
+				comment = reddit().comment(comment_id)
+				with metrics.timer('api', service='reddit', call='edit'), ratelimit.call('reddit', cost=2) : # (fetching the comment, then editing it)
+					comment.edit(comment.body.replace(streamable.placeholder(job.shortcode), replacement))
+			except (praw.exceptions.PRAWException, prawcore.PrawcoreException) as e:
+				logger.error('%s - Could not edit comment to add streamable links (we\'ll try again later): %s', comment_id, str(e))
+			else:
+				logger.info('Edited streamable links into comment %s', comment_id)
+				edited.append(comment_id)
+		video_tracker.done(job.shortcode, edited) # (any we couldn't edit stay attached, so they get tried again next time)
 
 # when passed a t.co shortlink, find and return the resolved link from the tweet entities
 # we use a closure so that we can pass the tweet object from the function call (which occurs inside re.sub as a replace function: see http://stackoverflow.com/questions/7868554/python-re-subs-replace-function-doesnt-accept-extra-arguments-how-to-avoid)
@@ -557,17 +1338,15 @@ def resolveLink(tweet) :
 
 						# whether that worked or not, we still need to test it to see if it redirects elsewhere
 						# and if so, use the redirected url (because a bit.ly url, for example, would still get us stuck in reddit's spam filter)
-						try :
-							# follow any redirects and store that url
-							session = requests.Session()
-							resp = session.head(expandedURL, allow_redirects=True) # follow any redirects
-							expandedURL = resp.url # save the redirected url
-						except requests.exceptions.RequestException as e :
+						# follow any redirects (or look up where they went last time) and store that url
+						resolution = link_resolver.resolve(expandedURL)
+						if resolution.error is None :
+							expandedURL = resolution.resolved_url # save the redirected url
+						else :
 							# there was a problem trying to find the url to see if it redirected anywhere, so log the error
-							# in the future, we may want to apply more sophisticated error handling here, with timeouts and so forth
-							# in the meantime, we'll just do nothing, which will result in expandedURL
+							# and then do nothing, which will result in expandedURL
 							# having either the value of the expanded url from the tweet object (ideally) or (worst case) the original t.co link if the expanded_url couldn't be found in the tweet object
-							logger.error('HTTP request failed when trying to see if %s redirects anywhere, so we\'ll just post the original link; error: %s',expandedURL,str(e))
+							logger.error('HTTP request failed when trying to see if %s redirects anywhere, so we\'ll just post the original link; error: %s',expandedURL,resolution.error)
 
 						# regardless of whether everything got resolved appropriately, we set resolvedLink to expandedURL, with some formatting
 						# depending on which of the previous try blocks failed, expandedURL could at this point be
@@ -592,37 +1371,50 @@ def resolveLink(tweet) :
 		return resolvedLink
 	return replaceLink
 
-# find urls in body of comment text; this function is called as a separate process
-# in order to cut it off after a couple seconds in case of a runaway regex deal
-def findURLs(pattern, text, return_queue) :
-	return_queue.put(regex.findall(pattern,text)) # use the regex library instead of the re library because the regex_url pattern uses a possessive quantifier
-
-def resolveRedirects(url, return_queue) :
-	try :
-		# follow any redirects and store that url
-		logger.debug("    resolving any redirects...")
-		session = requests.Session()
-		resp = session.head(url, allow_redirects=True) # follow any redirects
-		resolved_url = resp.url # save the redirected url
-		logger.debug(f"    resolved url: {resolved_url[:url_logging_truncate]}...")
-	except requests.exceptions.RequestException as e :
-		logger.debug(f"    Using {url[:url_logging_truncate]}... as found, problem with redirect detection: {str(e)}")
-		resolved_url = url
-	return_queue.put(resolved_url)
-
-
+# download the file at url into a temp file of its own, and yield (filepath, checksum);
+# the file is streamed to disk a chunk at a time (so it doesn't matter how big it is, memory-wise),
+# we give up if it turns out to be bigger than max_download_bytes, and it's deleted again when we're done with it
+@contextlib.contextmanager
 def download(url) :
+	filename = None
 	try :
-		req = requests.get(url)
-		filename = 'temp/' + url.split('/')[-1]
-		with open(filename,'wb') as file:
-			file.write(req.content)
+		os.makedirs(temp_dir, exist_ok=True)
+		basename = os.path.basename(urllib.parse.urlsplit(url).path)
+		name, ext = os.path.splitext(basename)
+		with metrics.timer('api', service='twimg', call='download'), sessions.session().get(url, stream=True, timeout=download_timeout) as req :
+			req.raise_for_status()
+			if int(req.headers.get('Content-Length') or 0) > max_download_bytes :
+				raise requests.exceptions.RequestException('File is ' + req.headers['Content-Length'] + ' bytes, which is more than our limit of ' + str(max_download_bytes))
+			checksum = hashlib.sha256()
+			size = 0
+			fd, filename = tempfile.mkstemp(prefix=name + '-', suffix=ext, dir=temp_dir) # unique, so two files with the same name can't collide
+			with os.fdopen(fd, 'wb') as file :
+				for chunk in req.iter_content(chunk_size=64*1024) :
+					size += len(chunk)
+					if size > max_download_bytes :
+						raise requests.exceptions.RequestException('File is more than our limit of ' + str(max_download_bytes) + ' bytes')
+					checksum.update(chunk)
+					file.write(chunk)
 	except Exception as e:
+		if filename is not None :
+			os.remove(filename)
 		e.custom = 'Unable to download file ' + url
 		raise
-	else :
-		logger.debug('Successfully downloaded' + url + ' as ' + filename)
-		return filename
+
+	logger.debug('Successfully downloaded ' + url + ' as ' + filename + ' (' + str(size) + ' bytes)')
+	try :
+		yield filename, checksum.hexdigest()
+	finally :
+		os.remove(filename) # clean up after ourselves
 
 if __name__ == "__main__":
-	main()
+	parser = argparse.ArgumentParser(description='Reply to links to tweets in r/' + subName)
+	parser.add_argument('--daemon', action='store_true', help='keep running and react to new submissions and comments as they come in, instead of checking once and exiting')
+	parser.add_argument('--worker', action='store_true', help='keep running as one of any number of workers sharing the work through STATE_DB')
+	args = parser.parse_args()
+	if args.worker :
+		worker()
+	elif args.daemon :
+		daemon()
+	else :
+		main()
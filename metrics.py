@@ -0,0 +1,199 @@
+# Metrics: how long things take, and how often things happen
+#
+# Like logging, there's one registry per process that everything records into:
+# timer() (or the timed() decorator) records how long something took in a histogram,
+# and count() adds to a counter; both take labels, e.g. timer('api', service='imgur', call='upload').
+# At the end of a run, write() dumps it all to a file, either as a Prometheus textfile
+# (e.g. for node_exporter's textfile collector) or, if the file name ends in .json, as a JSON snapshot;
+# a long-running process can serve() it over HTTP instead.
+
+import http.server
+import threading
+import contextlib
+import functools
+import logging
+import json
+import time
+import os
+
+prefix = 'fleetflot_' # every metric's name starts with this
+buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60) # histogram bucket upper bounds, in seconds
+
+class Histogram :
+	def __init__(self) :
+		self.counts = [0] * (len(buckets) + 1) # the last one is everything over the biggest bucket
+		self.sum = 0.0
+		self.count = 0
+
+	def observe(self, seconds) :
+		for n, bound in enumerate(buckets) :
+			if seconds <= bound :
+				break
+		else :
+			n = len(buckets)
+		self.counts[n] += 1
+		self.sum += seconds
+		self.count += 1
+
+	# cumulative counts for each bucket's upper bound, as Prometheus wants them
+	def cumulative(self) :
+		total = 0
+		result = []
+		for bound, count in zip(buckets + ('+Inf',), self.counts) :
+			total += count
+			result.append((bound, total))
+		return result
+
+class Metrics :
+	def __init__(self) :
+		self.lock = threading.Lock()
+		self.started = time.time()
+		self.counters = {} # (name, labels) -> value
+		self.histograms = {} # (name, labels) -> Histogram
+		self.server = None
+
+	def reset(self) :
+		with self.lock :
+			self.started = time.time()
+			self.counters.clear()
+			self.histograms.clear()
+
+	# add n to counter name (e.g. count('cache_lookups', cache='tweets', result='hit'))
+	def count(self, name, n=1, **labels) :
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock :
+			self.counters[key] = self.counters.get(key, 0) + n
+
+	# record that something took this many seconds
+	def observe(self, name, seconds, **labels) :
+		key = (name, tuple(sorted(labels.items())))
+		with self.lock :
+			if key not in self.histograms :
+				self.histograms[key] = Histogram()
+			self.histograms[key].observe(seconds)
+
+	# time the body of a with statement; if it raises, that's counted as an error too
+	@contextlib.contextmanager
+	def timer(self, name, **labels) :
+		started = time.perf_counter()
+		try:
+			yield
+		except Exception :
+			self.count(name + '_errors', **labels)
+			raise
+		finally:
+			self.observe(name, time.perf_counter() - started, **labels)
+
+	# decorator version of timer
+	def timed(self, name, **labels) :
+		def decorator(function) :
+			@functools.wraps(function)
+			def wrapper(*args, **kwargs) :
+				with self.timer(name, **labels) :
+					return function(*args, **kwargs)
+			return wrapper
+		return decorator
+
+	def snapshot(self) :
+		with self.lock :
+			return {
+				'started' : self.started,
+				'written' : time.time(),
+				'counters' : [{'name' : name, 'labels' : dict(labels), 'value' : value} for (name, labels), value in sorted(self.counters.items())],
+				'histograms' : [{'name' : name, 'labels' : dict(labels), 'count' : h.count, 'sum' : round(h.sum, 6),
+					'buckets' : {str(bound) : count for bound, count in h.cumulative()}} for (name, labels), h in sorted(self.histograms.items())],
+			}
+
+	# everything in the Prometheus text format; counters get _total on the end of their names, histograms _seconds
+	def prometheus(self) :
+		def format(labels, extra=()) :
+			labels = tuple(labels) + tuple(extra)
+			if not labels :
+				return ''
+			return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+		lines = []
+		with self.lock :
+			typed = set()
+			for (name, labels), value in sorted(self.counters.items()) :
+				full = prefix + name + '_total'
+				if full not in typed :
+					lines.append(f'# TYPE {full} counter')
+					typed.add(full)
+				lines.append(f'{full}{format(labels)} {value}')
+			for (name, labels), h in sorted(self.histograms.items()) :
+				full = prefix + name + '_seconds'
+				if full not in typed :
+					lines.append(f'# TYPE {full} histogram')
+					typed.add(full)
+				for bound, count in h.cumulative() :
+					lines.append(f'{full}_bucket{format(labels, [("le", bound)])} {count}')
+				lines.append(f'{full}_sum{format(labels)} {h.sum:.6f}')
+				lines.append(f'{full}_count{format(labels)} {h.count}')
+			lines.append(f'# TYPE {prefix}started_timestamp_seconds gauge')
+			lines.append(f'{prefix}started_timestamp_seconds {self.started:.3f}')
+		return '\n'.join(lines) + '\n'
+
+	# write everything to path: a JSON snapshot if path ends in .json, otherwise a Prometheus textfile
+	def write(self, path) :
+		if path.endswith('.json') :
+			contents = json.dumps(self.snapshot(), indent=1)
+		else :
+			contents = self.prometheus()
+		temp = path + '.tmp'
+		with open(temp, 'w') as file :
+			file.write(contents)
+		os.replace(temp, path) # so nobody ever reads a half-written file
+
+	# serve everything on a local port: /metrics in the Prometheus format, /metrics.json as JSON
+	def serve(self, port) :
+		if self.server is None :
+			metrics = self
+			class Handler(http.server.BaseHTTPRequestHandler) :
+				def do_GET(self) :
+					if self.path.rstrip('/') in ('', '/metrics') :
+						body, content_type = metrics.prometheus(), 'text/plain; version=0.0.4'
+					elif self.path == '/metrics.json' :
+						body, content_type = json.dumps(metrics.snapshot()), 'application/json'
+					else :
+						self.send_error(404)
+						return
+					body = body.encode('utf-8')
+					self.send_response(200)
+					self.send_header('Content-Type', content_type)
+					self.send_header('Content-Length', str(len(body)))
+					self.end_headers()
+					self.wfile.write(body)
+
+				def log_message(self, *args) : # don't spam stderr with every scrape
+					pass
+
+			self.server = http.server.ThreadingHTTPServer(('127.0.0.1', port), Handler)
+			threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
+		return self
+
+	def stop(self) :
+		if self.server is not None :
+			self.server.shutdown()
+			self.server.server_close()
+			self.server = None
+
+def escape(value) :
+	return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# a logging handler that counts every message at or above its level, by level
+# (so we can see how many errors a run had without digging through the logs)
+class LogCounter(logging.Handler) :
+	def __init__(self, metrics, level=logging.WARNING) :
+		super().__init__(level)
+		self.metrics = metrics
+
+	def emit(self, record) :
+		self.metrics.count('log_messages', level=record.levelname.lower())
+
+# the registry everything records into
+registry = Metrics()
+count = registry.count
+observe = registry.observe
+timer = registry.timer
+timed = registry.timed
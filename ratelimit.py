@@ -0,0 +1,193 @@
+# Staying within every API's rate limits
+#
+# Each service (or endpoint) we call has a limiter, a token bucket: calls take tokens out, which refill
+# at a steady rate, and a call that finds the bucket empty waits its turn (in the order they asked),
+# so bursts go through at full speed and sustained use gets paced to what the service allows.
+# On top of that, whatever the service tells us about our budget (rate limit headers, imgur's credits,
+# praw's auth.limits) is fed back in with update(): once the service says we've used it all up, calls wait
+# until it resets. And if we get rate limited anyway (a 429, or the like), the service is paused for as
+# long as it asks.
+#
+# Like metrics, there's one set of limiters per process, shared by every thread:
+#
+#   with ratelimit.call('imgur', cost=10) :
+#       upload = client.upload_from_url(...)
+#   ratelimit.update('imgur', remaining=client.credits['UserRemaining'], reset_at=client.credits['UserReset'])
+
+import threading
+import contextlib
+import time
+import re
+import os
+import metrics
+
+class Limiter :
+	# rate is how many tokens (calls, or credits) we get per second, burst how many we can save up;
+	# rate None means no limit of our own (we just go by what the service tells us);
+	# margin is how much of the service's own budget we leave alone, in case something else is using it too
+	def __init__(self, name, rate=None, burst=1, margin=1) :
+		self.name = name
+		self.rate = rate
+		self.burst = max(1, burst)
+		self.margin = margin
+		self.lock = threading.Lock()
+		self.tokens = float(self.burst)
+		self.updated = time.monotonic()
+		self.remaining = None # what the service says is left of our budget (less what we've used since)
+		self.reset_at = None # when the service says our budget resets (time.time())
+		self.blocked_until = 0 # time.time() until which we've been told to back off
+		self.calls = 0
+		self.waits = 0
+		self.waited = 0.0
+		self.throttles = 0
+
+	# how long to wait before making a call costing cost; the tokens are taken straight away,
+	# so whoever asks next waits behind us
+	def reserve(self, cost=1) :
+		with self.lock :
+			now = time.monotonic()
+			wall = time.time()
+			wait = 0.0
+			if self.rate is not None :
+				self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+				self.updated = now
+				self.tokens -= cost
+				if self.tokens < 0 :
+					wait = -self.tokens / self.rate
+			if self.remaining is not None and self.reset_at is not None :
+				if wall >= self.reset_at : # the service's budget has reset since it last told us about it
+					self.remaining = self.reset_at = None
+				elif self.remaining - cost < self.margin : # we've used it all; everyone waits for the reset
+					self.blocked_until = max(self.blocked_until, self.reset_at)
+				else :
+					self.remaining -= cost
+			wait = max(wait, self.blocked_until - wall)
+			self.calls += 1
+			if wait > 0 :
+				self.waits += 1
+				self.waited += wait
+			return wait
+
+	# what the service told us about our budget: remaining calls/credits, and when it resets (a timestamp)
+	def update(self, remaining=None, reset_at=None) :
+		if remaining is None :
+			return
+		with self.lock :
+			self.remaining = float(remaining)
+			self.reset_at = float(reset_at) if reset_at is not None else None
+
+	# we got rate limited; don't make any more calls for seconds
+	def throttle(self, seconds) :
+		with self.lock :
+			self.blocked_until = max(self.blocked_until, time.time() + seconds)
+			self.throttles += 1
+
+	def usage(self) :
+		with self.lock :
+			wall = time.time()
+			tokens = None
+			if self.rate is not None :
+				tokens = min(self.burst, self.tokens + (time.monotonic() - self.updated) * self.rate)
+			return {
+				'rate' : self.rate,
+				'burst' : self.burst,
+				'tokens' : round(tokens, 2) if tokens is not None else None,
+				'remaining' : self.remaining,
+				'resets_in' : round(self.reset_at - wall, 1) if self.reset_at is not None else None,
+				'blocked_for' : round(max(0, self.blocked_until - wall), 1),
+				'calls' : self.calls,
+				'waits' : self.waits,
+				'waited' : round(self.waited, 3),
+				'throttles' : self.throttles,
+			}
+
+# what we know about each service's limits to start with, as (tokens per second, burst); see parseLimits
+defaults = {
+	'reddit' : (None, 1), # praw paces itself, and tells us what's left (see main.redditLimits)
+	'reddit.reply' : (None, 1), # posting has its own limit, which reddit only tells us about when we hit it
+	'twitter.get_status' : (900 / 900, 900), # 900 per 15 minutes
+	'twitter.statuses_lookup' : (900 / 900, 900),
+	'imgur' : (500 / 3600, 500), # 500 credits an hour (an upload costs 10)
+	'gfycat' : (1, 10),
+	'streamable' : (1, 10),
+}
+
+# parse a list of limits like "imgur=500/3600,gfycat=60/60" (name=calls/seconds, bursting up to calls)
+# into a dict of name -> (tokens per second, burst)
+def parseLimits(spec) :
+	limits = {}
+	for entry in spec.replace(' ', ',').split(',') :
+		if not entry :
+			continue
+		name, _, limit = entry.partition('=')
+		calls, _, seconds = limit.partition('/')
+		if calls.strip().lower() in ('', 'none') :
+			limits[name.strip()] = (None, 1)
+		else :
+			limits[name.strip()] = (float(calls) / float(seconds or 1), int(float(calls)))
+	return limits
+
+limits = dict(defaults, **parseLimits(os.getenv('RATE_LIMITS', '')))
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def limiter(name) :
+	with _limiters_lock :
+		if name not in _limiters :
+			rate, burst = limits.get(name, limits.get(name.split('.')[0], (None, 1)))
+			_limiters[name] = Limiter(name, rate, burst)
+		return _limiters[name]
+
+# wait our turn on every limiter in names, then make the call in the body of the with statement;
+# if the call gets rate limited, the limiters back off for as long as the service asks
+@contextlib.contextmanager
+def call(*names, cost=1) :
+	wait = max(limiter(name).reserve(cost) for name in names)
+	if wait > 0 :
+		metrics.observe('ratelimit_wait', wait, service=names[0])
+		time.sleep(wait)
+	try:
+		yield
+	except Exception as e:
+		seconds = retryAfter(e)
+		if seconds is not None :
+			metrics.count('rate_limited', service=names[0])
+			for name in names :
+				limiter(name).throttle(seconds)
+		raise
+
+def update(name, remaining=None, reset_at=None) :
+	limiter(name).update(remaining, reset_at)
+
+# twitter-style rate limit headers (x-rate-limit-remaining, x-rate-limit-reset)
+def updateFromHeaders(name, headers) :
+	if headers and 'x-rate-limit-remaining' in headers :
+		update(name, headers['x-rate-limit-remaining'], headers.get('x-rate-limit-reset'))
+
+# everything we know about every limiter we've used
+def usage() :
+	with _limiters_lock :
+		limiters = dict(_limiters)
+	return {name : limiter.usage() for name, limiter in sorted(limiters.items())}
+
+# if e means we've been rate limited, how many seconds to back off for (otherwise None)
+def retryAfter(e, default=60) :
+	response = getattr(e, 'response', None)
+	headers = getattr(response, 'headers', None) or {}
+	# reddit's limit on posting comes back as an error saying how long to wait, e.g. 'Take a break for 5 minutes'
+	for item in getattr(e, 'items', None) or [] :
+		if getattr(item, 'error_type', None) == 'RATELIMIT' :
+			wait = re.search(r'(\d+) (second|minute)', str(getattr(item, 'message', '')))
+			if wait is None :
+				return default
+			return int(wait.group(1)) * (60 if wait.group(2) == 'minute' else 1)
+	if getattr(response, 'status_code', None) == 429 or getattr(e, 'api_code', None) == 88 or 'ratelimit' in type(e).__name__.lower() :
+		try:
+			if 'retry-after' in headers :
+				return max(0, float(headers['retry-after']))
+			if 'x-rate-limit-reset' in headers :
+				return max(0, float(headers['x-rate-limit-reset']) - time.time())
+		except ValueError :
+			pass
+		return default
+	return None
@@ -0,0 +1,139 @@
+# Follow redirects on urls found in comments to see where they really go
+# (e.g. a bit.ly link that actually points to a tweet)
+#
+# Urls are resolved concurrently on a pool of threads; each HEAD request gets its own
+# timeout, measured from when it actually starts, so one slow link can't hold up the rest.
+# Given a stop function, redirects are followed one at a time, and only until they get somewhere
+# stop says is far enough (e.g. off the url shorteners), saving a request for wherever they end up.
+# If we're given a cache, urls we've resolved before (or failed to resolve recently)
+# are answered from it without going to the network at all.
+
+import concurrent.futures
+import collections
+import threading
+import time
+import urllib.parse
+import requests
+import metrics
+import sessions
+
+# resolved_url is where the url ended up (or the url itself if we couldn't find out);
+# error is None if everything went fine, otherwise a message saying what went wrong;
+# cached is True if we got the answer from the cache rather than the network
+Resolution = collections.namedtuple('Resolution', ['resolved_url', 'error', 'cached'], defaults=[False])
+
+# follow any redirects and return the url we end up at; if stop is given, we stop following them
+# as soon as we're redirected to a url that stop(url) is True for
+def resolveRedirects(url, timeout, stop=None) :
+	session = sessions.session()
+	if stop is None :
+		with metrics.timer('api', service='redirects', call='head') :
+			resp = session.head(url, allow_redirects=True, timeout=timeout) # follow any redirects
+		return resp.url # the redirected url
+	for _ in range(session.max_redirects) :
+		with metrics.timer('api', service='redirects', call='head') :
+			resp = session.head(url, allow_redirects=False, timeout=timeout)
+		if not resp.is_redirect :
+			return resp.url
+		url = urllib.parse.urljoin(resp.url, resp.headers['location'])
+		if stop(url) :
+			return url
+	raise requests.TooManyRedirects('Exceeded ' + str(session.max_redirects) + ' redirects')
+
+class RedirectResolver :
+	# max_workers is how many urls we'll resolve at the same time
+	# timeout is how many seconds each url gets before we give up on it
+	# cache (optional) is a cache.Cache mapping urls to the url they resolve to
+	# stop (optional) is a function saying whether a url is as far as we need to follow redirects
+	def __init__(self, max_workers=8, timeout=10, cache=None, stop=None) :
+		self.max_workers = max(1, max_workers)
+		self.timeout = timeout
+		self.cache = cache
+		self.stop = stop
+		self.executor = None
+
+	def start(self) :
+		if self.executor is None :
+			self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='redirects')
+		return self
+
+	def close(self) :
+		if self.executor is not None :
+			# don't wait around for any requests we've already given up on
+			self.executor.shutdown(wait=False, cancel_futures=True)
+			self.executor = None
+
+	def __enter__(self) :
+		return self.start()
+
+	def __exit__(self, *exc) :
+		self.close()
+
+	# resolve every url in urls, all at once, and return a dict mapping each url to its Resolution
+	def resolveAll(self, urls) :
+		urls = list(dict.fromkeys(urls)) # no need to resolve the same url twice
+		results = {}
+
+		# answer whatever we can from the cache
+		if self.cache is not None :
+			for url, entry in self.cache.lookupMany(urls).items() :
+				results[url] = Resolution(url if entry.error else entry.value, entry.error, True)
+			urls = [url for url in urls if url not in results]
+		if not urls :
+			return results
+
+		self.start()
+		started = {} # url -> time its request actually started
+		lock = threading.Lock()
+
+		def resolve(url) :
+			with lock :
+				started[url] = time.monotonic()
+			return resolveRedirects(url, self.timeout, self.stop)
+
+		futures = {self.executor.submit(resolve, url) : url for url in urls}
+		pending = set(futures)
+		while pending :
+			done, pending = concurrent.futures.wait(pending, timeout=self._nextDeadline(pending, futures, started, lock), return_when=concurrent.futures.FIRST_COMPLETED)
+			for future in done :
+				url = futures[future]
+				try :
+					results[url] = Resolution(future.result(), None)
+				except Exception as e : # usually a requests.exceptions.RequestException, but a bad url can throw just about anything
+					results[url] = Resolution(url, 'problem with redirect detection: ' + str(e))
+
+			# give up on anything that's been running for longer than the timeout
+			now = time.monotonic()
+			for future in list(pending) :
+				url = futures[future]
+				with lock :
+					start = started.get(url)
+				if start is not None and now - start >= self.timeout :
+					future.cancel() # won't actually stop a running request, but we'll stop waiting on it
+					pending.discard(future)
+					results[url] = Resolution(url, 'timed out')
+
+		for url in urls :
+			error = results[url].error
+			metrics.count('redirects', result='resolved' if error is None else 'timed out' if error == 'timed out' else 'failed')
+
+		if self.cache is not None :
+			for url in urls :
+				if results[url].error is None :
+					self.cache.put(url, results[url].resolved_url)
+				else :
+					self.cache.putFailure(url, results[url].error)
+
+		return results
+
+	# resolve a single url; returns its Resolution
+	def resolve(self, url) :
+		return self.resolveAll([url])[url]
+
+	# how long to wait before the next request could possibly time out
+	def _nextDeadline(self, pending, futures, started, lock) :
+		with lock :
+			starts = [started[futures[future]] for future in pending if futures[future] in started]
+		if not starts :
+			return self.timeout # nothing has started yet; wake up once one would have timed out
+		return max(0, min(starts) + self.timeout - time.monotonic())
@@ -0,0 +1,82 @@
+# Rendering our replies
+#
+# The tweet's text goes through one pass, a line at a time: t.co links are swapped for wherever they
+# really go, reddit markdown is escaped, lines are double spaced, and every line is quoted with "> ".
+# The rest of the reply (the header, the list of rehosted media and the footer) comes from templates.
+# The output is exactly what composeReply used to build with a string of re.sub() passes
+# (see bench/replies.py, which checks that against the old way of doing it).
+
+import re
+
+regex_tco = re.compile(r"\bhttps?:\/\/t\.co\/\w+\b") # t.co shortlinks in the text of a tweet
+
+header = "**[@{screen_name}](https://www.twitter.com/{screen_name})** ({name}):\n\n"
+media_header = "Rehosted Media:\n\n"
+media_item = "* {media}\n\n"
+separator = "&nbsp;\n\n" # between tweets, when one reply has several
+footer = (
+	"--------------------\n\n"
+	"^I ^am ^a ^bot ^powered ^by ^fricks ^and ^I ^like ^that"
+	" ^| [^(message&nbsp;me)](https://www.reddit.com/message/compose?to=FleetFlotTheTweetBot)"
+	" ^| [^(source&nbsp;code)](https://github.com/JohnMTorgerson/FleetFlotTheTweetBot)"
+	" ^| ^Skål!"
+)
+
+# escape a single line of text (with no newlines in it) so reddit shows it as it is
+def escapeLine(line) :
+	if line.startswith('#') : # a leading '#' would make it a heading
+		return '\\' + line
+	line = line.lstrip(' \t') # leading spaces/tabs would make it a code block
+	# a number at the start of the line followed by a '.' would make it a numbered list,
+	# and reddit always renumbers those to start at 1, so escape the '.' (only up to 3 digits, like '100.')
+	digits = 0
+	while digits < 4 and digits < len(line) and line[digits].isdecimal() :
+		digits += 1
+	if 1 <= digits <= 3 and line[digits:digits + 1] == '.' :
+		line = line[:digits] + '\\' + line[digits:]
+	return line
+
+# escape any reddit markdown in text, line by line, and double space it
+# (reddit needs two newlines to actually show a line break, but only between lines with something in them)
+def escape(text) :
+	return _join([escapeLine(line) for line in text.split('\n')], '')
+
+# the text of a tweet, ready to go in a reply: t.co links replaced using replace_link
+# (called with each match, like re.sub), escaped, double spaced, and quoted
+def quote(text, replace_link=None) :
+	lines = []
+	for line in text.split('\n') :
+		if replace_link is not None and 't.co/' in line :
+			line = regex_tco.sub(replace_link, line)
+			if '\n' in line : # (a replacement with a newline in it; unlikely, but it would start a new line)
+				lines.extend(escapeLine(part) for part in line.split('\n'))
+				continue
+		lines.append(escapeLine(line))
+	return _join(lines, '> ')
+
+# join escaped lines back up, with a blank line between any two lines that both have something in them,
+# and prefix every line (blank ones included) with prefix
+def _join(lines, prefix) :
+	parts = [prefix, lines[0]]
+	for previous, line in zip(lines, lines[1:]) :
+		if previous and line :
+			parts.append('\n' + prefix) # the blank line
+		parts.append('\n' + prefix)
+		parts.append(line)
+	return ''.join(parts)
+
+# one tweet's part of a reply: who tweeted it, what they said (already run through quote()), and any rehosted media
+def tweet(screen_name, name, quoted_text, media=()) :
+	parts = [header.format(screen_name=screen_name, name=name), quoted_text, "\n\n"]
+	if media :
+		parts.append(media_header)
+		parts.extend(media_item.format(media=item) for item in media)
+	return ''.join(parts)
+
+# the whole reply, for a single tweet
+def reply(screen_name, name, quoted_text, media=()) :
+	return tweet(screen_name, name, quoted_text, media) + footer
+
+# the whole reply, for any number of tweets (each one already run through tweet())
+def replyMany(tweets) :
+	return separator.join(tweets) + footer
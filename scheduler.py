@@ -0,0 +1,56 @@
+# Looking after several subreddits at once
+#
+# Each subreddit gets its own limit on how many of its newest threads we check. Rather than doing one
+# subreddit after another (so the last one only gets whatever time and API budget is left), the work is
+# interleaved by a stride scheduler: every subreddit gets turns in proportion to its weight (how busy it's
+# been lately), the busiest go first, and even the quietest gets a turn every so often.
+
+import collections
+
+# parse a list of subreddits like "minnesotavikings:25,nfl:10" (name:number of threads to check; the number
+# is optional, and defaults to default_limit) into an ordered dict of name -> limit
+def parseSubreddits(spec, default_limit) :
+	subreddits = collections.OrderedDict()
+	for entry in spec.replace(' ', ',').split(',') :
+		if not entry :
+			continue
+		name, _, limit = entry.partition(':')
+		name = name.strip()
+		if name.lower().startswith('r/') :
+			name = name[2:]
+		if not name :
+			raise ValueError('Missing subreddit name in ' + repr(spec))
+		subreddits[name] = int(limit) if limit else default_limit
+	return subreddits
+
+class FairScheduler :
+	def __init__(self) :
+		self.queues = collections.OrderedDict() # name -> deque of items
+		self.weights = {}
+		self.passes = {} # how far along each queue is; whoever's furthest behind goes next
+
+	# queue up items for name; weight is how big a share of the turns it gets (at least 1)
+	def add(self, name, items, weight=1) :
+		self.queues.setdefault(name, collections.deque()).extend(items)
+		self.weights[name] = max(1.0, float(weight))
+		self.passes.setdefault(name, min(self.passes.values(), default=0.0))
+
+	def __len__(self) :
+		return sum(len(queue) for queue in self.queues.values())
+
+	# take the next item; returns (name, item), or None if there's nothing left
+	def next(self) :
+		waiting = [name for name, queue in self.queues.items() if queue]
+		if not waiting :
+			return None
+		# furthest behind first; on a tie, the busier one
+		name = min(waiting, key=lambda name : (self.passes[name], -self.weights[name]))
+		self.passes[name] += 1.0 / self.weights[name]
+		return name, self.queues[name].popleft()
+
+	def __iter__(self) :
+		while True :
+			turn = self.next()
+			if turn is None :
+				return
+			yield turn
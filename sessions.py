@@ -0,0 +1,90 @@
+# Every HTTP request we make ourselves, over one shared pool of connections
+#
+# A new requests.Session (or a bare requests.get) for every request means a new TCP connection, and a new
+# TLS handshake, every single time. Instead, everything goes through session(): one requests.Session per
+# process, shared by every thread, which keeps its connections to each host open (keep-alive) and hands
+# them to the next request for the same host. Requests that don't say how long they'll wait get a default
+# timeout. Every request is counted per host, along with whether it got a connection that was already open,
+# so usage() (and the http_requests metric) shows how well the connections are being reused.
+#
+#   with sessions.session().get(url, stream=True, timeout=30) as response :
+#       ...
+
+import threading
+import urllib.parse
+import os
+import requests
+import requests.adapters
+import urllib3
+import metrics
+
+pool_hosts = int(os.getenv('HTTP_POOL_HOSTS', 32)) # how many hosts we keep connections open to
+pool_size = int(os.getenv('HTTP_POOL_SIZE', 16)) # how many connections we keep open to each host (at least as many as the threads using it at once)
+connect_timeout = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5)) # default seconds to wait to connect, for requests that don't give a timeout
+read_timeout = float(os.getenv('HTTP_READ_TIMEOUT', 30)) # default seconds to wait for a response
+max_redirects = 10
+
+_usage = {} # host -> [requests, requests on a connection that was already open]
+_usage_lock = threading.Lock()
+
+def _counted(host, reused) :
+	with _usage_lock :
+		usage = _usage.setdefault(host, [0, 0])
+		usage[0] += 1
+		usage[1] += reused
+	metrics.count('http_requests', host=host, connection='reused' if reused else 'new')
+
+# connection pools that count every request, by the host it's for (which, through a proxy, isn't the host we connect to)
+class _Counting :
+	def _make_request(self, conn, method, url, *args, **kwargs) :
+		_counted(urllib.parse.urlsplit(url).hostname or self.host, getattr(conn, 'sock', None) is not None)
+		return super()._make_request(conn, method, url, *args, **kwargs)
+
+class HTTPPool(_Counting, urllib3.HTTPConnectionPool) :
+	pass
+
+class HTTPSPool(_Counting, urllib3.HTTPSConnectionPool) :
+	pass
+
+pool_classes = {'http' : HTTPPool, 'https' : HTTPSPool}
+
+class Adapter(requests.adapters.HTTPAdapter) :
+	# timeout is what requests that don't give one of their own get, as (connect, read) seconds
+	def __init__(self, timeout=None, **kwargs) :
+		self.timeout = timeout
+		super().__init__(**kwargs)
+
+	def init_poolmanager(self, *args, **kwargs) :
+		super().init_poolmanager(*args, **kwargs)
+		self.poolmanager.pool_classes_by_scheme = pool_classes
+
+	def proxy_manager_for(self, proxy, **proxy_kwargs) :
+		manager = super().proxy_manager_for(proxy, **proxy_kwargs)
+		if isinstance(manager, urllib3.ProxyManager) : # (SOCKS proxies have pool classes of their own)
+			manager.pool_classes_by_scheme = pool_classes
+		return manager
+
+	def send(self, request, timeout=None, **kwargs) :
+		return super().send(request, timeout=self.timeout if timeout is None else timeout, **kwargs)
+
+_session = None
+_session_lock = threading.Lock()
+
+# the session every request goes through (made the first time we need it)
+def session() :
+	global _session
+	with _session_lock :
+		if _session is None :
+			new = requests.Session()
+			adapter = Adapter(timeout=(connect_timeout, read_timeout), pool_connections=pool_hosts, pool_maxsize=pool_size)
+			new.mount('http://', adapter)
+			new.mount('https://', adapter)
+			new.max_redirects = max_redirects
+			_session = new
+		return _session
+
+# how many requests we've made to each host, and how many of them reused a connection
+def usage() :
+	with _usage_lock :
+		hosts = {host : list(usage) for host, usage in _usage.items()}
+	return {host : {'requests' : made, 'reused' : reused, 'connections' : made - reused} for host, (made, reused) in sorted(hosts.items())}
@@ -0,0 +1,146 @@
+# Durable state the bot keeps between runs, in the same SQLite file as the caches
+
+import time
+import glob
+from cache import connect
+
+# Every submission (or comment) we've replied to
+#
+# The whole table is read into a set the first time it's needed, so checking
+# whether we've already replied to something doesn't touch the disk, let alone Reddit.
+# Unlike comment_log.log, nothing ever rotates out of it.
+#
+# When more than one process is replying from the same database, each one claims an id before
+# replying to it (see claim), so only one of them ever does; the in-memory set is only ever used
+# to skip things, never to decide that nobody else has replied.
+class RepliedStore :
+	# path is the SQLite database file
+	# legacy_log (optional) is the old comment log; if the table is brand new, any ids in it
+	# (and in its rotated backups) are imported, so we don't forget what we did before the store existed
+	def __init__(self, path, legacy_log=None) :
+		self.path = path
+		self.legacy_log = legacy_log
+		self._ids = None
+		self._taken_over = set() # ids we claimed after someone else's claim on them ran out (see tookOver)
+
+	def _load(self) :
+		if self._ids is None :
+			self._conn, self._lock = connect(self.path)
+			with self._lock :
+				self._conn.execute('CREATE TABLE IF NOT EXISTS replied (id TEXT PRIMARY KEY, replied REAL NOT NULL)')
+				self._conn.execute('CREATE TABLE IF NOT EXISTS replying (id TEXT PRIMARY KEY, worker TEXT NOT NULL, until REAL NOT NULL)')
+				self._ids = {row[0] for row in self._conn.execute('SELECT id FROM replied')}
+			if not self._ids and self.legacy_log is not None :
+				self._importLegacyLog()
+		return self._ids
+
+	def _importLegacyLog(self) :
+		ids = set()
+		for filename in glob.glob(glob.escape(self.legacy_log) + '*') : # comment_log.log, comment_log.log.1, ...
+			with open(filename) as log :
+				ids.update(line.strip() for line in log if line.strip())
+		self.addMany(ids)
+
+	def __contains__(self, id) :
+		return id in self._load()
+
+	def __len__(self) :
+		return len(self._load())
+
+	# record that we've replied to id
+	def add(self, id) :
+		self.addMany([id])
+
+	def addMany(self, ids) :
+		known = self._load()
+		new = [id for id in set(ids) if id not in known]
+		if not new :
+			return
+		now = time.time()
+		with self._lock :
+			self._conn.executemany('INSERT OR IGNORE INTO replied (id, replied) VALUES (?, ?)', [(id, now) for id in new])
+			self._conn.executemany('DELETE FROM replying WHERE id = ?', [(id,) for id in new])
+		known.update(new)
+
+	# claim the right to reply to id for the next seconds, on behalf of worker; returns False if we've already
+	# replied to it, or someone else has claimed it (and their claim hasn't run out). If a claim runs out
+	# without a reply being recorded, whoever claimed it probably died, and someone else can have a go
+	def claim(self, id, worker, seconds=600) :
+		known = self._load()
+		if id in known :
+			return False
+		now = time.time()
+		with self._lock :
+			self._conn.execute('BEGIN IMMEDIATE') # nobody else can claim anything until we're done
+			try:
+				if self._conn.execute('SELECT 1 FROM replied WHERE id = ?', (id,)).fetchone() is not None :
+					known.add(id) # someone else replied since we loaded the table
+					claimed = False
+				else :
+					row = self._conn.execute('SELECT worker, until FROM replying WHERE id = ?', (id,)).fetchone()
+					claimed = row is None or row[0] == worker or row[1] < now
+					if claimed and row is not None and row[0] != worker :
+						self._taken_over.add(id)
+					if claimed :
+						self._conn.execute('INSERT OR REPLACE INTO replying (id, worker, until) VALUES (?, ?, ?)', (id, worker, now + seconds))
+			except BaseException :
+				self._conn.execute('ROLLBACK')
+				raise
+			self._conn.execute('COMMIT')
+		return claimed
+
+	# True if, when we claimed id, we took it over from someone whose claim had run out; they may have
+	# died after replying but before recording it, so it's worth checking for a reply before making another
+	def tookOver(self, id) :
+		if id in self._taken_over :
+			self._taken_over.discard(id)
+			return True
+		return False
+
+	# give up our claim on id without having replied (e.g. posting failed), so it can be tried again
+	def unclaim(self, id, worker) :
+		self._load()
+		with self._lock :
+			self._conn.execute('DELETE FROM replying WHERE id = ? AND worker = ?', (id, worker))
+
+# Where we got to last time, so each run only has to look at what's new
+#
+# For each submission we remember how many comments it had and the timestamp of the newest
+# comment we scanned; if the comment count hasn't changed there's nothing new to look at,
+# and if it has, we only need to look at comments from that timestamp on.
+# There's also a little key/value table for anything else (e.g. the newest comment in each subreddit's comment feed).
+class Checkpoints :
+	def __init__(self, path) :
+		self.path = path
+		self._conn = None
+
+	def _db(self) :
+		if self._conn is None :
+			conn, lock = connect(self.path)
+			with lock :
+				conn.execute('CREATE TABLE IF NOT EXISTS checkpoints (id TEXT PRIMARY KEY, num_comments INTEGER NOT NULL, newest_comment REAL NOT NULL, updated REAL NOT NULL)')
+				conn.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)')
+			self._conn, self._lock = conn, lock
+		return self._conn
+
+	# return (num_comments, newest_comment) for submission id, or None if we've never finished scanning it
+	def get(self, id) :
+		db = self._db()
+		with self._lock :
+			return db.execute('SELECT num_comments, newest_comment FROM checkpoints WHERE id = ?', (id,)).fetchone()
+
+	def set(self, id, num_comments, newest_comment) :
+		db = self._db()
+		with self._lock :
+			db.execute('INSERT OR REPLACE INTO checkpoints (id, num_comments, newest_comment, updated) VALUES (?, ?, ?, ?)', (id, num_comments, newest_comment, time.time()))
+
+	def getState(self, key, default=None) :
+		db = self._db()
+		with self._lock :
+			row = db.execute('SELECT value FROM state WHERE key = ?', (key,)).fetchone()
+		return row[0] if row is not None else default
+
+	def setState(self, key, value) :
+		db = self._db()
+		with self._lock :
+			db.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', (key, value))
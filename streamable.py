@@ -0,0 +1,220 @@
+# Rehosting videos on Streamable
+#
+# Streamable takes a while to process a video after we ask it to import one, and we don't want
+# the whole bot to sit around waiting for it. So instead, each import is tracked as a job:
+# the reply goes out straight away with a placeholder link, a background thread keeps checking
+# on the job (less and less often the longer it takes), and once the video is ready (or has failed)
+# the bot edits its comment to swap the placeholder for the real links.
+# Jobs are kept in the SQLite database, so they survive the bot restarting. Once a job's comments have
+# been edited it's marked done, but kept for a while (keep_done), so that a reply that was still being
+# posted (say by another worker, sharing the job) can still be attached to it and edited.
+
+import threading
+import logging
+import collections
+import time
+import re
+import metrics
+import sessions
+import ratelimit
+from cache import connect
+
+# a job that's finished, one way or the other:
+# urls is a dict of {'desktop': ..., 'mobile': ...} (or None if it failed), error says why it failed,
+# and comment_ids are the comments we need to edit
+Job = collections.namedtuple('Job', ['shortcode', 'source_url', 'urls', 'error', 'comment_ids'])
+
+# what we put in the reply in place of a video that isn't ready yet
+def placeholder(shortcode) :
+	return 'Video: *still processing...* [[streamable]](https://streamable.com/' + shortcode + ')'
+regex_placeholder = re.compile(r"Video: \*still processing\.\.\.\* \[\[streamable\]\]\(https:\/\/streamable\.com\/(\w+)\)")
+
+# ask streamable to import the video at url; returns the shortcode of the new video
+def importVideo(api, url, auth, timeout=30) :
+	r = None
+	try:
+		with metrics.timer('api', service='streamable', call='import'), ratelimit.call('streamable') :
+			r = sessions.session().get(api + '/import', params={'url' : url}, auth=auth, timeout=timeout)
+		return r.json()['shortcode'] # get shortcode from streamable for uploaded video, which we'll then check on to see if it got uploaded
+	except Exception as e:
+		e.custom = 'Streamable account may have been suspended; response was: ' + str(r)
+		raise
+
+# check on a video we asked streamable to import; returns its status
+# (0 or 1 means still working on it, 2 means done, 3 means it failed)
+# and a dict with whichever of the desktop and mobile urls it has so far
+def checkVideo(api, shortcode, timeout=30) :
+	with metrics.timer('api', service='streamable', call='check'), ratelimit.call('streamable') :
+		response = sessions.session().get(api + '/videos/' + shortcode, timeout=timeout).json()
+	files = response.get('files') or {}
+	urls = {}
+	if 'mp4' in files and files['mp4'].get('url','') != '' : # we have a desktop url
+		urls['desktop'] = files['mp4']['url']
+	if 'mp4-mobile' in files and files['mp4-mobile'].get('url','') != '' : # we have a mobile url
+		urls['mobile'] = files['mp4-mobile']['url']
+	return response['status'], urls
+
+class VideoTracker :
+	# path is the SQLite database file; api is the base url of the streamable api; auth is our streamable login
+	# first_check is how many seconds after starting an import we first check on it; after that we wait
+	# longer each time, up to max_interval; after max_age seconds we take whatever we've got, or give up;
+	# keep_done is how many seconds (from when it started) we remember a job for, once it's done;
+	# logger is where to log anything that goes wrong in the background
+	def __init__(self, path, api, auth, first_check=5, max_interval=60, max_age=30*60, keep_done=24*60*60, logger=None) :
+		self.path = path
+		self.api = api
+		self.auth = auth
+		self.first_check = first_check
+		self.max_interval = max_interval
+		self.max_age = max_age
+		self.keep_done = keep_done
+		self.logger = logger or logging.getLogger(__name__)
+		self._conn = None
+		self._thread = None
+		self._stopping = threading.Event()
+		self._wake = threading.Event() # set whenever there's a new job, so the polling thread doesn't sleep through it
+
+	def _db(self) :
+		if self._conn is None :
+			conn, lock = connect(self.path)
+			with lock :
+				conn.execute('CREATE TABLE IF NOT EXISTS streamable_jobs (shortcode TEXT PRIMARY KEY, source_url TEXT NOT NULL, state TEXT NOT NULL, desktop TEXT, mobile TEXT, error TEXT, created REAL NOT NULL, next_check REAL NOT NULL, interval REAL NOT NULL)')
+				conn.execute('CREATE INDEX IF NOT EXISTS streamable_jobs_source ON streamable_jobs (source_url)')
+				conn.execute('CREATE TABLE IF NOT EXISTS streamable_edits (shortcode TEXT NOT NULL, comment_id TEXT NOT NULL, PRIMARY KEY (shortcode, comment_id))')
+			self._conn, self._lock = conn, lock
+		return self._conn
+
+	# start importing the video at url (unless we're already importing it for another reply, or it's finished
+	# but its comments haven't been edited yet), and return its shortcode
+	def startImport(self, url) :
+		db = self._db()
+		with self._lock :
+			row = db.execute("SELECT shortcode FROM streamable_jobs WHERE source_url = ? AND state != 'done'", (url,)).fetchone()
+		if row is not None :
+			return row[0]
+		shortcode = importVideo(self.api, url, self.auth)
+		now = time.time()
+		with self._lock :
+			db.execute("INSERT OR REPLACE INTO streamable_jobs (shortcode, source_url, state, created, next_check, interval) VALUES (?, ?, 'pending', ?, ?, ?)", (shortcode, url, now, now + self.first_check, self.first_check))
+		self._wake.set()
+		return shortcode
+
+	# once we've posted a comment, link it to any videos it has placeholders for, so we know to edit it later
+	# (if a job's already done, the comment still gets edited, the next time finished() is dealt with);
+	# returns the shortcodes of any jobs we've forgotten about, whose placeholders will never be replaced
+	def attach(self, comment_id, body) :
+		shortcodes = regex_placeholder.findall(body)
+		if not shortcodes :
+			return []
+		db = self._db()
+		missing = []
+		with self._lock :
+			for shortcode in shortcodes :
+				if db.execute('INSERT OR IGNORE INTO streamable_edits (shortcode, comment_id) SELECT shortcode, ? FROM streamable_jobs WHERE shortcode = ?', (comment_id, shortcode)).rowcount == 0 :
+					if db.execute('SELECT 1 FROM streamable_jobs WHERE shortcode = ?', (shortcode,)).fetchone() is None :
+						missing.append(shortcode)
+				else :
+					db.execute("UPDATE streamable_jobs SET next_check = ? WHERE shortcode = ? AND state = 'done'", (time.time(), shortcode)) # (no need to wait to edit a new one)
+		return missing
+
+	# check on every job that's due for a check; returns how many jobs are still pending
+	def poll(self) :
+		db = self._db()
+		now = time.time()
+		with self._lock :
+			due = db.execute("SELECT shortcode, created, interval FROM streamable_jobs WHERE state = 'pending' AND next_check <= ?", (now,)).fetchall()
+
+		for shortcode, created, interval in due :
+			if self._stopping.is_set() :
+				break
+			try:
+				status, urls = checkVideo(self.api, shortcode)
+			except Exception as e: # probably just a hiccup; try again later
+				self.logger.debug('Could not check on streamable video %s: %s', shortcode, str(e))
+				status, urls = None, {}
+			now = time.time()
+			if status == 3 :
+				self._finish(shortcode, None, 'Could not upload, returned status==3!')
+			elif status == 2 and 'desktop' in urls and 'mobile' in urls :
+				self._finish(shortcode, urls, None)
+			elif now - created > self.max_age : # we've waited long enough; take what we've got, if anything
+				if urls :
+					self._finish(shortcode, urls, None)
+				else :
+					self._finish(shortcode, None, 'Could not retrieve any URLs in time, so we gave up!')
+			else : # not ready yet; wait a bit longer before we check again
+				interval = min(interval * 1.5, self.max_interval)
+				with self._lock :
+					db.execute('UPDATE streamable_jobs SET next_check = ?, interval = ? WHERE shortcode = ?', (now + interval, interval, shortcode))
+
+		with self._lock :
+			return db.execute("SELECT COUNT(*) FROM streamable_jobs WHERE state = 'pending'").fetchone()[0]
+
+	def _finish(self, shortcode, urls, error) :
+		urls = urls or {}
+		with self._lock :
+			self._db().execute('UPDATE streamable_jobs SET state = ?, desktop = ?, mobile = ?, error = ? WHERE shortcode = ?', ('failed' if error else 'ready', urls.get('desktop'), urls.get('mobile'), error, shortcode))
+
+	# every job that's finished (but hasn't been dealt with yet), or is done but has comments to edit
+	# that came along since (or that we couldn't edit last time, once it's time to try them again)
+	def finished(self) :
+		db = self._db()
+		jobs = []
+		with self._lock :
+			rows = db.execute("SELECT shortcode, source_url, desktop, mobile, error FROM streamable_jobs WHERE state IN ('ready', 'failed') OR (state = 'done' AND next_check <= ? AND shortcode IN (SELECT shortcode FROM streamable_edits))", (time.time(),)).fetchall()
+			for shortcode, source_url, desktop, mobile, error in rows :
+				comment_ids = [row[0] for row in db.execute('SELECT comment_id FROM streamable_edits WHERE shortcode = ?', (shortcode,))]
+				urls = {key : url for key, url in (('desktop', desktop), ('mobile', mobile)) if url} if error is None else None
+				jobs.append(Job(shortcode, source_url, urls, error, comment_ids))
+		return jobs
+
+	# we've dealt with a finished job (edited comment_ids, of the comments it had); it's kept for a while
+	# in case any more comments come along, and any we couldn't edit are tried again in max_interval seconds;
+	# jobs that have been done for long enough are forgotten
+	def done(self, shortcode, comment_ids) :
+		db = self._db()
+		with self._lock :
+			db.executemany('DELETE FROM streamable_edits WHERE shortcode = ? AND comment_id = ?', [(shortcode, comment_id) for comment_id in comment_ids])
+			db.execute("UPDATE streamable_jobs SET state = 'done', next_check = ? WHERE shortcode = ?", (time.time() + self.max_interval, shortcode))
+			old = [row[0] for row in db.execute("SELECT shortcode FROM streamable_jobs WHERE state = 'done' AND created < ?", (time.time() - self.keep_done,))]
+			db.executemany('DELETE FROM streamable_edits WHERE shortcode = ?', [(old_shortcode,) for old_shortcode in old])
+			db.executemany('DELETE FROM streamable_jobs WHERE shortcode = ?', [(old_shortcode,) for old_shortcode in old])
+
+	def pending(self) :
+		db = self._db()
+		with self._lock :
+			return db.execute("SELECT COUNT(*) FROM streamable_jobs WHERE state = 'pending'").fetchone()[0]
+
+	# start checking on jobs in the background
+	def start(self) :
+		if self._thread is None :
+			self._stopping.clear()
+			self._thread = threading.Thread(target=self._run, name='streamable', daemon=True)
+			self._thread.start()
+		return self
+
+	def stop(self) :
+		if self._thread is not None :
+			self._stopping.set()
+			self._wake.set()
+			self._thread.join()
+			self._thread = None
+
+	def _run(self) :
+		while not self._stopping.is_set() :
+			try:
+				self.poll()
+			except Exception : # never let the polling thread die; we'll just try again
+				self.logger.exception('Could not check on streamable videos')
+			# sleep until the next job is due (or a new one comes in)
+			with self._lock :
+				row = self._db().execute("SELECT MIN(next_check) FROM streamable_jobs WHERE state = 'pending'").fetchone()
+			wait = self.max_interval if row[0] is None else max(0.1, row[0] - time.time())
+			self._wake.wait(wait)
+			self._wake.clear()
+
+	# wait (up to timeout seconds) for every pending job to finish
+	def wait(self, timeout) :
+		deadline = time.monotonic() + timeout
+		while self.pending() > 0 and time.monotonic() < deadline and not self._stopping.is_set() :
+			time.sleep(min(1, max(0, deadline - time.monotonic())))
@@ -0,0 +1,300 @@
+# Find urls in the body text of comments
+#
+# Urls are found with a purpose-built tokenizer (findURLs) that gives exactly the same results
+# as the big url regex in main.py (John Gruber's "liberal, accurate" pattern), but in linear time;
+# the regex itself is prone to catastrophic backtracking on unpredictable text.
+#
+# The regex is still here as a fallback (and for comparison; see bench/urls.py): to be able to cut
+# a runaway match off, it runs in long-lived worker processes rather than in the bot itself.
+# Each worker compiles the pattern once when it starts, and is then handed comment bodies
+# in batches; if a worker takes too long on any single body, we kill it, start a fresh one
+# in its place, and hand it whatever was left of its batch.
+
+import multiprocessing
+import multiprocessing.connection
+import collections
+import time
+import re
+import metrics
+import regex # the url pattern uses a possessive quantifier, which the 're' library doesn't support
+
+########-------- Tokenizer --------########
+
+# The regex is (?i)\b(PREFIX)(?:BODY+|PARENS)+(?:PARENS|END), where:
+#   PREFIX is either a scheme ([a-z][\w-]+: followed by 1-3 slashes or a letter, digit or %) or www\d{0,3}.
+#     (there's a third alternative, [a-z0-9.\-]++[.][a-z]{2,4}\/, but it can never match: the possessive ++
+#     swallows every '.', so there's never one left for [.])
+#   BODY is any character but whitespace, ( ) < or >
+#   PARENS is a pair of parentheses around any number of BODY characters and (non-empty) inner pairs,
+#     i.e. balanced, and at most two deep
+#   END is a BODY character that isn't punctuation that usually ends a sentence rather than a url
+# After the prefix, the text splits into a run of "units" (BODY characters and PARENS), up to the first
+# thing that's neither; the regex backtracks until it finds the last unit that's an END or PARENS
+# (with at least one unit before it), so that's where the url ends.
+
+# the classes the regex module uses, so the tokenizer agrees with it on every character (not just ascii);
+# each character is only ever looked up once
+def _characterClass(pattern) :
+	compiled = regex.compile(pattern)
+	known = {}
+	def test(char) :
+		try:
+			return known[char]
+		except KeyError:
+			known[char] = result = compiled.match(char) is not None
+			return result
+	return test
+
+_isWord = _characterClass(r'\w')
+_isDigit = _characterClass(r'\d')
+_isLetter = _characterClass(r'(?i)[a-z]')
+_isW = _characterClass(r'(?i)w')
+_isSchemeEnd = _characterClass(r'(?i)[a-z0-9%]')
+
+_whitespace = '\t\n\x0b\x0c\r \x85\xa0\u1680\u2000-\u200a\u2028\u2029\u202f\u205f\u3000' # exactly what the regex module counts as \s
+_body = re.compile('[^' + _whitespace + '()<>]+') # a run of BODY characters
+_trailing = set('`!{}[];:\'"*.,?«»“”‘’') # BODY characters that aren't END characters
+_anchors = re.compile('[:.]') # every prefix ends in one of these
+
+# where the parentheses starting at text[i] close (the index just after), or None if they aren't a PARENS
+def _parens(text, i) :
+	k = i + 1
+	while k < len(text) :
+		if text[k] == ')' :
+			return k + 1
+		if text[k] == '(' : # an inner pair, which has to have something in it
+			run = _body.match(text, k + 1)
+			if run is None or run.end() >= len(text) or text[run.end()] != ')' :
+				return None
+			k = run.end() + 1
+		else :
+			run = _body.match(text, k)
+			if run is None :
+				return None
+			k = run.end()
+	return None
+
+# where a url whose prefix ends at text[q] ends (the index just after), or None if it doesn't have a valid body
+def _bodyEnd(text, q) :
+	units = 0
+	end = None
+	i = q
+	while i < len(text) :
+		run = _body.match(text, i)
+		if run is not None :
+			j = run.end()
+			k = j
+			while k > i and text[k - 1] in _trailing : # the last END character in the run is just before k
+				k -= 1
+			if k > i and units + (k - i) >= 2 :
+				end = k
+			units += j - i
+			i = j
+		elif text[i] == '(' :
+			j = _parens(text, i)
+			if j is None :
+				break
+			units += 1
+			if units >= 2 :
+				end = j
+			i = j
+		else :
+			break
+	return end
+
+# every url in text, exactly as regex.findall(regex_url, text) would find them (well, the url in each match)
+def findURLs(text) :
+	urls = []
+	if ':' not in text and '.' not in text : # every url has one or the other, and most comments have neither
+		return urls
+	pos = 0 # where the last url ended; the next one can't start before this
+	for anchor in _anchors.finditer(text) :
+		b = anchor.start()
+		if b < pos :
+			continue
+		a = b # the start of the run of [\w-] that ends at the anchor (but not before pos)
+		while a > pos and (_isWord(text[a - 1]) or text[a - 1] == '-') :
+			a -= 1
+
+		start = end = None
+		if text[b] == ':' : # a scheme, like http:
+			for p in range(a, b - 1) :
+				if _isLetter(text[p]) and (p == 0 or not _isWord(text[p - 1])) :
+					start = p
+					break
+			if start is not None and b + 1 < len(text) :
+				if text[b + 1] == '/' :
+					slashes = 1
+					while slashes < 3 and b + 1 + slashes < len(text) and text[b + 1 + slashes] == '/' :
+						slashes += 1
+					for slashes in range(slashes, 0, -1) : # as many as we can, but fewer if that's what it takes
+						end = _bodyEnd(text, b + 1 + slashes)
+						if end is not None :
+							break
+				elif _isSchemeEnd(text[b + 1]) :
+					end = _bodyEnd(text, b + 2)
+		else : # www., www1. etc.
+			digits = 0
+			while digits < 4 and b - 1 - digits >= a and _isDigit(text[b - 1 - digits]) :
+				digits += 1
+			p = b - digits - 3
+			if digits <= 3 and p >= a and all(_isW(char) for char in text[p:p + 3]) and (p == 0 or not _isWord(text[p - 1])) :
+				start = p
+				end = _bodyEnd(text, b + 1)
+
+		if start is not None and end is not None :
+			urls.append(text[start:end])
+			pos = end
+	return urls
+
+########-------- Regex worker pool --------########
+
+# runs inside each worker process: compile the pattern once, then keep
+# matching whatever text we're sent until the pipe is closed
+def _work(pattern, conn) :
+	compiled = regex.compile(pattern)
+	while True :
+		try :
+			batch = conn.recv()
+		except EOFError :
+			break
+		if batch is None : # told to shut down
+			break
+		for text in batch :
+			conn.send([match.group(0) for match in compiled.finditer(text)]) # send back each result as soon as we have it, so the parent can time each one
+
+class _Worker :
+	def __init__(self, pattern) :
+		self.conn, child_conn = multiprocessing.Pipe()
+		self.process = multiprocessing.Process(target=_work, args=(pattern, child_conn), daemon=True)
+		self.process.start()
+		child_conn.close() # the child has its own copy now
+		self.pending = collections.deque() # indices (into the current batch) this worker still owes us a result for
+		self.deadline = None
+
+	def send(self, texts, indices, timeout) :
+		self.pending.extend(indices)
+		self.deadline = time.monotonic() + timeout
+		self.conn.send(texts)
+
+	def kill(self) :
+		self.process.terminate()
+		self.process.join()
+		self.conn.close()
+
+	def close(self) :
+		try :
+			self.conn.send(None)
+		except (BrokenPipeError, OSError) :
+			pass
+		self.process.join(1)
+		if self.process.is_alive() :
+			self.process.terminate()
+			self.process.join()
+		self.conn.close()
+
+class URLFinder :
+	# pattern is the url regex (as a string, so it can be handed to the workers)
+	# timeout is how many seconds a worker gets to match a single body of text
+	# num_workers is the size of the pool
+	# extractor is 'tokenizer' (findURLs, with the regex pool only as a fallback if it ever fails) or 'regex'
+	# (the tokenizer implements the url regex in main.py; with any other pattern, use 'regex')
+	def __init__(self, pattern, timeout=2, num_workers=1, extractor='tokenizer') :
+		if extractor not in ('tokenizer', 'regex') :
+			raise ValueError('extractor must be tokenizer or regex, not ' + repr(extractor))
+		self.pattern = pattern
+		self.timeout = timeout
+		self.num_workers = max(1, num_workers)
+		self.extractor = extractor
+		self.workers = []
+		self.timeouts = 0 # how many bodies of text we've had to give up on
+
+	def start(self) :
+		if self.extractor == 'regex' : # (otherwise we only start the workers if we ever need them)
+			self._spawn()
+		return self
+
+	def _spawn(self) :
+		while len(self.workers) < self.num_workers :
+			self.workers.append(_Worker(self.pattern))
+
+	def close(self) :
+		for worker in self.workers :
+			worker.close()
+		self.workers = []
+
+	def __enter__(self) :
+		return self.start()
+
+	def __exit__(self, *exc) :
+		self.close()
+
+	# find the urls in every string in texts, and return a list with a list of urls
+	# for each; if the regex took too long on one of the strings, its entry in the list will be None instead
+	def findall(self, texts) :
+		texts = list(texts)
+		if self.extractor == 'regex' :
+			return self._findallRegex(texts)
+
+		results = []
+		fallback = [] # anything the tokenizer chokes on (which it shouldn't), we hand to the regex instead
+		for n, text in enumerate(texts) :
+			try:
+				results.append(findURLs(text))
+			except Exception :
+				results.append(None)
+				fallback.append(n)
+		if fallback :
+			metrics.count('url_tokenizer_fallbacks', len(fallback))
+			for n, urls in zip(fallback, self._findallRegex([texts[n] for n in fallback])) :
+				results[n] = urls
+		return results
+
+	def _findallRegex(self, texts) :
+		results = [None] * len(texts)
+		if not texts :
+			return results
+		self._spawn()
+
+		# split the batch into one contiguous chunk per worker
+		chunk_size = -(-len(texts) // len(self.workers)) # ceiling division
+		busy = []
+		for n, worker in enumerate(self.workers) :
+			indices = range(n * chunk_size, min((n + 1) * chunk_size, len(texts)))
+			if len(indices) > 0 :
+				worker.send([texts[k] for k in indices], indices, self.timeout)
+				busy.append(worker)
+
+		while busy :
+			wait_for = max(0, min(worker.deadline for worker in busy) - time.monotonic())
+			ready = multiprocessing.connection.wait([worker.conn for worker in busy], timeout=wait_for)
+
+			for worker in list(busy) :
+				if worker.conn in ready :
+					try :
+						result = worker.conn.recv()
+					except EOFError : # the worker died on us; treat it like a timeout
+						result = None
+						worker.deadline = 0
+					else :
+						results[worker.pending.popleft()] = result
+						worker.deadline = time.monotonic() + self.timeout # the clock restarts for the next string
+
+				if worker.pending and worker.deadline <= time.monotonic() :
+					# this worker is stuck (or dead); give up on the string it's working on,
+					# replace it with a fresh worker, and give that one the rest of the chunk
+					self.timeouts += 1
+					metrics.count('url_regex_timeouts')
+					worker.pending.popleft() # its result stays None
+					remaining = list(worker.pending)
+					worker.kill()
+					replacement = _Worker(self.pattern)
+					self.workers[self.workers.index(worker)] = replacement
+					busy.remove(worker)
+					if remaining :
+						replacement.send([texts[k] for k in remaining], remaining, self.timeout)
+						busy.append(replacement)
+				elif not worker.pending :
+					busy.remove(worker)
+
+		return results
@@ -0,0 +1,119 @@
+# A work queue shared by several worker processes
+#
+# Work items live in the SQLite database, so any number of workers using the same file can split the
+# work between them. A worker leases an item, which makes it theirs until the lease runs out; when
+# they're done, they ack it (or release it, to be tried again later). If a worker dies part way
+# through, its lease just runs out and the item goes to whoever asks next, so nothing gets lost;
+# the flip side is that an item can occasionally be worked on twice, so anything that must only ever
+# happen once (like posting a reply) needs a claim of its own too (see RepliedStore.claim).
+#
+# An item can be added again once it's done, to do it again (e.g. check a thread for new comments),
+# and can be put off until later (e.g. look for new submissions again in a minute).
+
+import collections
+import contextlib
+import socket
+import time
+import os
+import metrics
+from cache import connect
+
+# a leased work item: key is unique (e.g. 'submission:abc123'), kind says what sort of work it is,
+# payload is whatever the worker needs to do it, and attempts counts how many times it's been leased
+Item = collections.namedtuple('Item', ['key', 'kind', 'payload', 'attempts'])
+
+# who we are, as far as leases go
+def workerName() :
+	return socket.gethostname() + ':' + str(os.getpid())
+
+class WorkQueue :
+	# path is the SQLite database file; lease is how many seconds a worker gets to finish an item
+	# before it's handed to someone else; worker is our name (see workerName)
+	def __init__(self, path, lease=600, worker=None) :
+		self.path = path
+		self.lease_seconds = lease
+		self.worker = worker or workerName()
+		self._conn = None
+
+	def _db(self) :
+		if self._conn is None :
+			conn, lock = connect(self.path)
+			with lock :
+				conn.execute('CREATE TABLE IF NOT EXISTS work (key TEXT PRIMARY KEY, kind TEXT NOT NULL, payload TEXT, state TEXT NOT NULL, due REAL NOT NULL, worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0, added REAL NOT NULL)')
+				conn.execute('CREATE INDEX IF NOT EXISTS work_due ON work (state, due)')
+			self._conn, self._lock = conn, lock
+		return self._conn
+
+	# other processes share the file, so anything that reads and then writes has to do it in one go
+	@contextlib.contextmanager
+	def _transaction(self) :
+		db = self._db()
+		with self._lock :
+			db.execute('BEGIN IMMEDIATE')
+			try:
+				yield db
+			except BaseException :
+				db.execute('ROLLBACK')
+				raise
+			db.execute('COMMIT')
+
+	# add an item to do (in delay seconds' time); if it's already waiting or being worked on, it's left alone,
+	# and if it's done, it's queued up again
+	def put(self, key, kind, payload=None, delay=0) :
+		now = time.time()
+		with self._transaction() as db :
+			row = db.execute('SELECT state FROM work WHERE key = ?', (key,)).fetchone()
+			if row is None :
+				db.execute('INSERT INTO work (key, kind, payload, state, due, added) VALUES (?, ?, ?, ?, ?, ?)', (key, kind, payload, 'queued', now + delay, now))
+			elif row[0] == 'done' :
+				db.execute('UPDATE work SET state = ?, kind = ?, payload = ?, due = ?, worker = NULL, lease_until = NULL, attempts = 0 WHERE key = ?', ('queued', kind, payload, now + delay, key))
+			else :
+				return False
+		metrics.count('work_items', kind=kind, event='queued')
+		return True
+
+	# take the next item that's due (or whose worker's lease has run out); returns an Item, or None if there's nothing to do
+	def lease(self) :
+		now = time.time()
+		with self._transaction() as db :
+			row = db.execute('SELECT key, kind, payload, attempts, state FROM work WHERE (state = ? AND due <= ?) OR (state = ? AND lease_until < ?) ORDER BY due LIMIT 1',
+				('queued', now, 'leased', now)).fetchone()
+			if row is None :
+				return None
+			key, kind, payload, attempts, state = row
+			db.execute('UPDATE work SET state = ?, worker = ?, lease_until = ?, attempts = attempts + 1 WHERE key = ?', ('leased', self.worker, now + self.lease_seconds, key))
+		metrics.count('work_items', kind=kind, event='expired' if state == 'leased' else 'leased')
+		return Item(key, kind, payload, attempts + 1)
+
+	# we're still working on item; give us another full lease
+	def extend(self, item) :
+		with self._transaction() as db :
+			return db.execute('UPDATE work SET lease_until = ? WHERE key = ? AND state = ? AND worker = ?', (time.time() + self.lease_seconds, item.key, 'leased', self.worker)).rowcount == 1
+
+	# we've finished item; if again is a number of seconds, it's queued up to be done again then
+	# returns False if our lease had run out and someone else has it now
+	def ack(self, item, again=None) :
+		with self._transaction() as db :
+			if again is None :
+				acked = db.execute('UPDATE work SET state = ?, worker = NULL, lease_until = NULL WHERE key = ? AND state = ? AND worker = ?', ('done', item.key, 'leased', self.worker)).rowcount == 1
+			else :
+				acked = db.execute('UPDATE work SET state = ?, due = ?, worker = NULL, lease_until = NULL, attempts = 0 WHERE key = ? AND state = ? AND worker = ?',
+					('queued', time.time() + again, item.key, 'leased', self.worker)).rowcount == 1
+		metrics.count('work_items', kind=item.kind, event='acked' if acked else 'lost')
+		return acked
+
+	# we couldn't finish item; let it be tried again in delay seconds
+	def release(self, item, delay=0) :
+		with self._transaction() as db :
+			released = db.execute('UPDATE work SET state = ?, due = ?, worker = NULL, lease_until = NULL WHERE key = ? AND state = ? AND worker = ?',
+				('queued', time.time() + delay, item.key, 'leased', self.worker)).rowcount == 1
+		metrics.count('work_items', kind=item.kind, event='released')
+		return released
+
+	# how many items are in each state, and which workers hold leases
+	def stats(self) :
+		db = self._db()
+		with self._lock :
+			states = dict(db.execute('SELECT state, COUNT(*) FROM work GROUP BY state').fetchall())
+			workers = dict(db.execute('SELECT worker, COUNT(*) FROM work WHERE state = ? AND lease_until >= ? GROUP BY worker', ('leased', time.time())).fetchall())
+		return {'states' : states, 'workers' : workers}